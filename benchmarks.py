@@ -0,0 +1,812 @@
+"""
+Benchmarks for the Euler tour tree.
+
+Run with:
+    python benchmarks.py
+or, for the link/cut/find_root suite across tree shapes and sizes,
+    python benchmarks.py --suite [--sizes 1000,10000] [--json results.json]
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from eulertourtree import Aggregate, AVL_tree, Compact_Euler_Tour_Tree, Dynamic_Connectivity, Euler_Tour_Tree, Forest, Offline_Connectivity, Persistent_AVL_tree, Splay_tree, Treap
+
+
+def build_random_tree(n, seed=0):
+    """
+    Build a random recursive tree on n vertices by linking one vertex at a time
+    """
+    rng = random.Random(seed)
+    root = Euler_Tour_Tree.Represented_Node(0)
+    euler = Euler_Tour_Tree(root)
+    nodes = [root]
+    for i in range(1, n):
+        node = Euler_Tour_Tree.Represented_Node(i)
+        euler.link(node, nodes[rng.randrange(len(nodes))])
+        nodes.append(node)
+    return euler, nodes
+
+
+def bench_link_cut(sizes=(1000, 10000, 100000), ops=2000, seed=0):
+    """
+    Time cutting a random non-root vertex and linking it back under its parent.
+    The per-operation latency should stay flat (logarithmic) as n grows.
+    """
+    rng = random.Random(seed)
+    results = []
+    for n in sizes:
+        euler, nodes = build_random_tree(n, seed)
+        start = time.perf_counter()
+        for _ in range(ops):
+            v = nodes[rng.randrange(1, n)]
+            p = v.get_parent()
+            euler.cut(v)
+            euler.link(v, p)
+        elapsed = time.perf_counter() - start
+        results.append((n, elapsed / (2 * ops)))
+    return results
+
+
+def bench_subtree_size(sizes=(1000, 10000, 100000), ops=20000, seed=0):
+    """
+    Time subtree_size queries on random vertices.
+    """
+    rng = random.Random(seed)
+    results = []
+    for n in sizes:
+        euler, nodes = build_random_tree(n, seed)
+        start = time.perf_counter()
+        for _ in range(ops):
+            euler.subtree_size(nodes[rng.randrange(n)])
+        elapsed = time.perf_counter() - start
+        results.append((n, elapsed / ops))
+    return results
+
+
+def bench_subtree_add(sizes=(1000, 10000, 100000), ops=2000, seed=0):
+    """
+    Time subtree_add against walking the children to bump every value in the
+    subtree. Vertices are picked skewed towards low ids, which head the larger
+    subtrees of a random recursive tree.
+    """
+    rng = random.Random(seed)
+    results = []
+    for n in sizes:
+        parents = [None] + [rng.randrange(i) for i in range(1, n)]
+        euler, nodes = Euler_Tour_Tree.from_parent_array(parents, vals=[0] * n, aggregate=Aggregate.SUM)
+        picks = [nodes[int(n * rng.random() ** 3)] for _ in range(ops)]
+        start = time.perf_counter()
+        for v in picks:
+            euler.subtree_add(v, 1)
+        lazy = time.perf_counter() - start
+        start = time.perf_counter()
+        for v in picks:
+            stack = [v]
+            while stack:
+                w = stack.pop()
+                w.val += 1
+                stack.extend(w.get_children())
+        walked = time.perf_counter() - start
+        results.append((n, lazy / ops, walked / ops))
+    return results
+
+
+def bench_is_ancestor(n=100000, ops=2000, seed=0):
+    """
+    is_ancestor against walking get_parent() up from v, on a caterpillar
+    whose spine is n/2 deep. Returns seconds per query for both.
+    """
+    rng = random.Random(seed)
+    euler, nodes = Euler_Tour_Tree.from_parent_array(caterpillar_parents(n, rng))
+    pairs = [(nodes[rng.randrange(n)], nodes[rng.randrange(n)]) for _ in range(ops)]
+    start = time.perf_counter()
+    for u, v in pairs:
+        euler.is_ancestor(u, v)
+    tour = time.perf_counter() - start
+    start = time.perf_counter()
+    for u, v in pairs:
+        w = v
+        while w and w is not u:
+            w = w.get_parent()
+    walked = time.perf_counter() - start
+    return tour / ops, walked / ops
+
+
+def bench_depth_lca(n=100000, ops=2000, seed=0):
+    """
+    depth and lca against walking get_parent() up from both ends, on a
+    caterpillar whose spine is n/2 deep. Returns seconds per depth+lca pair
+    for both.
+    """
+    rng = random.Random(seed)
+    euler, nodes = Euler_Tour_Tree.from_parent_array(caterpillar_parents(n, rng))
+    pairs = [(nodes[rng.randrange(n)], nodes[rng.randrange(n)]) for _ in range(ops)]
+    start = time.perf_counter()
+    for u, v in pairs:
+        euler.depth(v)
+        euler.lca(u, v)
+    tour = time.perf_counter() - start
+    start = time.perf_counter()
+    for u, v in pairs:
+        seen = set()
+        w = u
+        while w:
+            seen.add(w)
+            w = w.get_parent()
+        w = v
+        while w not in seen:
+            w = w.get_parent()
+    walked = time.perf_counter() - start
+    return tour / ops, walked / ops
+
+
+def bench_build(sizes=(1000, 10000, 100000), seed=0):
+    """
+    Compare building a random tree link by link with the bulk constructor.
+    """
+    rng = random.Random(seed)
+    results = []
+    for n in sizes:
+        parents = [None] + [rng.randrange(i) for i in range(1, n)]
+        start = time.perf_counter()
+        build_random_tree(n, seed)
+        linked = time.perf_counter() - start
+        start = time.perf_counter()
+        Euler_Tour_Tree.from_parent_array(parents)
+        bulk = time.perf_counter() - start
+        results.append((n, linked, bulk))
+    return results
+
+
+def bench_memory(n=100000, seed=0):
+    """
+    Bytes per vertex of a random tree in object form and in compact form,
+    as seen by tracemalloc.
+    """
+    rng = random.Random(seed)
+    parents = [None] + [rng.randrange(i) for i in range(1, n)]
+    results = []
+    for name, build in (("objects", Euler_Tour_Tree.from_parent_array),
+                        ("compact", Compact_Euler_Tour_Tree.from_parent_array)):
+        tracemalloc.start()
+        tree = build(parents)
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append((name, used / n))
+        del tree
+    return results
+
+
+def bench_star(n=100000, ops=2000, seed=0):
+    """
+    Cutting a leaf off a hub with n-1 children and linking it back, with
+    child containers and with children read off the tour. Returns
+    (name, seconds per cut+link, bytes per vertex) for both.
+    """
+    rng = random.Random(seed)
+    parents = [None] + [0] * (n - 1)
+    leaves = [rng.randrange(1, n) for _ in range(ops)]
+    results = []
+    for name, children in (("containers", True), ("from tour", False)):
+        tracemalloc.start()
+        euler, nodes = Euler_Tour_Tree.from_parent_array(parents, children=children)
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        start = time.perf_counter()
+        for leaf in leaves:
+            euler.cut(nodes[leaf])
+            euler.link(nodes[leaf], nodes[0])
+        results.append((name, (time.perf_counter() - start) / ops, used / n))
+    return results
+
+
+def bench_dynamic_connectivity(n=2000, m=6000, ops=2000, seed=0):
+    """
+    A random graph on n vertices and m edges under ops rounds of deleting
+    an edge, inserting a fresh one and asking whether two random vertices
+    are connected, with Dynamic_Connectivity and with a BFS per query.
+    Returns seconds per round for both.
+    """
+    rng = random.Random(seed)
+    edges = set()
+    while len(edges) < m:
+        u, v = rng.sample(range(n), 2)
+        edges.add((min(u, v), max(u, v)))
+    edges = list(edges)
+    graph = Dynamic_Connectivity()
+    adjacency = [set() for _ in range(n)]
+    for key in range(n):
+        graph.add_vertex(key)
+    for u, v in edges:
+        graph.insert_edge(u, v)
+        adjacency[u].add(v)
+        adjacency[v].add(u)
+
+    rounds = []
+    live = set(edges)
+    for _ in range(ops):
+        i = rng.randrange(len(edges))
+        old = edges[i]
+        while True:
+            u, v = rng.sample(range(n), 2)
+            new = (min(u, v), max(u, v))
+            if new not in live:
+                break
+        live.discard(old)
+        live.add(new)
+        edges[i] = new
+        rounds.append((old, new, rng.randrange(n), rng.randrange(n)))
+
+    start = time.perf_counter()
+    for old, new, u, v in rounds:
+        graph.delete_edge(*old)
+        graph.insert_edge(*new)
+        graph.connected(u, v)
+    dynamic = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for old, new, u, v in rounds:
+        adjacency[old[0]].discard(old[1])
+        adjacency[old[1]].discard(old[0])
+        adjacency[new[0]].add(new[1])
+        adjacency[new[1]].add(new[0])
+        seen = {u}
+        stack = [u]
+        while stack and v not in seen:
+            for w in adjacency[stack.pop()]:
+                if w not in seen:
+                    seen.add(w)
+                    stack.append(w)
+    searched = time.perf_counter() - start
+    return dynamic / ops, searched / ops
+
+
+def bench_find_root_many(n=100000, queries=1000000, seed=0):
+    """
+    Compact trees on a random forest of n vertices: find_root and connected
+    one call per query against find_root_many and connected_many over all
+    the queries. Returns seconds per query, (one by one, batched) for each.
+    """
+    rng = random.Random(seed)
+    parents = [None if i == 0 or rng.random() < 0.01 else rng.randrange(i) for i in range(n)]
+    compact = Compact_Euler_Tour_Tree.from_parent_array(parents)
+    us = [rng.randrange(n) for _ in range(queries)]
+    vs = [rng.randrange(n) for _ in range(queries)]
+    start = time.perf_counter()
+    for u in us:
+        compact.find_root(u)
+    single_roots = time.perf_counter() - start
+    start = time.perf_counter()
+    for u, v in zip(us, vs):
+        compact.connected(u, v)
+    single_connected = time.perf_counter() - start
+    us = numpy.array(us)
+    vs = numpy.array(vs)
+    start = time.perf_counter()
+    compact.find_root_many(us)
+    many_roots = time.perf_counter() - start
+    start = time.perf_counter()
+    compact.connected_many(us, vs)
+    many_connected = time.perf_counter() - start
+    return ((single_roots / queries, many_roots / queries),
+            (single_connected / queries, many_connected / queries))
+
+
+def forest_log(n, ops, seed=0):
+    """
+    A reproducible log of links, cuts and connected queries on a forest of
+    n vertices, about half of it queries
+    """
+    rng = random.Random(seed)
+    forest = Forest()
+    for key in range(n):
+        forest.add_vertex(key)
+    edges = []
+    log = []
+    for _ in range(ops):
+        r = rng.random()
+        u = rng.randrange(n)
+        v = rng.randrange(n)
+        if r < 0.3 and not forest.connected(u, v):
+            forest.link(u, v)
+            edges.append((u, v))
+            log.append(("link", u, v))
+        elif r < 0.5 and edges:
+            i = rng.randrange(len(edges))
+            edges[i], edges[-1] = edges[-1], edges[i]
+            u, v = edges.pop()
+            forest.cut(u, v)
+            log.append(("cut", u, v))
+        else:
+            log.append(("connected", u, v))
+    return log
+
+
+def bench_offline(n=10000, ops=100000, seed=0):
+    """
+    Replay a forest log online through Forest, answering the queries with
+    find_root, and offline through Offline_Connectivity. Returns
+    (seconds online, seconds offline); the answers are compared in the tests.
+    """
+    log = forest_log(n, ops, seed)
+    start = time.perf_counter()
+    forest = Forest()
+    for key in range(n):
+        forest.add_vertex(key)
+    online = []
+    for op, u, v in log:
+        if op == "link":
+            forest.link(u, v)
+        elif op == "cut":
+            forest.cut(u, v)
+        else:
+            online.append(forest.find_root(u) == forest.find_root(v))
+    online_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    Offline_Connectivity(log).answers()
+    offline_seconds = time.perf_counter() - start
+    return online_seconds, offline_seconds
+
+
+def bench_pool(n=10000, ops=100000, seed=0):
+    """
+    Move random subtrees around (a cut and a link each) with the node pool
+    on and off. Returns (name, seconds per move, tour nodes allocated per
+    move, young generation collections per 1000 moves) for both.
+    """
+    rng = random.Random(seed)
+    moves = [(rng.randrange(1, n), rng.randrange(n)) for _ in range(ops)]
+    results = []
+    for name, pooled in (("pooled", True), ("unpooled", False)):
+        euler, nodes = build_random_tree(n, seed)
+        if not pooled:
+            euler.avl.pool = None
+        stats = euler.instrument()
+        gc.collect()
+        collections = gc.get_stats()[0]["collections"]
+        start = time.perf_counter()
+        for v, w in moves:
+            v = nodes[v]
+            w = nodes[w]
+            euler.cut(v)
+            if w.find_avl_root() is v.find_avl_root():
+                w = nodes[0]
+            euler.link(v, w)
+        elapsed = time.perf_counter() - start
+        collections = gc.get_stats()[0]["collections"] - collections
+        euler.uninstrument()
+        results.append((name, elapsed / ops, stats.allocations / ops, collections * 1000 / ops))
+    return results
+
+
+def skewed_trace(n, ops, seed=0, skew=3):
+    """
+    A reproducible trace of (op, a, b) over vertices 0..n-1 where low vertex ids
+    are much hotter than high ones: "move" cuts a and relinks it under b,
+    "connected" and "size" are queries.
+    """
+    rng = random.Random(seed)
+    pick = lambda: int(n * rng.random() ** skew)
+    trace = []
+    for _ in range(ops):
+        r = rng.random()
+        op = "move" if r < 0.4 else "connected" if r < 0.7 else "size"
+        trace.append((op, pick(), pick()))
+    return trace
+
+
+def bench_backends(n=20000, ops=20000, seed=0):
+    """
+    Replay the same skewed trace against every sequence backend.
+    """
+    rng = random.Random(seed)
+    parents = [None] + [rng.randrange(i) for i in range(1, n)]
+    trace = skewed_trace(n, ops, seed)
+    results = []
+    for backend in (AVL_tree, Splay_tree, Treap):
+        euler, nodes = Euler_Tour_Tree.from_parent_array(parents, backend=backend)
+        avl = euler.avl
+        start = time.perf_counter()
+        for op, a, b in trace:
+            u = nodes[a]
+            v = nodes[b]
+            if op == "move":
+                if u.get_parent():
+                    euler.cut(u)
+                if not avl.same_tree(u.first_ptr, v.first_ptr):
+                    euler.link(u, v)
+            elif op == "connected":
+                avl.same_tree(u.first_ptr, v.first_ptr)
+            else:
+                euler.subtree_size(u)
+        elapsed = time.perf_counter() - start
+        results.append((backend.__name__, elapsed / ops))
+    return results
+
+
+def bench_batch(n=100000, batch=5000, seed=0):
+    """
+    Apply the same burst of cuts and links one at a time and through
+    apply_batch, on identical trees. Returns seconds per operation for both.
+    """
+    rng = random.Random(seed)
+    parents = [None] + [rng.randrange(i) for i in range(1, n)]
+    # cut vertices, each relinked under a vertex that stays attached to the root
+    moved = rng.sample(range(1, n), batch)
+    moved_set = set(moved)
+    anchors = [w for w in range(n) if w not in moved_set and not any(
+        a in moved_set for a in _ancestors(parents, w))]
+    targets = [rng.choice(anchors) for _ in moved]
+    results = []
+    for batched in (False, True):
+        euler, nodes = Euler_Tour_Tree.from_parent_array(parents)
+        ops = [("cut", nodes[v]) for v in moved] + [("link", nodes[v], nodes[w]) for v, w in zip(moved, targets)]
+        start = time.perf_counter()
+        if batched:
+            euler.apply_batch(ops)
+        else:
+            for op in ops:
+                if op[0] == "cut":
+                    euler.cut(op[1])
+                else:
+                    euler.link(op[1], op[2])
+        results.append(time.perf_counter() - start)
+    return [(n, batch, elapsed / (2 * batch)) for elapsed in results]
+
+
+def _ancestors(parents, w):
+    ancestors = []
+    while parents[w] is not None:
+        w = parents[w]
+        ancestors.append(w)
+    return ancestors
+
+
+def bench_instrumentation(n=100000, ops=5000, seed=0):
+    """
+    The same cut/link loop plain, with counters, and with counters and timing
+    callbacks. Returns seconds per operation for each, and the counters.
+    """
+    rng = random.Random(seed)
+    parents = [None] + [rng.randrange(i) for i in range(1, n)]
+    moves = [rng.randrange(1, n) for _ in range(ops)]
+    results = []
+    stats = None
+    for mode in ("off", "counters", "timing"):
+        euler, nodes = Euler_Tour_Tree.from_parent_array(parents)
+        if mode == "counters":
+            stats = euler.instrument()
+        elif mode == "timing":
+            euler.instrument(timing=lambda name, seconds: None)
+        start = time.perf_counter()
+        for v in moves:
+            v = nodes[v]
+            p = v.get_parent()
+            euler.cut(v)
+            euler.link(v, p)
+        results.append((mode, (time.perf_counter() - start) / (2 * ops)))
+    return results, stats.snapshot()
+
+
+def bench_persistent(n=100000, ops=5000, snapshot_every=100, seed=0):
+    """
+    The cut/link loop on the plain AVL backend, on the persistent one without
+    snapshots, and on the persistent one while keeping a snapshot taken every
+    snapshot_every operations alive. Returns seconds per operation for each,
+    the cost of snapshot() and the number of node states saved per operation.
+    """
+    rng = random.Random(seed)
+    parents = [None] + [rng.randrange(i) for i in range(1, n)]
+    moves = [rng.randrange(1, n) for _ in range(ops)]
+    results = []
+    snapshot_cost = 0.0
+    saved = 0
+    for name, backend, every in (("avl", AVL_tree, 0), ("persistent", Persistent_AVL_tree, 0),
+                                 ("snapshots", Persistent_AVL_tree, snapshot_every)):
+        euler, nodes = Euler_Tour_Tree.from_parent_array(parents, backend=backend)
+        snapshots = []
+        start = time.perf_counter()
+        for i, v in enumerate(moves):
+            if every and i % every == 0:
+                t0 = time.perf_counter()
+                snapshots.append(euler.snapshot())
+                snapshot_cost += time.perf_counter() - t0
+            v = nodes[v]
+            p = v.get_parent()
+            euler.cut(v)
+            euler.link(v, p)
+        results.append((name, (time.perf_counter() - start) / (2 * ops)))
+        if every:
+            saved = euler.avl.versions.entries
+            snapshot_cost /= len(snapshots)
+    return results, snapshot_cost, saved / (2.0 * ops)
+
+
+def bench_save_load(n=100000, seed=0):
+    """
+    Save a random tree, load it back, and compare with building it from its
+    parent array. Returns (file bytes per vertex, save s, load s, build s,
+    peak bytes per vertex traced while loading).
+    """
+    rng = random.Random(seed)
+    parents = [None] + [rng.randrange(i) for i in range(1, n)]
+    euler, nodes = Euler_Tour_Tree.from_parent_array(parents)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tree.ett")
+        start = time.perf_counter()
+        euler.save(path, nodes)
+        saved = time.perf_counter() - start
+        size = os.path.getsize(path)
+        del euler, nodes
+        start = time.perf_counter()
+        Euler_Tour_Tree.load(path)
+        loaded = time.perf_counter() - start
+        tracemalloc.start()
+        Euler_Tour_Tree.load(path)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    start = time.perf_counter()
+    Euler_Tour_Tree.from_parent_array(parents)
+    built = time.perf_counter() - start
+    return size / n, saved, loaded, built, peak / n
+
+
+def path_parents(n, rng):
+    return [None] + list(range(n - 1))
+
+
+def star_parents(n, rng):
+    return [None] + [0] * (n - 1)
+
+
+def random_parents(n, rng):
+    return [None] + [rng.randrange(i) for i in range(1, n)]
+
+
+def caterpillar_parents(n, rng):
+    """
+    A spine of about half the vertices, every other vertex a leaf hanging off a random spine vertex
+    """
+    spine = max(1, n // 2)
+    return [None] + list(range(spine - 1)) + [rng.randrange(spine) for _ in range(n - spine)]
+
+
+SHAPES = {
+    "path": path_parents,
+    "star": star_parents,
+    "random": random_parents,
+    "caterpillar": caterpillar_parents,
+}
+
+
+def percentile(ordered, q):
+    """
+    Nearest-rank q-th percentile of an already sorted list
+    """
+    if not ordered:
+        return 0.0
+    k = max(0, min(len(ordered) - 1, int(round(q / 100.0 * len(ordered))) - 1))
+    return ordered[k]
+
+
+def latency_summary(samples):
+    """
+    ops/sec and latency percentiles in microseconds of per-op samples in nanoseconds
+    """
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        "ops": len(ordered),
+        "ops_per_sec": len(ordered) / (total / 1e9) if total else 0.0,
+        "p50_us": percentile(ordered, 50) / 1e3,
+        "p90_us": percentile(ordered, 90) / 1e3,
+        "p99_us": percentile(ordered, 99) / 1e3,
+        "max_us": ordered[-1] / 1e3 if ordered else 0.0,
+    }
+
+
+def bench_shape(shape, n, ops=1000, seed=0):
+    """
+    Build a tree of the given shape on n vertices and time, one call at a time,
+    cutting a random non-root vertex, linking it back under its parent, and
+    find_root and find_avl_root on random vertices.
+    """
+    rng = random.Random(seed)
+    parents = SHAPES[shape](n, rng)
+    start = time.perf_counter()
+    euler, nodes = Euler_Tour_Tree.from_parent_array(parents)
+    build = time.perf_counter() - start
+
+    clock = time.perf_counter_ns
+    cut_samples = []
+    link_samples = []
+    root_samples = []
+    avl_root_samples = []
+    for _ in range(ops):
+        v = nodes[rng.randrange(1, n)] if n > 1 else None
+        if v is not None:
+            p = v.get_parent()
+            t0 = clock()
+            euler.cut(v)
+            t1 = clock()
+            euler.link(v, p)
+            t2 = clock()
+            cut_samples.append(t1 - t0)
+            link_samples.append(t2 - t1)
+        w = nodes[rng.randrange(n)]
+        t0 = clock()
+        w.find_root()
+        t1 = clock()
+        w.find_avl_root()
+        t2 = clock()
+        root_samples.append(t1 - t0)
+        avl_root_samples.append(t2 - t1)
+    return {
+        "shape": shape,
+        "n": n,
+        "seed": seed,
+        "build_s": build,
+        "cut": latency_summary(cut_samples),
+        "link": latency_summary(link_samples),
+        "find_root": latency_summary(root_samples),
+        "find_avl_root": latency_summary(avl_root_samples),
+    }
+
+
+def run_suite(shapes=tuple(SHAPES), sizes=(1000, 10000, 100000, 1000000), ops=1000, seed=0):
+    """
+    bench_shape over every shape and size, with the run's settings alongside
+    so that results from different runs can be compared
+    """
+    results = []
+    for n in sizes:
+        for shape in shapes:
+            results.append(bench_shape(shape, n, ops, seed))
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "seed": seed,
+        "ops": ops,
+        "results": results,
+    }
+
+
+def churn(n=1000, ops=100000, seed=0, check_every=10000):
+    """
+    Randomly move subtrees around: cut a random vertex and link it under a random
+    vertex outside its own subtree. Verifies the AVL height bound and the tour
+    every check_every operations, returns the number of operations checked.
+    """
+    rng = random.Random(seed)
+    euler, nodes = build_random_tree(n, seed)
+    for i in range(1, ops + 1):
+        v = nodes[rng.randrange(1, n)]
+        euler.cut(v)
+        w = nodes[rng.randrange(n)]
+        while w.find_avl_root() is v.find_avl_root():
+            w = nodes[rng.randrange(n)]
+        euler.link(v, w)
+        if i % check_every == 0:
+            euler.verify()
+    return ops
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--suite", action="store_true",
+                        help="run the link/cut/find_root suite across tree shapes and sizes")
+    parser.add_argument("--shapes", default=",".join(SHAPES),
+                        help="comma separated shapes for --suite (default: %(default)s)")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                        help="comma separated vertex counts for --suite (default: %(default)s)")
+    parser.add_argument("--ops", type=int, default=1000, help="operations per shape and size (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: %(default)s)")
+    parser.add_argument("--json", metavar="PATH", help="write the suite's results as JSON to PATH, - for stdout")
+    args = parser.parse_args(argv)
+    if args.suite:
+        return suite_main(args)
+
+    results = bench_link_cut()
+    size_results = bench_subtree_size()
+    add_results = bench_subtree_add()
+    ancestor_results = bench_is_ancestor()
+    lca_results = bench_depth_lca()
+    build_results = bench_build()
+    memory_results = bench_memory()
+    star_results = bench_star()
+    graph_results = bench_dynamic_connectivity()
+    offline_results = bench_offline()
+    pool_results = bench_pool()
+    many_results = bench_find_root_many() if numpy is not None else None
+    backend_results = bench_backends()
+    batch_results = bench_batch()
+    instrument_results = bench_instrumentation()
+    persistent_results = bench_persistent()
+    file_results = bench_save_load()
+    churned = churn()
+    for n, latency in results:
+        sys.stdout.write("n=%-8d link/cut: %8.2f us/op\n" % (n, latency * 1e6))
+    for n, latency in size_results:
+        sys.stdout.write("n=%-8d subtree_size: %8.2f us/op\n" % (n, latency * 1e6))
+    for n, lazy, walked in add_results:
+        sys.stdout.write("n=%-8d subtree_add: %8.2f us/op, walking children %8.2f us/op\n" % (n, lazy * 1e6, walked * 1e6))
+    sys.stdout.write("is_ancestor: %8.2f us/op, walking parents %8.2f us/op\n"
+                     % (ancestor_results[0] * 1e6, ancestor_results[1] * 1e6))
+    sys.stdout.write("depth+lca: %8.2f us/op, walking parents %8.2f us/op\n"
+                     % (lca_results[0] * 1e6, lca_results[1] * 1e6))
+    for n, linked, bulk in build_results:
+        sys.stdout.write("n=%-8d build: link by link %8.3f s, bulk %8.3f s\n" % (n, linked, bulk))
+    for name, per_vertex in memory_results:
+        sys.stdout.write("memory %s: %8.1f bytes/vertex\n" % (name, per_vertex))
+    sys.stdout.write("graph delete+insert+connected: %8.2f us/op, bfs %8.2f us/op\n"
+                     % (graph_results[0] * 1e6, graph_results[1] * 1e6))
+    sys.stdout.write("log replay: online %8.3f s, offline %8.3f s\n" % offline_results)
+    for name, latency, allocations, collections in pool_results:
+        sys.stdout.write("churn %-8s: %8.2f us/move, %5.2f nodes allocated/move, %6.2f gen0 collections/1000 moves\n"
+                         % (name, latency * 1e6, allocations, collections))
+    if many_results:
+        for name, (single, many) in zip(("find_root", "connected"), many_results):
+            sys.stdout.write("compact %s: %8.3f us/query one by one, %8.3f us/query batched\n"
+                             % (name, single * 1e6, many * 1e6))
+    for name, latency, per_vertex in star_results:
+        sys.stdout.write("star, children %-10s: cut+link %8.2f us/op, %8.1f bytes/vertex\n"
+                         % (name, latency * 1e6, per_vertex))
+    for name, latency in backend_results:
+        sys.stdout.write("backend %-10s: %8.2f us/op\n" % (name, latency * 1e6))
+    (n, batch, one), (_, _, batched) = batch_results
+    sys.stdout.write("n=%-8d batch of %d: one at a time %8.2f us/op, apply_batch %8.2f us/op\n"
+                     % (n, batch, one * 1e6, batched * 1e6))
+    timings, counters = instrument_results
+    for mode, latency in timings:
+        sys.stdout.write("instrumentation %-8s: %8.2f us/op\n" % (mode, latency * 1e6))
+    sys.stdout.write("counters: %s\n" % json.dumps(counters))
+    timings, snapshot_cost, saved = persistent_results
+    for name, latency in timings:
+        sys.stdout.write("persistent %-10s: %8.2f us/op\n" % (name, latency * 1e6))
+    sys.stdout.write("snapshot(): %8.2f us, %8.1f states saved per op\n" % (snapshot_cost * 1e6, saved))
+    sys.stdout.write("save/load: %.1f bytes/vertex on disk, save %.3f s, load %.3f s (build %.3f s), "
+                     "load peak %.1f bytes/vertex\n" % file_results)
+    sys.stdout.write("churn: %d random cut/link operations verified\n" % churned)
+
+
+def suite_main(args):
+    shapes = [shape for shape in args.shapes.split(",") if shape]
+    for shape in shapes:
+        if shape not in SHAPES:
+            raise SystemExit("unknown shape %r, expected one of %s" % (shape, ", ".join(SHAPES)))
+    sizes = [int(float(size)) for size in args.sizes.split(",") if size]
+    report = run_suite(shapes, sizes, args.ops, args.seed)
+
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    for result in report["results"]:
+        sys.stdout.write("%-11s n=%-8d build %8.3f s\n" % (result["shape"], result["n"], result["build_s"]))
+        for op in ("cut", "link", "find_root", "find_avl_root"):
+            summary = result[op]
+            sys.stdout.write("    %-13s %10.0f ops/s  p50 %8.2f  p90 %8.2f  p99 %8.2f  max %9.2f us\n"
+                             % (op, summary["ops_per_sec"], summary["p50_us"], summary["p90_us"],
+                                summary["p99_us"], summary["max_us"]))
+
+
+if __name__ == "__main__":
+    main()
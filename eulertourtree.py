@@ -1,20 +1,165 @@
+import argparse
+import bisect
+import contextlib
+import json
+import math
+import mmap
+import operator
+import random
+import struct
+import sys
+import threading
+import time
+import weakref
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Aggregate:
+    """
+    A monoid folded over the vertices of a subtree: an associative combine
+    function with its identity element. value maps a represented vertex to
+    the value fed into the fold (its val by default). shift(agg, delta, count)
+    is the aggregate after adding delta to the value of each of the count
+    vertices it covers; it is only needed for subtree_add.
+    """
+    def __init__(self, combine, identity, value=None, shift=None):
+        self.combine = combine
+        self.identity = identity
+        self.value = value if value else operator.attrgetter("val")
+        self.shift = shift
+
+Aggregate.SIZE = Aggregate(operator.add, 0, value=lambda vertex: 1, shift=lambda agg, delta, count: agg)
+Aggregate.SUM = Aggregate(operator.add, 0, shift=lambda agg, delta, count: agg + delta * count)
+Aggregate.MIN = Aggregate(min, math.inf, shift=lambda agg, delta, count: agg + delta)
+Aggregate.MAX = Aggregate(max, -math.inf, shift=lambda agg, delta, count: agg + delta)
+Aggregate.FLAGS = Aggregate(operator.or_, 0)
+
+
+class Stats:
+    """
+    Counters kept while a tree is instrumented, see Euler_Tour_Tree.instrument.
+    nodes_touched counts the nodes whose augmentation was recomputed and
+    max_height is the tallest tree seen: the AVL backend reads it off its
+    stored heights, the others off the deepest node walked up from.
+    allocations and reuses count the tour entries new_node made afresh and
+    took from the pool. operations holds [calls, seconds] per timed Euler_Tour_Tree method.
+    """
+    __slots__ = ("rotations", "splits", "concatenates", "nodes_touched", "max_height", "allocations", "reuses", "operations")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.rotations = 0
+        self.splits = 0
+        self.concatenates = 0
+        self.nodes_touched = 0
+        self.max_height = 0
+        self.allocations = 0
+        self.reuses = 0
+        self.operations = {}
+
+    def observe_height(self, height):
+        if height > self.max_height:
+            self.max_height = height
+
+    def record(self, name, seconds):
+        entry = self.operations.get(name)
+        if entry is None:
+            entry = self.operations[name] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def snapshot(self):
+        """
+        Plain dict copy of the counters, safe to hand to a metrics exporter
+        """
+        return {
+            "rotations": self.rotations,
+            "splits": self.splits,
+            "concatenates": self.concatenates,
+            "nodes_touched": self.nodes_touched,
+            "max_height": self.max_height,
+            "allocations": self.allocations,
+            "reuses": self.reuses,
+            "operations": {name: {"calls": calls, "seconds": seconds}
+                           for name, (calls, seconds) in self.operations.items()},
+        }
+
+
 class Euler_Tour_Tree:
     class Represented_Node:
-        def __init__(self, val, parent=None, children=[], first_ptr=None, last_ptr=None):
+        __slots__ = ("val", "parent", "children", "first_ptr", "last_ptr")
+
+        def __init__(self, val, parent=None, children=(), first_ptr=None, last_ptr=None):
+            """
+            children are kept as the keys of a dict of the vertex's own, so
+            adding, removing and counting them is O(1). children=None keeps no
+            container at all: the children are read off the tour when asked for.
+            """
             self.val = val
             self.parent = parent
-            self.children = children
+            self.children = None if children is None else dict.fromkeys(children)
             self.first_ptr = AVL_tree.AVL_node(0, represented=self) # First appearance of node in euler tour representation
             self.last_ptr = self.first_ptr                          # Last appearance of node in euler tour representation
 
         def get_val(self):
-            return self.val
+            """
+            Effective value: val plus the subtree_add deltas still pending
+            above the vertex's first appearance in the tour
+            """
+            val = self.val
+            ptr = self.first_ptr.parent
+            while ptr:
+                if ptr.lazy:
+                    val += ptr.lazy
+                ptr = ptr.parent
+            return val
 
         def get_parent(self):
             return self.parent
 
         def get_children(self):
-            return self.children
+            if self.children is None:
+                return list(self.tour_children())
+            return list(self.children)
+
+        def degree(self):
+            """
+            Number of children, O(1), or O(degree * log n) read off the tour
+            """
+            if self.children is None:
+                return sum(1 for _ in self.tour_children())
+            return len(self.children)
+
+        def tour_children(self):
+            """
+            Yield the children in the order the tour visits them, O(log n) each.
+            Each occurrence of the vertex but the last is followed by a
+            child's first appearance, and the child's last appearance by the
+            vertex's next occurrence.
+            """
+            ptr = self.first_ptr
+            while ptr is not self.last_ptr:
+                child = Euler_Tour_Tree.Represented_Node.next_entry(ptr).represented
+                yield child
+                ptr = Euler_Tour_Tree.Represented_Node.next_entry(child.last_ptr)
+
+        @staticmethod
+        def next_entry(ptr):
+            if ptr.right:
+                ptr = ptr.right
+                while ptr.left:
+                    ptr = ptr.left
+                return ptr
+            while ptr.parent and ptr.parent.right is ptr:
+                ptr = ptr.parent
+            return ptr.parent
 
         def get_first_ptr(self):
             return self.first_ptr
@@ -26,10 +171,12 @@ class Euler_Tour_Tree:
             self.parent = p
 
         def add_child(self, c):
-            self.children.append(c)
+            if self.children is not None:
+                self.children[c] = None
 
         def remove(self, c):
-            self.children.remove(c)
+            if self.children is not None:
+                del self.children[c]
     
         def find_root(self):
             """
@@ -51,680 +198,4086 @@ class Euler_Tour_Tree:
                 ptr = ptr.parent
             return ptr
 
-    def __init__(self, root):
-        self.root = root
-        self.avl = AVL_tree()
+    # public operations wrapped by instrument(timing=...)
+    TIMED = ("link", "cut", "reroot", "apply_batch", "set_val", "subtree_add", "subtree_size", "subtree_aggregate")
 
-    def cut(self, v):
+    def __init__(self, root, aggregate=None, backend=None):
         """
-        Cut v subtree from self
+        aggregate is an Aggregate maintained over every subtree of the tour,
+        see subtree_aggregate. Subtree sizes are always maintained.
+        backend is the Sequence_tree class holding the tour: AVL_tree (the
+        default), Splay_tree or Treap.
         """
-        # remove link in represented
-        v.parent.remove(v)
-        v.parent = None
-
-        # cut AVL tree
-        left_T, v_subtree = self.avl.cutting(v.first_ptr, v.last_ptr)        
-        return v_subtree
+        self.root = root
+        self.avl = (backend if backend else AVL_tree)(aggregate)
+        if root:
+            self.avl.adopt(root)
 
-    def link(self, u, v):
+    @classmethod
+    def from_parent_array(cls, parents, vals=None, aggregate=None, backend=None, children=True):
         """
-        Link u subtree to self as a child of v
+        Build the tree (or forest) where vertex i hangs off parents[i], with
+        None or a negative entry marking a root, in O(n).
+        The euler tour is produced by an iterative DFS and the AVL tree is
+        built perfectly balanced straight from it, without any splits or joins.
+        vals[i] is the value of vertex i (i by default). children=False
+        leaves the vertices without child containers, see Represented_Node.
+        Returns (tree, list of Represented_Node indexed by vertex), the tree
+        being rooted at the first root in the array.
+        Raises ValueError if a parent is out of range or the parents do not
+        form a forest, some vertices sitting on a cycle instead of below a root.
         """
-        self.avl.linking(u, v)
+        n = len(parents)
+        child_lists = [[] for _ in range(n)]
+        roots = []
+        for i, p in enumerate(parents):
+            if p is None or p < 0:
+                roots.append(i)
+            elif p >= n:
+                raise ValueError("parent %r of vertex %d is out of range" % (p, i))
+            else:
+                child_lists[p].append(i)
+        # every vertex must be reached from a root, the others sit on a cycle
+        reached = len(roots)
+        stack = list(roots)
+        while stack:
+            below = child_lists[stack.pop()]
+            reached += len(below)
+            stack.extend(below)
+        if reached < n:
+            raise ValueError("the parents have a cycle: %d of %d vertices are not below a root" % (n - reached, n))
+        # the tours are laid out from child_lists, so without children no container is ever made
+        nodes = [Euler_Tour_Tree.Represented_Node(vals[i] if vals is not None else i, children=None)
+                 for i in range(n)]
+        for i, p in enumerate(parents):
+            if children:
+                nodes[i].children = dict.fromkeys(nodes[c] for c in child_lists[i])
+            if not (p is None or p < 0):
+                nodes[i].parent = nodes[p]
 
-class AVL_tree:
-    #Inner node class
-    class AVL_node:
+        euler = cls(nodes[roots[0]] if roots else None, aggregate, backend)
+        for node in nodes:
+            euler.avl.adopt(node)
+        for r in roots:
+            euler.avl.build(euler.tour_sequence(nodes, child_lists, r))
+        return euler, nodes
+
+    @classmethod
+    def from_edges(cls, n, edges, root=0, vals=None, aggregate=None, backend=None):
         """
-        Node class to be used in the tree.
-        Each node has a balance factor attribute representing 
-        the longest downward path rooted at the node.
+        Build the tree (or forest) on vertices 0..n-1 with the given undirected
+        edges, rooted at root (and at the smallest vertex of every component
+        not containing root), in O(n). Returns the same as from_parent_array.
+        Raises ValueError if the edges are not a forest: a cycle, a self-loop
+        or a repeated edge.
         """
-        def __init__(self, data=None, left=None, right=None, balance=0, parent=None, height=0, represented=None):
-            self.data = data
-            self.left = left
-            self.right = right
-            self.parent = parent
-            self.height = height
-            self.represented = represented
-
-            #used to balance the tree: balance = height(left subtree) - height(right subtree)
-            #tree at node is balanced if the value is in [-1, 0, 1], else it is unbalanced
-            self.balance = balance 
-            return
+        edges = list(edges)
+        adjacency = [[] for _ in range(n)]
+        for u, v in edges:
+            adjacency[u].append(v)
+            adjacency[v].append(u)
+        parents = [None] * n
+        seen = [False] * n
+        tree_edges = 0
+        for r in [root] + list(range(n)):
+            if seen[r]:
+                continue
+            seen[r] = True
+            stack = [r]
+            while stack:
+                u = stack.pop()
+                for v in adjacency[u]:
+                    if not seen[v]:
+                        seen[v] = True
+                        parents[v] = u
+                        stack.append(v)
+                        tree_edges += 1
+        # the DFS keeps one edge per vertex reached, every other edge closes a cycle
+        if len(edges) > tree_edges:
+            raise ValueError("the edges are not a forest: %d of %d close a cycle or repeat an edge"
+                             % (len(edges) - tree_edges, len(edges)))
+        euler, nodes = cls.from_parent_array(parents, vals, aggregate, backend)
+        euler.root = nodes[root] if n else None
+        return euler, nodes
 
-    def __init__(self):
-        self._root = None
-        self._depth = None
-        self._max_chars = None
-        return
+    # file layout for save/load: a header, then int arrays padded to 8 bytes
+    #   tree_roots[trees]  AVL root of every tour, as a tour node index
+    #   represented[m]     vertex index of every tour node, tour after tour, in order
+    #   left[m], right[m]  AVL children of every tour node, -1 for none
+    # then the vertex values and, for a Forest, the vertex keys as columns
+    FILE_MAGIC = b"ETT1"
+    FILE_HEADER = struct.Struct("<4sBBBBqqqq")  # magic, index typecode, has keys, 2 spare, n, m, trees, root
 
-    def __str__(self):
+    def save(self, path, vertices=None, keys=None):
         """
-        Traverses and prints the binary tree in an organized and pretty way.
-        Uses a BFS (level-order) traversal.
+        Write every tree holding one of vertices (the vertices of self.root's
+        tree by default) to path. Values are stored as int64 or float64 when
+        they all are ints or floats, as JSON when they are a mix of None,
+        bools, ints, floats and strings, and anything else raises ValueError.
+        keys, if given, is a column of the same length stored alongside, see
+        Forest.save.
+        The tree is left as it is: values are written as get_val() reads them,
+        with pending subtree_add tags added in but not pushed down.
         """
-        self.synchronizeFields()
-        if (self._depth == 0):
-            return ""
-        s = ""
-        queue = []
-        level = 0
-        queue.append((1, self._root))
-        while len(queue):
-            nodelev, node = queue.pop(0)
-            if (not node):
-                if ((self._depth - nodelev + 1) <= 0):
-                    continue
-                if (nodelev != level):
-                    s += "\n"
-                    s += " "*int((self._max_chars)*(2**(self._depth - nodelev) - 1))
-                    level = nodelev
-                s += " "*(self._max_chars)*(2**(self._depth - nodelev + 1) - 1)
-                s += " "*self._max_chars
-                queue.append((nodelev + 1, None))
-                queue.append((nodelev + 1, None))
+        if vertices is None:
+            vertices = list(self.vertices_of(self.root)) if self.root else []
+        index = {vertex: i for i, vertex in enumerate(vertices)}
+
+        roots = []
+        tours = []
+        vals = {}
+        seen = set()
+        for vertex in vertices:
+            root = vertex.find_avl_root()
+            if root in seen:
                 continue
-            if (nodelev != level):
-                s += "\n"
-                s += " "*(self._max_chars)*(2**(self._depth - nodelev) - 1)
-                level = nodelev
-            for i in range(int(self._max_chars - len(str(node.represented.val)))):
-                s += "|"
-            s += str(node.represented.val) 
-            s += " "*(self._max_chars)*(2**(self._depth - nodelev + 1) - 1)
-            if node.left:
-                queue.append((nodelev + 1, node.left))
-            else:
-                queue.append((nodelev + 1, None))
-            if node.right:
-                queue.append((nodelev + 1, node.right))
-            else:
-                queue.append((nodelev + 1, None))
-        s += "\n"
-        return s
+            seen.add(root)
+            roots.append(root)
+            # in-order walk, carrying the sum of the tags above each node
+            stack = []
+            node = root
+            delta = 0
+            while stack or node:
+                while node:
+                    stack.append((node, delta))
+                    delta += node.lazy
+                    node = node.left
+                node, delta = stack.pop()
+                tours.append(node)
+                vertex = node.represented
+                if vertex is not None and vertex.first_ptr is node:
+                    vals[vertex] = vertex.val + delta if delta else vertex.val
+                delta += node.lazy
+                node = node.right
+
+        if any(node.represented not in index for node in tours):
+            raise ValueError("vertices must include every vertex of the trees they are in")
+        m = len(tours)
+        typecode = "i" if max(m, len(vertices)) < 2 ** 31 else "q"
+        position = {node: i for i, node in enumerate(tours)}
+        represented = array(typecode, (index[node.represented] for node in tours))
+        left = array(typecode, (position[node.left] if node.left else -1 for node in tours))
+        right = array(typecode, (position[node.right] if node.right else -1 for node in tours))
+        tree_roots = array(typecode, (position[root] for root in roots))
+        root = index.get(self.root, -1) if self.root else -1
+        # encoded before the file is opened, so a value that cannot be saved leaves no partial file
+        columns = [self.encode_column([vals[vertex] for vertex in vertices])]
+        if keys is not None:
+            columns.append(self.encode_column(keys))
 
-    def synchronizeFields(self):
+        with open(path, "wb") as f:
+            f.write(self.FILE_HEADER.pack(self.FILE_MAGIC, ord(typecode), keys is not None, 0, 0,
+                                          len(vertices), m, len(roots), root))
+            for column in (tree_roots, represented, left, right):
+                self.write_padded(f, column.tobytes())
+            for column_typecode, data in columns:
+                f.write(struct.pack("<c7xq", column_typecode.encode(), len(data)))
+                self.write_padded(f, data)
+
+    @staticmethod
+    def vertices_of(r):
         """
-        Calculates depth and max_chars of the tree
+        The vertices of r's tree, in euler tour order of first appearance
         """
-        if (not self.getRoot()):
-            self._depth = 0
-            self._max_chars = 1
-            return
-        self._depth = 0
-        self._max_chars = 1
-        Q = []
-        Q.append((self.getRoot(), 1, len(str(self.getRoot().data))))
-        while len(Q):
-            node, depth, chars = Q.pop(0)
-            self._depth = max(self._depth, depth)
-            self._max_chars = max(self._max_chars, chars)
-            if node.left:
-                Q.append((node.left, depth + 1, len(str(node.left.data))))
-            if node.right:
-                Q.append((node.right, depth + 1, len(str(node.right.data))))
-        return
+        node = r.find_avl_root()
+        stack = []
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            vertex = node.represented
+            if vertex.first_ptr is node:
+                yield vertex
+            node = node.right
 
-    def getRoot(self):
-        return self._root
+    @staticmethod
+    def write_padded(f, data):
+        f.write(data)
+        if len(data) % 8:
+            f.write(bytes(8 - len(data) % 8))
 
-    def setRoot(self, node):
-        self._root = node
+    @staticmethod
+    def encode_column(values):
+        """
+        (type code, data) of a column, written as a one byte type code, seven
+        spare bytes, a length and the data: int64 or float64 values as they
+        are, other plain values as a JSON list. Nothing is pickled, so
+        loading a file can never run code from it.
+        """
+        values = list(values)
+        if all(type(x) is int and -2 ** 63 <= x < 2 ** 63 for x in values):
+            typecode, data = "q", array("q", values).tobytes()
+        elif all(type(x) is float for x in values):
+            typecode, data = "d", array("d", values).tobytes()
+        else:
+            for x in values:
+                if x is not None and type(x) not in (bool, int, float, str):
+                    raise ValueError("cannot save %r, values and keys must be None, bool, int, float or str" % (x,))
+            typecode, data = "j", json.dumps(values).encode()
+        return typecode, data
 
-    def contains(self, data):
+    @staticmethod
+    def read_column(view, offset):
         """
-        External method used to search the tree for a data element.
+        (values, offset past the column) for a column made by encode_column
         """
-        return True if self.recursiveContains(data, self.getRoot()) else False
+        typecode, length = struct.unpack_from("<c7xq", view, offset)
+        offset += 16
+        data = view[offset:offset + length]
+        offset += length + (-length % 8)
+        if typecode == b"j":
+            return json.loads(bytes(data)), offset
+        if typecode not in (b"q", b"d"):
+            raise ValueError("unknown column type %r" % (typecode,))
+        return data.cast(typecode.decode()).tolist(), offset
 
-    def recursiveContains(self, data, node):
+    @classmethod
+    def load(cls, path, aggregate=None, backend=None):
         """
-        Internal method used to recursively search for data elements
+        Read a file written by save. The file is memory mapped and the tours
+        are wired straight from it: every tour node is created once and, on
+        an AVL backend, given its saved children; other backends build
+        their trees from the tour in O(n). No splits or joins happen.
+        Returns (tree, list of Represented_Node in the order they were saved).
         """
-        if not node:
-            return None
-        elif node.data == data:
-            return node
-        elif data > node.data:
-            return self.recursiveContains(data, node.right)
-        elif data < node.data:
-            return self.recursiveContains(data, node.right)
+        euler, vertices, _ = cls.read(path, aggregate, backend)
+        return euler, vertices
 
-    def insertList(self, l):
+    @classmethod
+    def read(cls, path, aggregate=None, backend=None):
         """
-        Builds the tree by inserting elements from a list in order.
+        load, also returning the saved keys column (None if there is none)
         """
-        if (l == None):
-            return
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
         try:
-            for ele in l:
-                self.insert(ele)
-        except TypeError:
-            return
-        return
+            magic, typecode, has_keys, _, _, n, m, trees, root = cls.FILE_HEADER.unpack_from(view, 0)
+            if magic != cls.FILE_MAGIC:
+                raise ValueError("%s is not an euler tour tree file" % (path,))
+            typecode = chr(typecode)
+            offset = cls.FILE_HEADER.size
+            columns = []
+            for length in (trees, m, m, m):
+                size = length * array(typecode).itemsize
+                columns.append(view[offset:offset + size].cast(typecode))
+                offset += size + (-size % 8)
+            tree_roots, represented, left, right = columns
+            vals, offset = cls.read_column(view, offset)
+            keys = None
+            if has_keys:
+                keys, offset = cls.read_column(view, offset)
 
-    def insert(self, data):
+            vertices = [Euler_Tour_Tree.Represented_Node(val) for val in vals]
+            euler = cls(vertices[root] if root >= 0 else None, aggregate, backend)
+            avl = euler.avl
+            for vertex in vertices:
+                avl.adopt(vertex)
+
+            # tour nodes: a vertex's first appearance reuses its own first_ptr
+            nodes = []
+            seen = [False] * n
+            for r in represented:
+                vertex = vertices[r]
+                if seen[r]:
+                    node = avl.new_node(vertex)
+                else:
+                    seen[r] = True
+                    node = vertex.first_ptr
+                vertex.last_ptr = node
+                nodes.append(node)
+
+            # represented tree: each step of a tour enters a child or returns to the parent
+            starts = sorted(cls.leftmost(tree_root, left) for tree_root in tree_roots)
+            starts.append(m)
+            for start, end in zip(starts, starts[1:]):
+                stack = [vertices[represented[start]]]
+                for i in range(start + 1, end):
+                    vertex = vertices[represented[i]]
+                    if len(stack) > 1 and vertex is stack[-2]:
+                        stack.pop()
+                        continue
+                    vertex.parent = stack[-1]
+                    stack[-1].add_child(vertex)
+                    stack.append(vertex)
+
+            if isinstance(avl, AVL_tree):
+                for i, node in enumerate(nodes):
+                    if left[i] >= 0:
+                        node.left = nodes[left[i]]
+                        node.left.parent = node
+                    if right[i] >= 0:
+                        node.right = nodes[right[i]]
+                        node.right.parent = node
+                # augmentation bottom up: children before parents
+                for tree_root in tree_roots:
+                    stack = [(nodes[tree_root], False)]
+                    while stack:
+                        node, done = stack.pop()
+                        if done:
+                            avl.update_node(node)
+                            continue
+                        stack.append((node, True))
+                        if node.left:
+                            stack.append((node.left, False))
+                        if node.right:
+                            stack.append((node.right, False))
+            else:
+                for start, end in zip(starts, starts[1:]):
+                    avl.build(nodes, start, end)
+            for column in columns:
+                column.release()
+        finally:
+            view.release()
+            mapped.close()
+        return euler, vertices, keys
+
+    @staticmethod
+    def leftmost(i, left):
+        while left[i] >= 0:
+            i = left[i]
+        return i
+
+    def tour_sequence(self, nodes, child_lists, r):
         """
-        This is the external insert method for the data structure.
-        Args:
-            data: a data object to be inserted into the tree
+        Lay out a fresh euler tour of the tree under nodes[r], where
+        child_lists[i] holds the indices of nodes[i]'s children, with an
+        iterative DFS, reusing each vertex's own first_ptr for its first
+        appearance and pointing last_ptr at its last one. Returns the list of
+        AVL nodes.
         """
-        if (data == None):
-            return 
-        if (not self.getRoot()):
-            self.setRoot(AVL_tree.AVL_node(data=data))
-            return
-        else:
-            self._done = 0
-            self.recursiveInsert(self.getRoot(), data)
-            delattr(self, "_done")
-            return
+        tour = [nodes[r].first_ptr]
+        stack = [(r, iter(child_lists[r]))]
+        while stack:
+            i, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                nodes[i].last_ptr = tour[-1]
+                if stack:
+                    tour.append(self.avl.new_node(nodes[stack[-1][0]]))
+                continue
+            tour.append(nodes[child].first_ptr)
+            stack.append((child, iter(child_lists[child])))
+        return tour
 
-    def recursiveInsert(self, node, data):
+    def cut(self, v):
         """
-        This is an internal method used to insert data elements 
-        recursively into the tree.
+        Cut v subtree from self. Raises ValueError if v is a root.
         """
+        if not v.parent:
+            raise ValueError("v is the root of its tree, there is nothing to cut")
+        # remove link in represented
+        v.parent.remove(v)
+        v.parent = None
 
-        #no duplicates in the tree
-        if (data == node.data):
-            return
+        # cut AVL tree, returns the root of v's tour
+        _, v_tour = self.avl.cutting(v.first_ptr, v.last_ptr)
+        return v_tour
 
-        if data < node.data:
-            if node.left:
-                self.recursiveInsert(node.left, data)
-            else:
-                node.left = AVL_tree.AVL_node(data=data, parent=node)
-                self.updateBalance(node.left)
-        else:
-            if node.right:
-                self.recursiveInsert(node.right, data)
-            else:
-                node.right = AVL_tree.AVL_node(data=data, parent=node)
-                self.updateBalance(node.right)
-        return
+    def link(self, u, v):
+        """
+        Link u subtree to self as a child of v. Raises ValueError if u and v
+        are already in the same tree.
+        If u is not the root of its own tree, its tree is rerooted at u first,
+        which costs O(d log n) for u at depth d, see reroot.
+        """
+        if self.avl.same_tree(u.first_ptr, v.first_ptr):
+            raise ValueError("u and v are already in the same tree")
+        if u.parent:
+            self.reroot(u)
+        elif u.first_ptr is u.last_ptr:
+            # u has never been linked, make sure it carries this backend's node and augmentation
+            self.avl.adopt(u)
+        if v.first_ptr is v.last_ptr and not v.parent:
+            self.avl.adopt(v)
+        self.avl.linking(u, v)
 
-    def updateBalance(self, node):
+    def reroot(self, v):
         """
-        Balances the tree starting with a newly inserted node (node)
+        Make v the root of its tree, O(d log n) for v at depth d.
+        Rotating the tour to start at v's first appearance takes a constant
+        number of splits and joins, O(log n), but every vertex on the path
+        from v to the old root then has its parent/children links reversed
+        and its occurrence pointers moved, each move a successor walk and a
+        refresh up to the AVL root, O(log n) per vertex on that path. Forest
+        keeps unrooted tours with no such pointers and reroots in O(log n).
         """
-        if (node.balance > 1 or node.balance < -1):
-            self.rebalance(node)
+        if not v.parent:
             return
-        if node.parent:
-            if node.parent.left is node: #lchild
-                if node.parent.balance >= 0:
-                    node.parent.height += 1
-                node.parent.balance += 1
-            elif node.parent.right is node: #rchild
-                if node.parent.balance <= 0:
-                    node.parent.height += 1
-                node.parent.balance -= 1
+        path = [v]
+        while path[-1].parent:
+            path.append(path[-1].parent)
 
-            #recurses to the parent
-            if node.parent.balance != 0:
-                self.updateBalance(node.parent)
+        self.avl.rerooting(path)
 
-    def rotateLeft(self, node):
+        # reverse the parent links along the path
+        for i in range(len(path) - 1, 0, -1):
+            w = path[i]
+            c = path[i - 1]
+            w.remove(c)
+            c.add_child(w)
+            w.set_parent(c)
+        v.set_parent(None)
+        if self.root is path[-1]:
+            self.root = v
+
+    class Batch:
         """
-        Performs a left rotation.
+        Plans a run of links and cuts against the tours as they were when the
+        run started. While planning, a tour is a linked list of pieces, each a
+        range of ranks of an untouched original tour or a single node created
+        by the run, and every operation only splits and relinks pieces. finish()
+        then splits every original tour at all its piece boundaries in one
+        pass and joins each final list of pieces in a balanced way.
         """
-        print("rotating left around: " + str(node.represented.val))
-        newRootNode = node.right
-        node.right = newRootNode.left
-        if (newRootNode.left):
-            newRootNode.left.parent = node
-        newRootNode.parent = node.parent
-        if node is self.getRoot():
-            self.setRoot(newRootNode)
-        else:
-            if node.parent.left is node:
-                node.parent.left = newRootNode
-                
-            else:
-                node.parent.right = newRootNode
-            # change parent height 
-            #node.parent.height -= 1
-            parent_left_height = node.parent.left.height if node.parent.left else -1
-            parent_right_height = node.parent.right.height if node.parent.right else -1
-            node.parent.height = max(parent_left_height, parent_right_height) + 1
+        class Piece:
+            __slots__ = ("tour", "lo", "hi", "node", "root", "prev", "next", "dropped")
 
-        newRootNode.left = node
-        node.parent = newRootNode
-        node.balance = node.balance + 1 - min(newRootNode.balance, 0)
-        newRootNode.balance = newRootNode.balance + 1 + max(node.balance, 0)
+            def __init__(self, tour, lo, hi, node=None):
+                self.tour = tour
+                self.lo = lo
+                self.hi = hi
+                self.node = node
+                self.root = node
+                self.prev = None
+                self.next = None
+                self.dropped = False
 
-        # Update height
-        node_left_height = node.left.height if node.left else -1
-        node_right_height = node.right.height if node.right else -1
-        node.height = max(node_left_height, node_right_height) + 1
+        def __init__(self, euler):
+            self.euler = euler
+            self.avl = euler.avl
+            self.starts = {}   # original root -> sorted start ranks of its pieces
+            self.pieces = {}   # original root -> its pieces, in the same order
+            self.fresh = {}    # node created by this run -> its piece
+            self.dropped = []  # original nodes removed by cuts
+            self.size = 0
 
-        newRoot_right_height = newRootNode.right.height if newRootNode.right else -1
-        newRoot_left_height = newRootNode.left.height if newRootNode.left else -1
-        newRootNode.height = max(newRoot_left_height, newRoot_right_height) + 1
+        def root_and_rank(self, x):
+            r = x.left.size if x.left else 0
+            while x.parent:
+                if x.parent.right is x:
+                    r += 1 + (x.parent.left.size if x.parent.left else 0)
+                x = x.parent
+            return x, r
 
-        # Verify balances match height differences
-        assert node_left_height - node_right_height == node.balance
-        #print("node: ", node.data, ", newRoot: ", newRootNode.data)
-        #print(newRoot_left_height, " - ", newRoot_right_height, " = ", newRootNode.balance)
-        assert newRoot_left_height - newRoot_right_height == newRootNode.balance
+        def piece_of(self, x):
+            """
+            (piece holding x, rank of x in its original tour or None for new nodes)
+            """
+            if x in self.fresh:
+                return self.fresh[x], None
+            root, r = self.root_and_rank(x)
+            starts = self.starts.get(root)
+            if starts is None:
+                piece = Euler_Tour_Tree.Batch.Piece(root, 0, root.size - 1)
+                self.starts[root] = [0]
+                self.pieces[root] = [piece]
+                return piece, r
+            return self.pieces[root][bisect.bisect_right(starts, r) - 1], r
 
-    def rotateRight(self, node):
-        """
-        Performs a right rotation.
-        """
-        print("rotating right around: " + str(node.represented.val))
-        newRootNode = node.left
-        node.left = newRootNode.right
-        if (newRootNode.right):
-            newRootNode.right.parent = node
-        newRootNode.parent = node.parent
-        if node is self.getRoot():
-            self.setRoot(newRootNode)
-        else:
-            if node.parent.right is node:
-                node.parent.right = newRootNode
+        def divide(self, piece, r):
+            """
+            Split piece in front of rank r, returns the new second half
+            """
+            second = Euler_Tour_Tree.Batch.Piece(piece.tour, r, piece.hi)
+            piece.hi = r - 1
+            starts = self.starts[piece.tour]
+            i = bisect.bisect_left(starts, r)
+            starts.insert(i, r)
+            self.pieces[piece.tour].insert(i, second)
+            second.next = piece.next
+            if second.next:
+                second.next.prev = second
+            piece.next = second
+            second.prev = piece
+            return second
+
+        def cut_before(self, x):
+            piece, r = self.piece_of(x)
+            if r is None or r == piece.lo:
+                return piece
+            return self.divide(piece, r)
+
+        def cut_after(self, x):
+            piece, r = self.piece_of(x)
+            if r is not None and r != piece.hi:
+                self.divide(piece, r + 1)
+            return piece
+
+        # plain walks: the tours must keep their shape until finish()
+        def first_node(self, piece):
+            return piece.node if piece.node else Sequence_tree.select(self.avl, piece.tour, piece.lo)
+
+        def last_node(self, piece):
+            return piece.node if piece.node else Sequence_tree.select(self.avl, piece.tour, piece.hi)
+
+        def cut(self, v):
+            start = self.cut_before(v.first_ptr)
+            end = self.cut_after(v.last_ptr)
+
+            # isolate the parent's occurrence right after the subtree and drop it
+            p_after = self.first_node(end.next)
+            after = self.cut_after(p_after)
+            before = start.prev
+            p_before = self.last_node(before)
+            before.next = after.next
+            if after.next:
+                after.next.prev = before
+            start.prev = None
+            end.next = None
+            after.prev = after.next = None
+            after.dropped = True
+
+            p = p_after.represented
+            if p.last_ptr is p_after:
+                p.last_ptr = p_before
+            if p_after in self.fresh:
+                # made by this run and never joined into a tour, so free right away;
+                # a later link may take it again, replacing its entry in fresh
+                self.avl.release(p_after)
             else:
-                node.parent.left = newRootNode
-            # change parent height 
-            parent_left_height = node.parent.left.height if node.parent.left else -1
-            parent_right_height = node.parent.right.height if node.parent.right else -1
-            node.parent.height = max(parent_left_height, parent_right_height) + 1
+                # still inside its original tour until finish() splits it out
+                self.dropped.append(p_after)
 
-        newRootNode.right = node
-        node.parent = newRootNode
-        node.balance = node.balance - 1 - max(newRootNode.balance, 0)
-        newRootNode.balance = newRootNode.balance - 1 + min(node.balance, 0)
-  
-        # Update height
-        node_left_height = node.left.height if node.left else -1
-        node_right_height = node.right.height if node.right else -1
-        node.height = max(node_left_height, node_right_height) + 1
+            v.parent.remove(v)
+            v.parent = None
+            self.size += 1
 
-        newRoot_right_height = newRootNode.right.height if newRootNode.right else -1
-        newRoot_left_height = newRootNode.left.height if newRootNode.left else -1
-        newRootNode.height = max(newRoot_left_height, newRoot_right_height) + 1
+        def link(self, u, v):
+            head = self.cut_before(u.first_ptr)
+            tail = self.cut_after(u.last_ptr)
+            before = self.cut_after(v.last_ptr)
+            after = before.next
 
-        # Verify balances match height differences
-        assert node_left_height - node_right_height == node.balance
-        #print("node: ", node.data, ", newRoot: ", newRootNode.data)
-        #print(newRoot_left_height, " - ", newRoot_right_height, " = ", newRootNode.balance)
-        assert newRoot_left_height - newRoot_right_height == newRootNode.balance
+            v_ptr = self.avl.new_node(v)
+            piece = Euler_Tour_Tree.Batch.Piece(None, 0, 0, v_ptr)
+            self.fresh[v_ptr] = piece
+            before.next = head
+            head.prev = before
+            tail.next = piece
+            piece.prev = tail
+            piece.next = after
+            if after:
+                after.prev = piece
+            v.last_ptr = v_ptr
 
-    def rebalance(self, node):
+            v.add_child(u)
+            u.set_parent(v)
+            self.size += 1
+
+        def finish(self):
+            avl = self.avl
+            for root, starts in self.starts.items():
+                pieces = self.pieces[root]
+                roots = avl.split_many(root, starts[1:])
+                for piece, piece_root in zip(pieces, roots):
+                    piece.root = piece_root
+
+            heads = [piece for pieces in self.pieces.values() for piece in pieces if piece.prev is None and not piece.dropped]
+            heads += [piece for piece in self.fresh.values() if piece.prev is None and not piece.dropped]
+            for head in heads:
+                roots = []
+                piece = head
+                while piece:
+                    roots.append(piece.root)
+                    piece = piece.next
+                avl.join_many(roots)
+            for node in self.dropped:
+                avl.release(node)
+
+    def apply_batch(self, ops):
         """
-        Performs the tree rotations to rebalance the tree.
+        Apply a sequence of ("link", u, v) and ("cut", v) operations, with
+        the same result as calling link and cut one at a time.
+        Every tour involved is split once at all the occurrences the batch
+        needs, in a single top-down pass, and each resulting tour is put back
+        together with one balanced multi-way join. A link whose u is not the
+        root of its tree needs a reroot, which ends the current run; u and v
+        of a link must be in different trees.
+        Each operation is checked before it changes anything: a cut of a
+        root or an unknown operation raises ValueError, and the operations
+        before it are still applied.
+        Returns the number of operations applied.
         """
-        if node.balance < 0:
-            if node.right.balance > 0:
-                self.rotateRight(node.right)
-                self.rotateLeft(node)
-            else:
-                self.rotateLeft(node)
-        elif node.balance > 0:
-            if node.left.balance < 0:
-                self.rotateLeft(node.left)
-                self.rotateRight(node)
-            else:
-                self.rotateRight(node)
-    
-    def rebalance_node_to_root(self, node):
-        while node:
-            if abs(node.balance) > 1:
-                self.rebalance(node)
-            node = node.parent
+        batch = Euler_Tour_Tree.Batch(self)
+        count = 0
+        try:
+            for op in ops:
+                if op[0] == "cut":
+                    v = op[1]
+                    if not v.parent:
+                        raise ValueError("v is the root of its tree, there is nothing to cut")
+                    batch.cut(v)
+                elif op[0] == "link":
+                    u, v = op[1], op[2]
+                    if u.parent:
+                        batch.finish()
+                        count += batch.size
+                        # a fresh batch first, so the finally below never finishes one twice
+                        batch = Euler_Tour_Tree.Batch(self)
+                        self.reroot(u)
+                    elif u.first_ptr is u.last_ptr and not u.first_ptr.parent:
+                        self.avl.adopt(u)
+                    if v.first_ptr is v.last_ptr and not v.parent and not v.first_ptr.parent:
+                        self.avl.adopt(v)
+                    batch.link(u, v)
+                else:
+                    raise ValueError("unknown operation %r" % (op[0],))
+        finally:
+            batch.finish()
+        return count + batch.size
 
+    def instrument(self, timing=None):
+        """
+        Start counting rotations, splits, concatenates, touched nodes and the
+        tallest tree into a fresh Stats, returned. If timing is given, each
+        call to one of the TIMED methods is also timed and reported as
+        timing(name, seconds). Until this is called the counters cost one
+        None check per event and the methods are not wrapped at all.
+        """
+        stats = Stats()
+        self.avl.stats = stats
+        for name in self.TIMED:
+            self.__dict__.pop(name, None)
+        if timing:
+            for name in self.TIMED:
+                setattr(self, name, self.timed(name, getattr(self, name), stats, timing))
+        return stats
 
-    def update_height(self, node):
+    def uninstrument(self):
         """
-        start at a given node and traverse upwards to update
-        the height and balance from the node to the root
+        Stop counting and drop the timing wrappers
         """
-        while node != None:
-            node_left_height = node.left.height if node.left else -1
-            node_right_height = node.right.height if node.right else -1
-            node.height = 1 + max(node_left_height, node_right_height)
-            node.balance = node_left_height - node_right_height
-            node = node.parent
+        self.avl.stats = None
+        for name in self.TIMED:
+            self.__dict__.pop(name, None)
 
+    @staticmethod
+    def timed(name, method, stats, timing):
+        clock = time.perf_counter
 
-    def find_min(self):
+        def run(*args, **kwargs):
+            start = clock()
+            result = method(*args, **kwargs)
+            elapsed = clock() - start
+            stats.record(name, elapsed)
+            timing(name, elapsed)
+            return result
+        return run
+
+    def stats(self):
         """
-        find min of the tree by traversing left
+        Snapshot of the counters as a dict, None unless instrument was called
         """
-        node = self._root
-        while node.left != None:
-            node = node.left
-        return node
+        stats = self.avl.stats
+        return stats.snapshot() if stats else None
 
-    def find_max(self):
+    def snapshot(self):
         """
-        find max of the tree by traversing right
+        Read-only view of every tree as it is now, O(1). Needs the
+        Persistent_AVL_tree backend, which keeps the old state of whatever
+        later link, cut or reroot calls change for as long as the view is
+        referenced.
         """
-        node = self._root
-        while node.right != None:
-            node = node.right
-        return node
+        if not isinstance(self.avl, Persistent_AVL_tree):
+            raise ValueError("snapshots need backend=Persistent_AVL_tree")
+        return Euler_Tour_Tree.Snapshot(self.avl.versions)
 
-    def concatenate(self, other):
+    class Snapshot:
         """
-        concatenate two AVL trees where the largest key in one tree
-        is less than the smallest key in the other. concatenation is
-        done by redirecting a pointers to roots, min, max, and nodes
-        at particular heights. 
-        More detail here: https://dhruvbird.blogspot.com/2014/01/merging-avl-trees.html
-        """
-
-        T1 = self 
-        T2 = other 
-
-        T1.synchronizeFields()
-        T2.synchronizeFields()
-        h1 = T1._depth
-        h2 = T2._depth
-
-        if h1 >= h2:
-        # delete the smallest element x from T2, leaving T'2 of height h
-            x = T2.find_min()
-
-            if T2.getRoot() is x and T2.getRoot() is T2.find_max():
-                # if the smallest element x is the only node in T2
-                T1_max = T1.find_max()
-                T1_max.right = T2.getRoot()
-                T2.getRoot().parent = T1_max
-                T2.getRoot().height = 0
-                T1.update_height(T2.getRoot())
-                T1.rebalance(T1.getRoot())
-                return T1
-
-            if x is not T2.getRoot():
-                # if the smallest element x is the root of T2
-                x_parent = x.parent
-                if x is x.parent.right:
-                    x.parent.right = None
-                else:
-                    x.parent.left = None
-                x.parent = None
-                T2.update_height(x_parent)
-                T2.rebalance_node_to_root(x_parent)
-                h = T2.getRoot().height
-            else:
-                if x.right:
-                    T2.setRoot(x.right)
-                    x.right.parent = None
-                    x.right = None
-                T2.update_height(T2.getRoot())
-                T2.rebalance(T2.getRoot())
-                h = T2.getRoot().height
-
-            # find v, the rightmost path from the root of T1 whose height is either         
-            T1.update_height(T1.find_max())
-            v = T1.getRoot()
-            while v.height != h+1 and v.height != h:
-                v = v.right
-            u = v.parent
+        The forest as it was when Euler_Tour_Tree.snapshot was called.
+        Queries only read, so they can run while the writer keeps going, and
+        take the same O(log n) as on the live tree. Vertices linked in for
+        the first time after the snapshot are not part of it.
+        """
+        def __init__(self, versions):
+            self.versions = versions
+            self.epoch = versions.take()
+            weakref.finalize(self, versions.release, self.epoch)
 
+        def node(self, x):
+            return self.versions.node_state(x, self.epoch)
+
+        def vertex(self, v):
+            state = self.versions.vertex_state(v, self.epoch)
+            if state is None:
+                raise KeyError("vertex is not part of this snapshot")
+            return state
+
+        def avl_root(self, x):
+            node = self.node
+            parent = node(x)[Versions.PARENT]
+            while parent:
+                x = parent
+                parent = node(x)[Versions.PARENT]
+            return x
+
+        def find_root(self, v):
+            """
+            Root of v's represented tree
+            """
+            node = self.node
+            x = self.avl_root(self.vertex(v)[Versions.FIRST])
+            left = node(x)[Versions.LEFT]
+            while left:
+                x = left
+                left = node(x)[Versions.LEFT]
+            return node(x)[Versions.REPRESENTED]
+
+        def connected(self, u, v):
+            return self.avl_root(self.vertex(u)[Versions.FIRST]) is self.avl_root(self.vertex(v)[Versions.FIRST])
+
+        def parent(self, v):
+            return self.vertex(v)[Versions.VERTEX_PARENT]
+
+        def rank(self, x):
+            node = self.node
+            state = node(x)
+            left = state[Versions.LEFT]
+            r = node(left)[Versions.SIZE] if left else 0
+            parent = state[Versions.PARENT]
+            while parent:
+                parent_state = node(parent)
+                if parent_state[Versions.RIGHT] is x:
+                    left = parent_state[Versions.LEFT]
+                    r += 1 + (node(left)[Versions.SIZE] if left else 0)
+                x = parent
+                parent = parent_state[Versions.PARENT]
+            return r
+
+        def subtree_size(self, v):
+            state = self.vertex(v)
+            return (self.rank(state[Versions.LAST]) - self.rank(state[Versions.FIRST])) // 2 + 1
+
+        def get_val(self, v):
+            """
+            v's value, including the subtree_add deltas pending above it
+            """
+            node = self.node
+            state = self.vertex(v)
+            val = state[Versions.VAL]
+            parent = node(state[Versions.FIRST])[Versions.PARENT]
+            while parent:
+                parent_state = node(parent)
+                if parent_state[Versions.LAZY]:
+                    val += parent_state[Versions.LAZY]
+                parent = parent_state[Versions.PARENT]
+            return val
+
+        def tour(self, v):
+            """
+            The represented vertices of v's tree in euler tour order
+            """
+            node = self.node
+            tour = []
+            stack = []
+            x = self.avl_root(self.vertex(v)[Versions.FIRST])
+            while stack or x:
+                while x:
+                    stack.append(x)
+                    x = node(x)[Versions.LEFT]
+                x = stack.pop()
+                state = node(x)
+                tour.append(state[Versions.REPRESENTED])
+                x = state[Versions.RIGHT]
+            return tour
+
+    def set_val(self, v, val):
+        """
+        Change the value of v, keeping subtree aggregates up to date
+        """
+        self.avl.push_path(v.first_ptr)
+        v.val = val
+        self.avl.update_height(v.first_ptr)
+
+    def subtree_add(self, v, delta):
+        """
+        Add delta to the value of every vertex in v's subtree, O(log n).
+        The subtree's stretch of the tour is split out and tagged at its root,
+        the tag is pushed down lazily whenever the tree is restructured.
+        """
+        aggregate = self.avl.aggregate
+        if aggregate and not aggregate.shift:
+            raise ValueError("the tree's aggregate has no shift, it cannot take subtree_add")
+        avl = self.avl
+        lt, rt = avl.split(v.first_ptr, True)
+        mid, rt = avl.split(v.last_ptr, False)
+        avl.apply_tag(mid, delta)
+        avl.concatenate_roots(avl.concatenate_roots(lt, mid), rt)
+
+    def tour_index(self, ptr):
+        """
+        Position of the tour entry ptr in its euler tour, counting from 0, O(log n)
+        """
+        return self.avl.rank(ptr)
+
+    def tour_at(self, k, v=None):
+        """
+        The k-th entry (an AVL node) of the euler tour of v's tree, self.root's
+        by default, O(log n). Raises IndexError if the tour is shorter.
+        """
+        avl = self.avl
+        root = avl.root_of((v if v else self.root).first_ptr)
+        if not 0 <= k < root.size:
+            raise IndexError("tour index out of range")
+        return avl.select(root, k)
+
+    def is_ancestor(self, u, v):
+        """
+        Whether u is v or one of v's ancestors, O(log n).
+        The subtrees' stretches of the tour nest, so this holds exactly when
+        v's first appearance falls between u's first and last.
+        """
+        avl = self.avl
+        if not avl.same_tree(u.first_ptr, v.first_ptr):
+            return False
+        v_first = avl.rank(v.first_ptr)
+        return avl.rank(u.first_ptr) <= v_first <= avl.rank(u.last_ptr)
+
+    def iter_tour(self, root):
+        """
+        Yield the represented vertices of root's tree in euler tour order,
+        one successor step per entry, O(1) amortized. Nothing is built up
+        front, so a large tour can be read a piece at a time; the tree must
+        not change while the generator is in use.
+        """
+        node = self.avl.root_of(root.first_ptr)
+        while node.left:
+            node = node.left
+        return self.iter_range(node, None)
+
+    def iter_subtree(self, v):
+        """
+        Yield the vertices of v's subtree in euler tour order, from v.first_ptr
+        to v.last_ptr, each vertex once more than it has children, in
+        O(k + log n) for k entries.
+        """
+        return self.iter_range(v.first_ptr, v.last_ptr)
+
+    def iter_range(self, node, last):
+        # the plain successor walk, splay trees are not restructured under the iterator
+        successor = Sequence_tree.successor
+        avl = self.avl
+        while node:
+            yield node.represented
+            if node is last:
+                return
+            node = successor(avl, node)
+
+    def dump(self, v=None, start=0, count=64):
+        """
+        A page of the euler tour of v's subtree (self.root's by default), one
+        line per entry as "position depth value", from entry start for count
+        entries, with a closing line saying where the next page starts.
+        Finding the page costs O(log n) and the page itself O(count).
+        """
+        avl = self.avl
+        v = v if v else self.root
+        first = avl.rank(v.first_ptr)
+        length = avl.rank(v.last_ptr) - first + 1
+        if not 0 <= start < length:
+            return ""
+        node = Sequence_tree.select(avl, avl.root_of(v.first_ptr), first + start)
+        # the depth of an entry's vertex is one less than the sum of the steps up to it
+        prefix = Sequence_tree.prefix_steps(avl, node)
+        lines = []
+        for position in range(start, min(start + count, length)):
+            if position > start:
+                node = Sequence_tree.successor(avl, node)
+                prefix += avl.step(node)
+            lines.append("%d %d %r" % (position, prefix - 1, node.represented.val))
+        if start + count < length:
+            lines.append("... %d more entries, next page start=%d" % (length - start - count, start + count))
+        return "\n".join(lines) + "\n"
+
+    def depth(self, v):
+        """
+        Number of edges from the root of v's tree down to v, O(log n).
+        Every entry of the tour steps one level down when it is a vertex's
+        first appearance and one level up otherwise, so the depth of an entry
+        is the sum of the steps up to it (less one for the root's own step).
+        The sums are kept per AVL subtree, so link, cut and reroot keep them
+        right with no extra work.
+        """
+        return self.avl.prefix_steps(v.first_ptr) - 1
+
+    def lca(self, u, v):
+        """
+        Lowest common ancestor of u and v, None if they are in different
+        trees, O(log n). It is the shallowest entry of the tour between the
+        first appearances of u and v.
+        """
+        avl = self.avl
+        if not avl.same_tree(u.first_ptr, v.first_ptr):
+            return None
+        lo = u.first_ptr
+        hi = v.first_ptr
+        if avl.rank(lo) > avl.rank(hi):
+            lo, hi = hi, lo
+        node, _ = avl.lowest(lo, hi)
+        return node.represented
+
+    def subtree_size(self, v):
+        """
+        Number of vertices in v's subtree, O(log n).
+        v appears once more than it has children, so a subtree of k vertices
+        spans 2k - 1 entries of the tour.
+        """
+        count, _ = self.avl.range_fold(v.first_ptr, v.last_ptr)
+        return (count + 1) // 2
+
+    def subtree_aggregate(self, v):
+        """
+        Fold of the tree's aggregate over the vertices of v's subtree, O(log n).
+        Each vertex contributes once, at its first appearance in the tour.
+        """
+        _, agg = self.avl.range_fold(v.first_ptr, v.last_ptr)
+        return agg
+
+    def verify(self, v=None):
+        """
+        Check the tree containing v (self.root by default): the AVL invariants
+        of its euler tour, that the tour matches a DFS of the represented tree,
+        and that every first_ptr/last_ptr points at the right occurrence.
+        Raises AssertionError on a violation, returns the length of the tour.
+        """
+        r = (v if v else self.root).find_root()
+        avl_root = r.find_avl_root()
+        count = self.avl.verify(avl_root)
+
+        # in-order walk of the AVL tree
+        tour = []
+        stack = []
+        node = avl_root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            tour.append(node)
+            node = node.right
+
+        # replay the tour: each step either enters a child or returns to the parent
+        assert tour[0].represented is r, "tour does not start at the root"
+        assert r.get_parent() is None, "root has a parent"
+        stack = [r]
+        seen = {r}
+        children = {r: set()}
+        for node in tour[1:]:
+            vertex = node.represented
+            if len(stack) > 1 and vertex is stack[-2]:
+                stack.pop()
+                continue
+            assert vertex not in seen, "vertex entered twice"
+            assert vertex.get_parent() is stack[-1], "tour does not match represented tree"
+            seen.add(vertex)
+            children[stack[-1]].add(vertex)
+            children[vertex] = set()
+            stack.append(vertex)
+        assert stack == [r], "tour does not return to the root"
+        for vertex in seen:
+            assert set(vertex.get_children()) == children[vertex], "children do not match tour"
+
+        first = {}
+        last = {}
+        for node in tour:
+            first.setdefault(node.represented, node)
+            last[node.represented] = node
+        for vertex in first:
+            assert vertex.get_first_ptr() is first[vertex], "stale first_ptr"
+            assert vertex.get_last_ptr() is last[vertex], "stale last_ptr"
+        return count
+
+class Sequence_tree:
+    """
+    A binary tree whose in-order sequence is an euler tour, with parent pointers.
+    This is the interface Euler_Tour_Tree talks to. A backend provides
+        join(lt, x, rt)       root of lt, x, rt concatenated in order
+        split(x, sign)        (left root, right root) around node x, with x
+                              going right if sign is True and left otherwise
+        remove_min/remove_max detach the first/last node of a tree
+        build(nodes)          root of a tree holding nodes in order, O(n)
+        root_of(x)            root of the tree holding x
+    and calls update_node on every node whose children change, which keeps
+    the size and aggregate augmentation (the aggregate hooks) up to date.
+    Everything else, from concatenate to the euler tour cutting, linking and
+    rerooting, is written against those primitives.
+    """
+    # node type used for the tour entries of this backend
+    Node = None
+
+    def __init__(self, aggregate=None):
+        self._root = None
+        self.aggregate = aggregate
+        # Stats while instrumented, None otherwise
+        self.stats = None
+        # nodes dropped from the tours, reused by new_node; None turns recycling off
+        self.pool = []
+
+    def getRoot(self):
+        return self._root
+
+    def setRoot(self, node):
+        self._root = node
+
+    def new_node(self, represented):
+        """
+        A fresh tour entry for the represented vertex
+        """
+        pool = self.pool
+        if pool:
+            node = pool.pop()
+            node.__init__(represented=represented)
+            if self.stats:
+                self.stats.reuses += 1
+        else:
+            node = self.Node(represented=represented)
+            if self.stats:
+                self.stats.allocations += 1
+        self.update_node(node)
+        return node
+
+    def release(self, node):
+        """
+        Take back a node that has left its tour for good. Its represented is
+        cleared, so stale references see a dropped entry, and new_node hands
+        it out again instead of allocating.
+        """
+        node.represented = None
+        if self.pool is not None:
+            self.pool.append(node)
+
+    def adopt(self, vertex):
+        """
+        Give a vertex that is not part of any tour yet an entry of this backend's node type
+        """
+        if not isinstance(vertex.first_ptr, self.Node):
+            vertex.first_ptr = self.Node(represented=vertex)
+            vertex.last_ptr = vertex.first_ptr
+        self.update_node(vertex.first_ptr)
+
+    def root_of(self, node):
+        """
+        Root of the tree holding node
+        """
+        while node.parent:
+            node = node.parent
+        return node
+
+    def same_tree(self, x, y):
+        """
+        Whether x and y are in the same tree
+        """
+        return self.root_of(x) is self.root_of(y)
+
+    def join(self, lt, x, rt):
+        raise NotImplementedError
+
+    def split(self, v, sign):
+        raise NotImplementedError
+
+    def remove_min(self, root):
+        raise NotImplementedError
+
+    def remove_max(self, root):
+        raise NotImplementedError
+
+    def build(self, nodes, lo=0, hi=None):
+        """
+        Build a perfectly balanced tree whose in-order sequence is nodes[lo:hi],
+        in O(n). Returns its root.
+        """
+        if hi is None:
+            hi = len(nodes)
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        node = nodes[mid]
+        node.left = self.build(nodes, lo, mid)
+        node.right = self.build(nodes, mid + 1, hi)
+        node.parent = None
+        if node.left:
+            node.left.parent = node
+        if node.right:
+            node.right.parent = node
+        self.update_node(node)
+        return node
+
+    def rotateLeft(self, node):
+        """
+        Performs a left rotation. Returns the new root of the rotated subtree.
+        """
+        if self.stats:
+            self.stats.rotations += 1
+        newRootNode = node.right
+        if node.lazy:
+            self.push(node)
+        if newRootNode.lazy:
+            self.push(newRootNode)
+        node.right = newRootNode.left
+        if (newRootNode.left):
+            newRootNode.left.parent = node
+        newRootNode.parent = node.parent
+        if node.parent is None:
+            if node is self.getRoot():
+                self.setRoot(newRootNode)
+        elif node.parent.left is node:
+            node.parent.left = newRootNode
+        else:
+            node.parent.right = newRootNode
+
+        newRootNode.left = node
+        node.parent = newRootNode
+
+        # Update height and balance, bottom up
+        self.update_node(node)
+        self.update_node(newRootNode)
+        return newRootNode
+
+    def rotateRight(self, node):
+        """
+        Performs a right rotation. Returns the new root of the rotated subtree.
+        """
+        if self.stats:
+            self.stats.rotations += 1
+        newRootNode = node.left
+        if node.lazy:
+            self.push(node)
+        if newRootNode.lazy:
+            self.push(newRootNode)
+        node.left = newRootNode.right
+        if (newRootNode.right):
+            newRootNode.right.parent = node
+        newRootNode.parent = node.parent
+        if node.parent is None:
+            if node is self.getRoot():
+                self.setRoot(newRootNode)
+        elif node.parent.right is node:
+            node.parent.right = newRootNode
+        else:
+            node.parent.left = newRootNode
+
+        newRootNode.right = node
+        node.parent = newRootNode
+
+        # Update height and balance, bottom up
+        self.update_node(node)
+        self.update_node(newRootNode)
+        return newRootNode
+
+    def update_node(self, node):
+        """
+        Recompute the augmentation of a single node from its children
+        """
+        left = node.left
+        right = node.right
+        node.size = 1 + (left.size if left else 0) + (right.size if right else 0)
+
+        if node.lazy:
+            self.push(node)
+        if self.stats:
+            self.stats.nodes_touched += 1
+
+        # depth steps: +1 entering a vertex for the first time, -1 returning to it
+        vertex = node.represented
+        first = vertex is not None and vertex.first_ptr is node
+        steps = low = 1 if first else -1
+        if left:
+            low = min(left.low, left.steps + steps)
+            steps += left.steps
+        if right:
+            low = min(low, steps + right.low)
+            steps += right.steps
+        node.steps = steps
+        node.low = low
+
+        aggregate = self.aggregate
+        if aggregate:
+            combine = aggregate.combine
+            if first:
+                agg = aggregate.value(vertex)
+                count = 1
+            else:
+                agg = aggregate.identity
+                count = 0
+            if left:
+                agg = combine(left.agg, agg)
+                count += left.count
+            if right:
+                agg = combine(agg, right.agg)
+                count += right.count
+            node.agg = agg
+            node.count = count
+
+    def apply_tag(self, node, delta):
+        """
+        Add delta to every vertex whose first appearance is in node's subtree.
+        Node's own value and aggregate change now, its children's only when
+        the tag is pushed down to them.
+        """
+        if node.left or node.right:
+            node.lazy += delta
+        vertex = node.represented
+        if vertex is not None and vertex.first_ptr is node:
+            vertex.val += delta
+        aggregate = self.aggregate
+        if aggregate:
+            node.agg = aggregate.shift(node.agg, delta, node.count)
+
+    def push(self, node):
+        """
+        Hand node's pending tag down to its children. Must happen before the
+        children of a tagged node change.
+        """
+        delta = node.lazy
+        node.lazy = 0
+        if node.left:
+            self.apply_tag(node.left, delta)
+        if node.right:
+            self.apply_tag(node.right, delta)
+
+    def push_path(self, node):
+        """
+        Push the pending tags on the path from the root down to node, so that
+        node and all its ancestors carry none
+        """
+        path = []
+        while node:
+            path.append(node)
+            node = node.parent
+        if self.stats:
+            self.stats.observe_height(len(path) - 1)
+        for node in reversed(path):
+            if node.lazy:
+                self.push(node)
+
+    def own_value(self, node):
+        """
+        The value node itself contributes to the aggregate: its vertex's value
+        at the vertex's first appearance in the tour, the identity elsewhere.
+        """
+        vertex = node.represented
+        if vertex is not None and vertex.first_ptr is node:
+            return self.aggregate.value(vertex)
+        return self.aggregate.identity
+
+    def range_fold(self, lo, hi):
+        """
+        Fold the nodes from lo to hi (inclusive, in order) without modifying the tree.
+        Walks from lo and hi up to their lowest common ancestor, picking up the
+        subtrees hanging inside the range, so this is O(log n).
+        Tags are not pushed: the subtree_add deltas still pending above each
+        piece are summed on the way down from the root and shifted in, so
+        the fold can run under a shared lock.
+        Returns (number of nodes, aggregate or None if the tree has none).
+        """
+        aggregate = self.aggregate
+        combine = aggregate.combine if aggregate else None
+        identity = aggregate.identity if aggregate else None
+
+        ancestors = set()
+        node = lo
+        while node:
+            ancestors.add(node)
+            node = node.parent
+        lca = hi
+        while lca not in ancestors:
+            lca = lca.parent
+
+        # pending[x]: sum of the tags on x's strict ancestors, for x on either path
+        pending = {}
+        if aggregate:
+            for end in (lo, hi):
+                path = []
+                node = end
+                while node and node not in pending:
+                    path.append(node)
+                    node = node.parent
+                delta = pending[node] + node.lazy if node else 0
+                for node in reversed(path):
+                    pending[node] = delta
+                    delta += node.lazy
+
+        def own(node):
+            value = self.own_value(node)
+            delta = pending[node]
+            if delta and node.represented is not None and node.represented.first_ptr is node:
+                value = aggregate.shift(value, delta, 1)
+            return value
+
+        def whole(subtree, parent):
+            delta = pending[parent] + parent.lazy
+            return aggregate.shift(subtree.agg, delta, subtree.count) if delta else subtree.agg
+
+        # lo side: lo itself, everything right of it, and ancestors entered from the left
+        left_count = 0
+        left_agg = identity
+        if lo is not lca:
+            left_count = 1 + (lo.right.size if lo.right else 0)
+            if aggregate:
+                left_agg = own(lo)
+                if lo.right:
+                    left_agg = combine(left_agg, whole(lo.right, lo))
+            child = lo
+            node = lo.parent
+            while node is not lca:
+                if node.left is child:
+                    left_count += 1 + (node.right.size if node.right else 0)
+                    if aggregate:
+                        left_agg = combine(left_agg, own(node))
+                        if node.right:
+                            left_agg = combine(left_agg, whole(node.right, node))
+                child = node
+                node = node.parent
+
+        # hi side: mirror image
+        right_count = 0
+        right_agg = identity
+        if hi is not lca:
+            right_count = 1 + (hi.left.size if hi.left else 0)
+            if aggregate:
+                right_agg = own(hi)
+                if hi.left:
+                    right_agg = combine(whole(hi.left, hi), right_agg)
+            child = hi
+            node = hi.parent
+            while node is not lca:
+                if node.right is child:
+                    right_count += 1 + (node.left.size if node.left else 0)
+                    if aggregate:
+                        right_agg = combine(own(node), right_agg)
+                        if node.left:
+                            right_agg = combine(whole(node.left, node), right_agg)
+                child = node
+                node = node.parent
+
+        count = left_count + 1 + right_count
+        agg = None
+        if aggregate:
+            agg = combine(combine(left_agg, own(lca)), right_agg)
+        return count, agg
+
+    def search(self, root, keep):
+        """
+        The vertices under root whose aggregate value passes keep, in tour
+        order. Subtrees whose aggregate fails keep are skipped, which is
+        right when keep can only pass on a fold if it passes on one of the
+        folded values, as with bit flags under Aggregate.FLAGS. O(log n)
+        per vertex found, without modifying the tree.
+        """
+        found = []
+        stack = []
+        node = root if root and keep(root.agg) else None
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left if node.left and keep(node.left.agg) else None
+            node = stack.pop()
+            vertex = node.represented
+            if vertex is not None and vertex.first_ptr is node and keep(self.aggregate.value(vertex)):
+                found.append(vertex)
+            node = node.right if node.right and keep(node.right.agg) else None
+        return found
+
+    def update_height(self, node):
+        """
+        start at a given node and traverse upwards to update
+        the height, balance and augmentation from the node to the root
+        """
+        while node != None:
+            self.update_node(node)
+            node = node.parent
+
+    def successor(self, node):
+        """
+        Next node in order, or None
+        """
+        if node.right:
+            node = node.right
+            while node.left:
+                node = node.left
+            return node
+        while node.parent and node.parent.right is node:
+            node = node.parent
+        return node.parent
+
+    def predecessor(self, node):
+        """
+        Previous node in order, or None
+        """
+        if node.left:
+            node = node.left
+            while node.right:
+                node = node.right
+            return node
+        while node.parent and node.parent.left is node:
+            node = node.parent
+        return node.parent
+
+    def step(self, node):
+        """
+        +1 if node is its vertex's first appearance in the tour, -1 otherwise.
+        The prefix sums of the steps along a tour are the depths plus one.
+        """
+        vertex = node.represented
+        return 1 if vertex is not None and vertex.first_ptr is node else -1
+
+    def prefix_steps(self, node):
+        """
+        Sum of the steps from the start of node's tour up to node, O(depth)
+        """
+        p = (node.left.steps if node.left else 0) + self.step(node)
+        while node.parent:
+            parent = node.parent
+            if parent.right is node:
+                p += (parent.left.steps if parent.left else 0) + self.step(parent)
+            node = parent
+        return p
+
+    def lowest(self, lo, hi):
+        """
+        The node from lo to hi (inclusive, in order) at which the prefix sum of
+        the steps is lowest, with that sum. Like range_fold, the range is
+        covered by the nodes and hanging subtrees on the paths from lo and hi
+        up to their lowest common ancestor; if the low point is inside one of
+        the subtrees, it is found by a walk down. O(log n).
+        """
+        ancestors = set()
+        node = lo
+        while node:
+            ancestors.add(node)
+            node = node.parent
+        lca = hi
+        while lca not in ancestors:
+            lca = lca.parent
+
+        # the range in order as (node, None) for single nodes and (None, subtree) for whole subtrees
+        pieces = []
+        if lo is not lca:
+            pieces += [(lo, None), (None, lo.right)]
+            child = lo
+            node = lo.parent
+            while node is not lca:
+                if node.left is child:
+                    pieces += [(node, None), (None, node.right)]
+                child = node
+                node = node.parent
+        pieces.append((lca, None))
+        if hi is not lca:
+            groups = [[(None, hi.left), (hi, None)]]
+            child = hi
+            node = hi.parent
+            while node is not lca:
+                if node.right is child:
+                    groups.append([(None, node.left), (node, None)])
+                child = node
+                node = node.parent
+            for group in reversed(groups):
+                pieces += group
+
+        acc = self.prefix_steps(lo) - self.step(lo)
+        best = None
+        best_subtree = None
+        best_before = 0
+        for node, subtree in pieces:
+            if node:
+                acc += self.step(node)
+                if best is None or acc < best:
+                    best, best_node, best_subtree = acc, node, None
+            elif subtree:
+                if best is None or acc + subtree.low < best:
+                    best, best_subtree, best_before = acc + subtree.low, subtree, acc
+                acc += subtree.steps
+        if best_subtree is None:
+            return best_node, best
+
+        # walk down to where the subtree reaches its low point
+        node = best_subtree
+        acc = best_before
+        while True:
+            if node.left and acc + node.left.low == best:
+                node = node.left
+                continue
+            if node.left:
+                acc += node.left.steps
+            acc += self.step(node)
+            if acc == best:
+                return node, best
+            node = node.right
+
+    def rank(self, node):
+        """
+        Number of nodes before node in order, O(depth)
+        """
+        r = node.left.size if node.left else 0
+        depth = 0
+        while node.parent:
+            if node.parent.right is node:
+                r += 1 + (node.parent.left.size if node.parent.left else 0)
+            node = node.parent
+            depth += 1
+        if self.stats:
+            self.stats.observe_height(depth)
+        return r
+
+    def select(self, root, k):
+        """
+        The node with rank k in the tree rooted at root, O(depth)
+        """
+        node = root
+        while node:
+            left_size = node.left.size if node.left else 0
+            if k < left_size:
+                node = node.left
+            elif k == left_size:
+                return node
+            else:
+                k -= left_size + 1
+                node = node.right
+        raise IndexError("rank out of range")
+
+    def concatenate_roots(self, lt, rt):
+        """
+        Concatenate the trees rooted at lt and rt, returns the new root
+        """
+        if not lt:
+            return rt
+        if not rt:
+            return lt
+        if self.stats:
+            self.stats.concatenates += 1
+        lt, x = self.remove_max(lt)
+        return self.join(lt, x, rt)
+
+    def split_many(self, root, cuts):
+        """
+        Split the tree rooted at root in front of each of the sorted ranks in
+        cuts (0 < rank < size) in a single top-down pass: each node only
+        decides which side of the cuts below it goes where, and the pieces are
+        joined back on the way up. Returns the len(cuts) + 1 roots, in order.
+        """
+        if not cuts:
+            return [root]
+        if self.stats:
+            self.stats.splits += 1
+        if root.lazy:
+            self.push(root)
+        left = root.left
+        right = root.right
+        if left:
+            left.parent = None
+        if right:
+            right.parent = None
+        root.left = root.right = root.parent = None
+        left_size = left.size if left else 0
+
+        i = bisect.bisect_left(cuts, left_size)
+        left_cuts = cuts[:i]
+        rest = cuts[i:]
+        cut_before = bool(rest) and rest[0] == left_size
+        if cut_before:
+            rest = rest[1:]
+        cut_after = bool(rest) and rest[0] == left_size + 1
+        if cut_after:
+            rest = rest[1:]
+        right_cuts = [c - left_size - 1 for c in rest]
+
+        left_pieces = self.split_many(left, left_cuts) if left_cuts else [left]
+        right_pieces = self.split_many(right, right_cuts) if right_cuts else [right]
+        middle_left = None if cut_before else left_pieces.pop()
+        middle_right = None if cut_after else right_pieces.pop(0)
+        middle = self.join(middle_left, root, middle_right)
+        return left_pieces + [middle] + right_pieces
+
+    def join_many(self, roots):
+        """
+        Concatenate the trees rooted at roots in order, pairing them up level
+        by level so that the trees being joined stay of similar size.
+        Returns the root of the result.
+        """
+        roots = [r for r in roots if r]
+        while len(roots) > 1:
+            paired = [self.concatenate_roots(roots[i], roots[i + 1]) for i in range(0, len(roots) - 1, 2)]
+            if len(roots) % 2:
+                paired.append(roots[-1])
+            roots = paired
+        return roots[0] if roots else None
+
+    def concatenate(self, other):
+        """
+        concatenate two trees where the largest key in one tree
+        is less than the smallest key in the other. The largest node of
+        self is detached and used as the middle node of a join, so for the
+        AVL tree this is O(log n) and never visits more than the two spines.
+        Returns self, now rooted at the concatenated tree.
+        """
+        self.setRoot(self.concatenate_roots(self.getRoot(), other.getRoot()))
+        return self
+
+    def verify(self, root=None):
+        """
+        Check the tree rooted at root (the tree's own root by default): parent
+        pointers, the size and aggregate augmentation, and whatever the
+        backend checks in verify_node.
+        Raises AssertionError on a violation, returns the number of nodes.
+        """
+        if root is None:
+            root = self.getRoot()
+        if root is None:
+            return 0
+        assert root.parent is None, "root has a parent"
+
+        count = 0
+        stack = [(root, False)]
+        while stack:
+            node, visited = stack.pop()
+            if not visited:
+                stack.append((node, True))
+                for child in (node.left, node.right):
+                    if child:
+                        assert child.parent is node, "broken parent pointer"
+                        stack.append((child, False))
+                continue
+            count += 1
+            assert node.size == 1 + (node.left.size if node.left else 0) + (node.right.size if node.right else 0), "stale size"
+            steps = low = self.step(node)
+            if node.left:
+                low = min(node.left.low, node.left.steps + steps)
+                steps += node.left.steps
+            if node.right:
+                low = min(low, steps + node.right.low)
+                steps += node.right.steps
+            assert node.steps == steps and node.low == low, "stale depth steps"
+            self.verify_node(node)
+            if self.aggregate:
+                agg = node.agg
+                self.update_node(node)
+                assert node.agg == agg, "stale aggregate"
+        return count
+
+    def verify_node(self, node):
+        pass
+
+    def cutting(self, first_v, last_v):
+        """
+        Cut out v subtree from euler tour representation
+        """
+        # split by first appearance of v in euler tour
+        lt, rt = self.split(first_v, True)
+
+        # split by last appearance of v in euler tour
+        rt, rt2 = self.split(last_v, False)
+
+        # the parent p appears on both sides of the cut subtree: ..., p, v, ..., v, p, ...
+        # drop the occurrence after the subtree and splice the rest back around the one before it
+        if lt and rt2:
+            lt, p_before = self.remove_max(lt)
+            rt2, p_after = self.remove_min(rt2)
+            p = p_after.represented
+            if p.last_ptr is p_after:
+                p.last_ptr = p_before
+            self.release(p_after)
+            lt = self.join(lt, p_before, rt2)
+        elif rt2:
+            lt = rt2
+
+        # the roots of the rest of the tour and of the cut out v subtree
+        return lt, rt
+
+    def rerooting(self, path):
+        """
+        Rotate the euler tour so that it starts at the first appearance of
+        path[0], where path runs up the represented tree from the new root
+        to the old one.
+        The tour r, A, v, B, r becomes v, B, r, A, v: the old root's first
+        appearance is dropped and v gets a new last appearance.
+        """
+        v = path[0]
+        r = path[-1]
+        r_first = r.get_first_ptr()
+
+        # new occurrence pointers, read off the tour before it changes:
+        # every vertex on the path is now first seen right after the path
+        # child's subtree, and last seen right before it
+        moved = []
+        for i in range(1, len(path)):
+            w = path[i]
+            c = path[i - 1]
+            first = self.successor(c.get_last_ptr())
+            last = self.predecessor(c.get_first_ptr())
+            if last is r_first:
+                last = r.get_last_ptr()
+            moved.append((w, first, last))
+
+        # a vertex's val is relative to the tags above its first appearance, clear them on both ends of the move
+        old_firsts = []
+        for w, first, last in moved:
+            self.push_path(w.first_ptr)
+            self.push_path(first)
+            if w.first_ptr is not r_first:
+                old_firsts.append(w.first_ptr)
+            w.first_ptr = first
+            w.last_ptr = last
+        v_ptr = self.new_node(v)
+        v.last_ptr = v_ptr
+
+        # cut the tour in front of v, drop r's first appearance and swap the halves
+        lt, rt = self.split(v.get_first_ptr(), True)
+        lt, _ = self.remove_min(lt)
+        self.release(r_first)
+        root = self.join(self.concatenate_roots(rt, lt), v_ptr, None)
+
+        # the aggregate is kept at first appearances, refresh the ones that moved
+        for node in old_firsts:
+            self.update_height(node)
+        for w, first, last in moved:
+            self.update_height(first)
+        return root
+
+    def linking(self, u, v):
+        """
+        Link u subtree as a child of v in euler tour representation
+        """
+        # Update represented tree
+        # append u to v's children
+        v.add_child(u)
+        # set u's parent to v
+        u.set_parent(v)
+
+        # Update AVL Tree
+        # split right after the last appearance of v in AVL Tree
+        v_ptr = v.get_last_ptr()
+        ut = self.root_of(u.get_first_ptr())
+        lt, rt = self.split(v_ptr, False)
+
+        # concatenate left subtree with u subtree
+        lt = self.concatenate_roots(lt, ut)
+
+        # v is visited again once u's subtree is done, that occurrence becomes its last
+        v_ptr = self.new_node(v)
+        v.last_ptr = v_ptr
+        return self.join(lt, v_ptr, rt)
+
+class AVL_tree(Sequence_tree):
+    #Inner node class
+    class AVL_node:
+        """
+        Node class to be used in the tree.
+        Each node has a balance factor attribute representing 
+        the longest downward path rooted at the node.
+        """
+        __slots__ = ("data", "left", "right", "parent", "height", "represented", "size", "agg", "count", "lazy", "steps", "low", "balance")
+
+        def __init__(self, data=None, left=None, right=None, balance=0, parent=None, height=0, represented=None):
+            self.data = data
+            self.left = left
+            self.right = right
+            self.parent = parent
+            self.height = height
+            self.represented = represented
+
+            # augmentation: number of nodes in the subtree, and the tree's aggregate folded over it
+            self.size = 1
+            self.agg = None
+            # number of vertices first seen in the subtree, and the subtree_add delta not yet pushed to the children
+            self.count = 0
+            self.lazy = 0
+            # depth steps over the subtree (+1 per first appearance, -1 per other entry), and their lowest prefix sum
+            self.steps = 1
+            self.low = 1
+
+            #used to balance the tree: balance = height(left subtree) - height(right subtree)
+            #tree at node is balanced if the value is in [-1, 0, 1], else it is unbalanced
+            self.balance = balance 
+            return
+
+    Node = AVL_node
+
+    def __init__(self, aggregate=None):
+        Sequence_tree.__init__(self, aggregate)
+        return
+
+    DUMP_LINES = 64
+
+    def __str__(self):
+        """
+        The binary tree on its side, right subtree above, one line per node
+        indented by its depth. Stops after DUMP_LINES lines, see dump for more.
+        """
+        return self.dump(self._root, 0, self.DUMP_LINES)
+
+    def dump(self, root, start=0, count=64):
+        """
+        Lines start to start+count of the sideways picture of the AVL tree
+        under root, each "height:value". Only the lines asked for are built,
+        and the walk is iterative, so any page of a large tree is cheap to print.
+        """
+        lines = []
+        skipped = 0
+        stack = []
+        node = root
+        depth = 0
+        while (stack or node) and len(lines) < count:
+            while node:
+                stack.append((node, depth))
+                node = node.right
+                depth += 1
+            node, depth = stack.pop()
+            if skipped < start:
+                skipped += 1
+            else:
+                val = node.represented.val if node.represented is not None else node.data
+                lines.append("    " * depth + "%d:%r" % (node.height, val))
+            node = node.left
+            depth += 1
+        if stack or node:
+            lines.append("... (more from line %d)" % (start + count))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def contains(self, data):
+        """
+        External method used to search the tree for a data element.
+        """
+        return True if self.recursiveContains(data, self.getRoot()) else False
+
+    def recursiveContains(self, data, node):
+        """
+        Internal method used to recursively search for data elements
+        """
+        if not node:
+            return None
+        elif node.data == data:
+            return node
+        elif data > node.data:
+            return self.recursiveContains(data, node.right)
+        elif data < node.data:
+            return self.recursiveContains(data, node.right)
+
+    def insertList(self, l):
+        """
+        Builds the tree by inserting elements from a list in order.
+        """
+        if (l == None):
+            return
+        try:
+            for ele in l:
+                self.insert(ele)
+        except TypeError:
+            return
+        return
+
+    def insert(self, data):
+        """
+        This is the external insert method for the data structure.
+        Args:
+            data: a data object to be inserted into the tree
+        """
+        if (data == None):
+            return 
+        if (not self.getRoot()):
+            self.setRoot(AVL_tree.AVL_node(data=data))
+            return
+        else:
+            self._done = 0
+            self.recursiveInsert(self.getRoot(), data)
+            delattr(self, "_done")
+            return
+
+    def recursiveInsert(self, node, data):
+        """
+        This is an internal method used to insert data elements 
+        recursively into the tree.
+        """
+
+        #no duplicates in the tree
+        if (data == node.data):
+            return
+
+        if data < node.data:
+            if node.left:
+                self.recursiveInsert(node.left, data)
+            else:
+                node.left = AVL_tree.AVL_node(data=data, parent=node)
+                self.updateBalance(node.left)
+        else:
+            if node.right:
+                self.recursiveInsert(node.right, data)
+            else:
+                node.right = AVL_tree.AVL_node(data=data, parent=node)
+                self.updateBalance(node.right)
+        return
+
+    def updateBalance(self, node):
+        """
+        Balances the tree starting with a newly inserted node (node)
+        """
+        if (node.balance > 1 or node.balance < -1):
+            self.rebalance(node)
+            return
+        if node.parent:
+            if node.parent.left is node: #lchild
+                if node.parent.balance >= 0:
+                    node.parent.height += 1
+                node.parent.balance += 1
+            elif node.parent.right is node: #rchild
+                if node.parent.balance <= 0:
+                    node.parent.height += 1
+                node.parent.balance -= 1
+
+            #recurses to the parent
+            if node.parent.balance != 0:
+                self.updateBalance(node.parent)
+
+    def rebalance(self, node):
+        """
+        Performs the tree rotations to rebalance the tree.
+        Returns the new root of the rebalanced subtree.
+        """
+        if node.balance < 0:
+            if node.right.balance > 0:
+                self.rotateRight(node.right)
+            return self.rotateLeft(node)
+        elif node.balance > 0:
+            if node.left.balance < 0:
+                self.rotateLeft(node.left)
+            return self.rotateRight(node)
+        return node
+    
+    def rebalance_node_to_root(self, node):
+        while node:
+            if abs(node.balance) > 1:
+                self.rebalance(node)
+            node = node.parent
+
+    def retrace(self, node):
+        """
+        Walk from node up to the root, recomputing height and balance and
+        rotating wherever the AVL condition is violated.
+        Returns the root of the tree.
+        """
+        root = node
+        while node != None:
+            self.update_node(node)
+            if node.balance > 1 or node.balance < -1:
+                node = self.rebalance(node)
+            root = node
+            node = node.parent
+        return root
+
+    def update_node(self, node):
+        """
+        Recompute the height, balance and augmentation of a single node from its children
+        """
+        node_left_height = node.left.height if node.left else -1
+        node_right_height = node.right.height if node.right else -1
+        node.height = 1 + max(node_left_height, node_right_height)
+        node.balance = node_left_height - node_right_height
+        if self.stats and node.height > self.stats.max_height:
+            self.stats.max_height = node.height
+        Sequence_tree.update_node(self, node)
+
+    def find_min(self):
+        """
+        find min of the tree by traversing left
+        """
+        node = self._root
+        while node.left != None:
+            node = node.left
+        return node
+
+    def find_max(self):
+        """
+        find max of the tree by traversing right
+        """
+        node = self._root
+        while node.right != None:
+            node = node.right
+        return node
+
+    def join(self, lt, x, rt):
+        """
+        Join the AVL trees rooted at lt and rt using x as the middle node,
+        where every node of lt comes before x and every node of rt after it.
+        Only the heights stored on the nodes are consulted: x is hung off the
+        spine of the taller tree at the height of the shorter one, and the
+        path above it is retraced, so this is O(|height(lt) - height(rt)| + 1).
+        Returns the root of the joined tree.
+        """
+        lt_height = lt.height if lt else -1
+        rt_height = rt.height if rt else -1
+
+        if lt_height > rt_height + 1:
+            # walk down the right spine of lt to the first node short enough to sit beside rt
+            u = lt
+            if u.lazy:
+                self.push(u)
+            v = lt.right
+            while v and v.height > rt_height + 1:
+                if v.lazy:
+                    self.push(v)
+                u = v
+                v = v.right
             x.left = v
-            x.right = T2.getRoot()
-            v.parent = x
-            T2.getRoot().parent = x
-
-            if u:
-                # if u exists, update the height starting from u
-                u.right = x
-                x.parent = u
-                T1.update_height(x)
-                T1.rebalance(u)
+            x.right = rt
+            if v:
+                v.parent = x
+            if rt:
+                rt.parent = x
+            u.right = x
+            x.parent = u
+            self.update_node(x)
+            return self.retrace(u)
+
+        if rt_height > lt_height + 1:
+            # walk down the left spine of rt
+            u = rt
+            if u.lazy:
+                self.push(u)
+            v = rt.left
+            while v and v.height > lt_height + 1:
+                if v.lazy:
+                    self.push(v)
+                u = v
+                v = v.left
+            x.left = lt
+            x.right = v
+            if lt:
+                lt.parent = x
+            if v:
+                v.parent = x
+            u.left = x
+            x.parent = u
+            self.update_node(x)
+            return self.retrace(u)
+
+        # heights differ by at most one, x becomes the new root
+        x.left = lt
+        x.right = rt
+        x.parent = None
+        if lt:
+            lt.parent = x
+        if rt:
+            rt.parent = x
+        self.update_node(x)
+        return x
+
+    def remove_max(self, root):
+        """
+        Detach the largest node of the tree rooted at root.
+        Returns (root of the remaining tree, detached node).
+        """
+        x = root
+        if x.lazy:
+            self.push(x)
+        while x.right != None:
+            x = x.right
+            if x.lazy:
+                self.push(x)
+        p = x.parent
+        if x.left:
+            x.left.parent = p
+        if p:
+            p.right = x.left
+        remaining = self.retrace(p) if p else x.left
+
+        x.left = None
+        x.parent = None
+        self.update_node(x)
+        return remaining, x
+
+    def remove_min(self, root):
+        """
+        Detach the smallest node of the tree rooted at root.
+        Returns (root of the remaining tree, detached node).
+        """
+        x = root
+        if x.lazy:
+            self.push(x)
+        while x.left != None:
+            x = x.left
+            if x.lazy:
+                self.push(x)
+        p = x.parent
+        if x.right:
+            x.right.parent = p
+        if p:
+            p.left = x.right
+        remaining = self.retrace(p) if p else x.right
+
+        x.right = None
+        x.parent = None
+        self.update_node(x)
+        return remaining, x
+
+    def split(self, v, sign):
+        """
+        Split the AVL Tree containing v in two sections, lt and rt, with lt being
+        elements less than v, and rt being elements greater than v.
+        If sign is True:
+            v goes with rt
+        If sign is False:
+            v goes with lt
+        The tree is taken apart along the path from v to the root and every
+        piece is put back together with join, so both halves are valid AVL
+        trees and the total cost telescopes to O(log n).
+        Returns (root of left tree, root of right tree).
+        """
+        if self.stats:
+            self.stats.splits += 1
+        self.push_path(v)
+        lt = v.left
+        rt = v.right
+        if lt:
+            lt.parent = None
+        if rt:
+            rt.parent = None
+        ancestor = v.parent
+        child = v
+
+        if sign:
+            rt = self.join(None, v, rt)
+        else:
+            lt = self.join(lt, v, None)
+
+        # Traverse up v's parent pointers, joining each ancestor onto the side it belongs to
+        while ancestor != None:
+            next_ancestor = ancestor.parent
+            if ancestor.right is child:
+                # ancestor and its left subtree come before v
+                outer = ancestor.left
+                if outer:
+                    outer.parent = None
+                lt = self.join(outer, ancestor, lt)
+            else:
+                # ancestor and its right subtree come after v
+                outer = ancestor.right
+                if outer:
+                    outer.parent = None
+                rt = self.join(rt, ancestor, outer)
+            child = ancestor
+            ancestor = next_ancestor
+
+        return (lt, rt)
+
+    def verify(self, root=None):
+        """
+        Check the AVL invariants of the tree rooted at root (the tree's own root
+        by default): parent pointers, stored heights and balances, and the AVL
+        height bound height <= 1.4405 * log2(n + 2) - 0.3277.
+        Raises AssertionError on a violation, returns the number of nodes.
+        """
+        if root is None:
+            root = self.getRoot()
+        count = Sequence_tree.verify(self, root)
+        if count:
+            assert root.height <= 1.4405 * math.log2(count + 2) - 0.3277, "height bound exceeded"
+        return count
+
+    def verify_node(self, node):
+        node_left_height = node.left.height if node.left else -1
+        node_right_height = node.right.height if node.right else -1
+        assert node.height == 1 + max(node_left_height, node_right_height), "stale height"
+        assert node.balance == node_left_height - node_right_height, "stale balance"
+        assert -1 <= node.balance <= 1, "unbalanced node"
+
+
+class Versions:
+    """
+    Old states of the nodes and vertices of a Persistent_AVL_tree.
+    Time is counted in epochs, each snapshot closing the current one. The
+    first write to a node or vertex in an epoch saves its fields as they were,
+    tagged with the range of epochs [lo, hi] that saw them, unless no live
+    snapshot falls in that range. Saved states go away as soon as no live
+    snapshot can read them: all at once when the last snapshot is dropped,
+    otherwise in sweeps paid for by the saves since the previous one.
+    """
+    # positions in a saved node state
+    NODE_FIELDS = ("left", "right", "parent", "height", "balance", "size", "agg", "count", "lazy", "represented")
+    LEFT, RIGHT, PARENT, HEIGHT, BALANCE, SIZE, AGG, COUNT, LAZY, REPRESENTED = range(10)
+    # positions in a saved vertex state
+    VERTEX_FIELDS = ("val", "parent", "first_ptr", "last_ptr")
+    VAL, VERTEX_PARENT, FIRST, LAST = range(4)
+
+    node_fields = operator.attrgetter(*NODE_FIELDS)
+    vertex_fields = operator.attrgetter(*VERTEX_FIELDS)
+
+    def __init__(self):
+        self.epoch = 0
+        self.live = []             # epochs of the snapshots still referenced, ascending
+        self.saved = set()         # nodes with a history
+        self.vertex_history = {}   # vertex -> [(lo, hi, state)]
+        self.vertex_stamp = {}     # vertex -> epoch of its last save
+        self.vertex_born = {}      # vertex -> epoch it joined the tree in
+        self.entries = 0
+        self.swept = 0
+
+    def take(self):
+        epoch = self.epoch
+        self.live.append(epoch)
+        self.epoch += 1
+        return epoch
+
+    def release(self, epoch):
+        self.live.remove(epoch)
+        if not self.live:
+            for node in self.saved:
+                object.__setattr__(node, "history", None)
+            self.saved = set()
+            self.vertex_history = {}
+            self.entries = self.swept = 0
+        elif self.entries >= 2 * self.swept + 64:
+            self.sweep()
+
+    def needed(self, lo, hi):
+        """
+        Whether a live snapshot falls in epochs lo..hi
+        """
+        live = self.live
+        i = bisect.bisect_left(live, lo)
+        return i < len(live) and live[i] <= hi
+
+    def sweep(self):
+        """
+        Drop the saved states no live snapshot can read any more
+        """
+        entries = 0
+        for node in list(self.saved):
+            history = [entry for entry in node.history if self.needed(entry[0], entry[1])]
+            object.__setattr__(node, "history", history if history else None)
+            if history:
+                entries += len(history)
+            else:
+                self.saved.discard(node)
+        for vertex, history in list(self.vertex_history.items()):
+            history = [entry for entry in history if self.needed(entry[0], entry[1])]
+            if history:
+                self.vertex_history[vertex] = history
+                entries += len(history)
+            else:
+                del self.vertex_history[vertex]
+        self.entries = self.swept = entries
+
+    def save_node(self, node):
+        lo = node.stamp
+        hi = self.epoch - 1
+        if self.needed(lo, hi):
+            entry = (lo, hi, self.node_fields(node))
+            if node.history is None:
+                object.__setattr__(node, "history", [entry])
+                self.saved.add(node)
+            else:
+                node.history.append(entry)
+            self.entries += 1
+        object.__setattr__(node, "stamp", self.epoch)
+
+    def save_vertex(self, vertex):
+        lo = self.vertex_stamp.get(vertex, 0)
+        hi = self.epoch - 1
+        if self.needed(lo, hi):
+            self.vertex_history.setdefault(vertex, []).append((lo, hi, self.vertex_fields(vertex)))
+            self.entries += 1
+        self.vertex_stamp[vertex] = self.epoch
+
+    def node_state(self, node, epoch):
+        # read the live fields before the history: a writer saves before it
+        # writes, so if the read raced a write the saved copy is there now
+        state = self.node_fields(node)
+        history = node.history
+        if history:
+            for lo, hi, saved in history:
+                if lo <= epoch <= hi:
+                    return saved
+        return state
+
+    def vertex_state(self, vertex, epoch):
+        if self.vertex_born.get(vertex, 0) > epoch:
+            return None
+        state = self.vertex_fields(vertex)
+        history = self.vertex_history.get(vertex)
+        if history:
+            for lo, hi, saved in history:
+                if lo <= epoch <= hi:
+                    return saved
+        return state
+
+
+class Persistent_AVL_tree(AVL_tree):
+    """
+    AVL_tree backend that supports Euler_Tour_Tree.snapshot. Its nodes, and
+    the vertices it adopts, save their fields in the tree's Versions on the
+    first write after a snapshot, so an update copies only the nodes it
+    touches, O(log n) of them, and a snapshot costs O(1). Parent pointers and
+    the vertices' first_ptr/last_ptr point into the nodes, which rules out
+    plain path copying; keeping every node in place and versioning its
+    fields gives readers the same view.
+    """
+    class Versioned_node(AVL_tree.AVL_node):
+        __slots__ = ("versions", "stamp", "history")
+
+        def __init__(self, *args, **kwargs):
+            object.__setattr__(self, "versions", None)
+            object.__setattr__(self, "stamp", 0)
+            object.__setattr__(self, "history", None)
+            AVL_tree.AVL_node.__init__(self, *args, **kwargs)
+
+        def __setattr__(self, name, value):
+            versions = self.versions
+            if versions is not None and self.stamp != versions.epoch:
+                versions.save_node(self)
+            object.__setattr__(self, name, value)
+
+    class Versioned_vertex(Euler_Tour_Tree.Represented_Node):
+        __slots__ = ()
+
+        def __setattr__(self, name, value):
+            versions = self.first_ptr.versions
+            if versions.vertex_stamp.get(self, 0) != versions.epoch:
+                versions.save_vertex(self)
+            object.__setattr__(self, name, value)
+
+    Node = Versioned_node
+
+    def __init__(self, aggregate=None):
+        AVL_tree.__init__(self, aggregate)
+        self.versions = Versions()
+        # snapshots still read the nodes a tour drops, so they are never recycled
+        self.pool = None
+
+    def stamped(self, node):
+        versions = self.versions
+        object.__setattr__(node, "versions", versions)
+        object.__setattr__(node, "stamp", versions.epoch)
+        return node
+
+    def new_node(self, represented):
+        node = self.stamped(self.Node(represented=represented))
+        self.update_node(node)
+        return node
+
+    def adopt(self, vertex):
+        if not isinstance(vertex.first_ptr, self.Node):
+            versions = self.versions
+            versions.vertex_born[vertex] = versions.epoch
+            versions.vertex_stamp[vertex] = versions.epoch
+            vertex.first_ptr = self.stamped(self.Node(represented=vertex))
+            vertex.last_ptr = vertex.first_ptr
+            vertex.__class__ = Persistent_AVL_tree.Versioned_vertex
+        self.update_node(vertex.first_ptr)
+
+
+class Splay_tree(Sequence_tree):
+    """
+    Splay tree backend. Every access splays the node it touches to the root,
+    so operations are O(log n) amortized and vertices that are used often
+    stay near the top, which pays off on skewed workloads. Joins are O(1)
+    once the pieces are splayed.
+    """
+    Node = AVL_tree.AVL_node
+
+    def splay(self, x):
+        """
+        Rotate x up to the root of its tree, returns x
+        """
+        self.push_path(x)
+        while x.parent:
+            p = x.parent
+            g = p.parent
+            if g is None:
+                if p.left is x:
+                    self.rotateRight(p)
+                else:
+                    self.rotateLeft(p)
+            elif g.left is p and p.left is x:
+                self.rotateRight(g)
+                self.rotateRight(p)
+            elif g.right is p and p.right is x:
+                self.rotateLeft(g)
+                self.rotateLeft(p)
+            elif g.left is p:
+                self.rotateLeft(p)
+                self.rotateRight(g)
+            else:
+                self.rotateRight(p)
+                self.rotateLeft(g)
+        return x
+
+    def root_of(self, node):
+        return self.splay(node)
+
+    def same_tree(self, x, y):
+        self.splay(x)
+        self.splay(y)
+        # x was the root before y was splayed, so it is at most two levels down now
+        while x.parent:
+            x = x.parent
+        return x is y
+
+    def join(self, lt, x, rt):
+        x.left = lt
+        x.right = rt
+        x.parent = None
+        if lt:
+            lt.parent = x
+        if rt:
+            rt.parent = x
+        self.update_node(x)
+        return x
+
+    def split(self, v, sign):
+        if self.stats:
+            self.stats.splits += 1
+        self.splay(v)
+        if sign:
+            lt = v.left
+            v.left = None
+            if lt:
+                lt.parent = None
+            self.update_node(v)
+            return lt, v
+        rt = v.right
+        v.right = None
+        if rt:
+            rt.parent = None
+        self.update_node(v)
+        return v, rt
+
+    def remove_min(self, root):
+        x = root
+        while x.left:
+            x = x.left
+        self.splay(x)
+        rest = x.right
+        x.right = None
+        if rest:
+            rest.parent = None
+        self.update_node(x)
+        return rest, x
+
+    def remove_max(self, root):
+        x = root
+        while x.right:
+            x = x.right
+        self.splay(x)
+        rest = x.left
+        x.left = None
+        if rest:
+            rest.parent = None
+        self.update_node(x)
+        return rest, x
+
+    def rank(self, node):
+        self.splay(node)
+        return node.left.size if node.left else 0
+
+    def select(self, root, k):
+        return self.splay(Sequence_tree.select(self, root, k))
+
+    def prefix_steps(self, node):
+        self.splay(node)
+        return (node.left.steps if node.left else 0) + self.step(node)
+
+    def lowest(self, lo, hi):
+        result = Sequence_tree.lowest(self, lo, hi)
+        self.splay(hi)
+        self.splay(lo)
+        return result
+
+    def range_fold(self, lo, hi):
+        result = Sequence_tree.range_fold(self, lo, hi)
+        # pay for the walks
+        self.splay(hi)
+        self.splay(lo)
+        return result
+
+
+class Treap(Sequence_tree):
+    """
+    Treap backend: every node draws a random priority and the tree is kept a
+    heap on priorities, so it is balanced in expectation and a join is a
+    plain merge along two spines, O(log n) expected.
+    """
+    class Treap_node(AVL_tree.AVL_node):
+        __slots__ = ("priority",)
+
+        def __init__(self, *args, **kwargs):
+            AVL_tree.AVL_node.__init__(self, *args, **kwargs)
+            self.priority = random.random()
+
+    Node = Treap_node
+
+    def merge(self, a, b):
+        """
+        Merge the treaps rooted at a and b, every node of a coming first.
+        Returns the root, whose parent pointer is left for the caller.
+        """
+        if not a:
+            return b
+        if not b:
+            return a
+        if a.priority > b.priority:
+            if a.lazy:
+                self.push(a)
+            r = self.merge(a.right, b)
+            a.right = r
+            r.parent = a
+            self.update_node(a)
+            return a
+        if b.lazy:
+            self.push(b)
+        l = self.merge(a, b.left)
+        b.left = l
+        l.parent = b
+        self.update_node(b)
+        return b
+
+    def split_rank(self, t, k):
+        """
+        Split the treap rooted at t into its first k nodes and the rest.
+        Returns the two roots, whose parent pointers are left for the caller.
+        """
+        if not t:
+            return None, None
+        if t.lazy:
+            self.push(t)
+        left_size = t.left.size if t.left else 0
+        if k <= left_size:
+            l, r = self.split_rank(t.left, k)
+            t.left = r
+            if r:
+                r.parent = t
+            self.update_node(t)
+            return l, t
+        l, r = self.split_rank(t.right, k - left_size - 1)
+        t.right = l
+        if l:
+            l.parent = t
+        self.update_node(t)
+        return t, r
+
+    def detached(self, lt, rt):
+        if lt:
+            lt.parent = None
+        if rt:
+            rt.parent = None
+        return lt, rt
+
+    def join(self, lt, x, rt):
+        x.left = x.right = x.parent = None
+        self.update_node(x)
+        root = self.merge(self.merge(lt, x), rt)
+        root.parent = None
+        return root
+
+    def split(self, v, sign):
+        if self.stats:
+            self.stats.splits += 1
+        k = self.rank(v) + (0 if sign else 1)
+        return self.detached(*self.split_rank(self.root_of(v), k))
+
+    def remove_min(self, root):
+        x, rest = self.detached(*self.split_rank(root, 1))
+        return rest, x
+
+    def remove_max(self, root):
+        rest, x = self.detached(*self.split_rank(root, root.size - 1))
+        return rest, x
+
+    def build(self, nodes, lo=0, hi=None):
+        """
+        Cartesian tree of nodes[lo:hi] on their priorities, in O(n)
+        """
+        if hi is None:
+            hi = len(nodes)
+        if lo >= hi:
+            return None
+        stack = []
+        for i in range(lo, hi):
+            node = nodes[i]
+            node.right = None
+            last = None
+            while stack and stack[-1].priority < node.priority:
+                last = stack.pop()
+            node.left = last
+            if stack:
+                stack[-1].right = node
+            stack.append(node)
+        root = stack[0]
+        root.parent = None
+
+        # fix parent pointers on the way down, augmentation on the way up
+        order = [root]
+        for node in order:
+            for child in (node.left, node.right):
+                if child:
+                    child.parent = node
+                    order.append(child)
+        for node in reversed(order):
+            self.update_node(node)
+        return root
+
+    def verify_node(self, node):
+        for child in (node.left, node.right):
+            assert not child or child.priority <= node.priority, "heap order violated"
+
+
+class Forest:
+    """
+    A dynamic forest over hashable vertex keys, kept as unrooted euler tours.
+    Every vertex has one entry in its tree's tour (its first_ptr) and every
+    edge (u, v) two arcs, u to v and v to u, found in O(1) through an index
+    keyed by the ordered pair. A tree's tour is the cyclic walk around it:
+    after the arc u to v come v's entry, the walk around the subtree beyond
+    v, and the arc back. Rerooting is rotating the cycle to start at a
+    vertex entry, a split and a join, so link and cut are O(log n) with no
+    parent links to reverse, and callers never see represented nodes or
+    AVL pointers.
+    """
+    def __init__(self, aggregate=None, backend=None):
+        self.ett = Euler_Tour_Tree(None, aggregate, backend)
+        self.avl = self.ett.avl
+        self.vertices = {}  # key -> Represented_Node
+        self._keys = {}     # Represented_Node -> key
+        self._arcs = {}     # (key, key) -> AVL node of the arc between them, in that direction
+
+    @classmethod
+    def from_edges(cls, vertices, edges, vals=None, aggregate=None, backend=None):
+        """
+        Build a forest on the given vertex keys and tree edges in O(n),
+        without going through link. vals maps keys to values (None by default).
+        """
+        forest = cls(aggregate, backend)
+        for key in vertices:
+            forest.add_vertex(key, vals.get(key) if vals is not None else None)
+        adjacency = {key: [] for key in forest.vertices}
+        for u, v in edges:
+            if (u, v) in forest._arcs:
+                raise ValueError("duplicate edge %r" % ((u, v),))
+            adjacency[u].append(v)
+            adjacency[v].append(u)
+            forest._arcs[(u, v)] = forest.avl.new_node(None)
+            forest._arcs[(v, u)] = forest.avl.new_node(None)
+
+        # lay out each tree's tour with an iterative DFS
+        seen = set()
+        for r in forest.vertices:
+            if r in seen:
+                continue
+            seen.add(r)
+            tour = [forest.vertices[r].first_ptr]
+            stack = [(r, None, iter(adjacency[r]))]
+            while stack:
+                u, parent, neighbours = stack[-1]
+                v = next(neighbours, None)
+                if v is None:
+                    stack.pop()
+                    if parent is not None:
+                        tour.append(forest._arcs[(u, parent)])
+                    continue
+                if v == parent:
+                    continue
+                if v in seen:
+                    raise ValueError("the edges have a cycle through %r" % ((u, v),))
+                seen.add(v)
+                tour.append(forest._arcs[(u, v)])
+                tour.append(forest.vertices[v].first_ptr)
+                stack.append((v, u, iter(adjacency[v])))
+            forest.avl.build(tour)
+        return forest
+
+    def edges(self):
+        """
+        Every edge once, as a pair of keys
+        """
+        edges = []
+        seen = set()
+        for u, v in self._arcs:
+            if (v, u) not in seen:
+                seen.add((u, v))
+                edges.append((u, v))
+        return edges
+
+    def save(self, path):
+        """
+        Write the forest to path, in the format of Euler_Tour_Tree.save,
+        which keeps rooted tours: the trees are rooted as Euler_Tour_Tree.from_edges
+        roots them on the way out, in O(n). Keys and values must be None,
+        bools, ints, floats or strings, anything else raises ValueError.
+        """
+        keys = list(self.vertices)
+        index = {key: i for i, key in enumerate(keys)}
+        euler, nodes = Euler_Tour_Tree.from_edges(len(keys), [(index[u], index[v]) for u, v in self.edges()],
+                                                  vals=[self.vertices[key].get_val() for key in keys])
+        euler.save(path, nodes, keys)
+
+    @classmethod
+    def load(cls, path, aggregate=None, backend=None):
+        """
+        Read a forest written by save, the edges coming back from the tours
+        """
+        euler, vertices, keys = Euler_Tour_Tree.read(path)
+        if keys is None:
+            raise ValueError("%s holds no vertex keys, load it with Euler_Tour_Tree.load" % (path,))
+        index = dict(zip(vertices, keys))
+        edges = [(key, index[vertex.get_parent()]) for key, vertex in zip(keys, vertices) if vertex.get_parent()]
+        vals = {key: vertex.get_val() for key, vertex in zip(keys, vertices)}
+        return cls.from_edges(keys, edges, vals, aggregate, backend)
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def __contains__(self, key):
+        return key in self.vertices
+
+    def add_vertex(self, key, val=None):
+        """
+        Add an isolated vertex
+        """
+        if key in self.vertices:
+            raise ValueError("vertex %r already exists" % (key,))
+        node = Euler_Tour_Tree.Represented_Node(val, children=None)
+        self.avl.adopt(node)
+        self.vertices[key] = node
+        self._keys[node] = key
+
+    def has_edge(self, u, v):
+        return (u, v) in self._arcs
+
+    def arc(self, u, v):
+        """
+        The tour entry of the arc from u to v, O(1)
+        """
+        return self._arcs[(u, v)]
+
+    def rotate(self, u):
+        """
+        Rotate u's tour to start at u's entry, returns its root, O(log n)
+        """
+        before, rest = self.avl.split(self.vertices[u].first_ptr, True)
+        return self.avl.concatenate_roots(rest, before)
+
+    def reroot(self, u):
+        """
+        Make u the vertex its tree's tour starts at, see find_root
+        """
+        self.rotate(u)
+
+    def link(self, u, v):
+        """
+        Add the edge (u, v) between two different trees, O(log n)
+        """
+        avl = self.avl
+        if avl.same_tree(self.vertices[u].first_ptr, self.vertices[v].first_ptr):
+            raise ValueError("%r and %r are already connected" % (u, v))
+        uv = avl.new_node(None)
+        vu = avl.new_node(None)
+        u_tour = self.rotate(u)
+        v_tour = self.rotate(v)
+        avl.join_many([u_tour, uv, v_tour, vu])
+        self._arcs[(u, v)] = uv
+        self._arcs[(v, u)] = vu
+
+    def cut(self, u, v):
+        """
+        Remove the edge (u, v), O(log n). The stretch of the tour between its
+        two arcs is the side that comes away. It can start part way around
+        its tree, so it is rotated to start at its endpoint of the edge, which
+        keeps every tour starting at a vertex.
+        """
+        try:
+            uv = self._arcs.pop((u, v))
+        except KeyError:
+            raise ValueError("no edge between %r and %r" % (u, v))
+        vu = self._arcs.pop((v, u))
+        avl = self.avl
+        if avl.rank(uv) > avl.rank(vu):
+            uv, vu = vu, uv
+        before, rest = avl.split(uv, True)
+        inside, after = avl.split(vu, False)
+        inside, _ = avl.remove_min(inside)
+        inside, _ = avl.remove_max(inside)
+        avl.release(uv)
+        avl.release(vu)
+        avl.concatenate_roots(before, after)
+        self.rotate(v if avl.same_tree(self.vertices[v].first_ptr, inside) else u)
+
+    def connected(self, u, v):
+        """
+        Whether u and v are in the same tree, O(log n)
+        """
+        return self.avl.same_tree(self.vertices[u].first_ptr, self.vertices[v].first_ptr)
+
+    def find_root(self, u):
+        """
+        Key of the vertex u's tour starts at. Two vertices are connected
+        exactly when this agrees, as long as no link or cut happens in between.
+        """
+        return self._keys[self.vertices[u].find_root()]
+
+    def component_size(self, u):
+        """
+        Number of vertices in u's tree, O(log n). A tree of k vertices has a
+        tour of k entries and 2 (k - 1) arcs.
+        """
+        return (self.avl.root_of(self.vertices[u].first_ptr).size + 2) // 3
+
+    def component_aggregate(self, u):
+        """
+        The forest's aggregate folded over u's tree, O(log n)
+        """
+        return self.avl.root_of(self.vertices[u].first_ptr).agg
+
+    def set_val(self, u, val):
+        self.ett.set_val(self.vertices[u], val)
+
+    def search(self, u, keep):
+        """
+        Keys of the vertices in u's tree whose value passes keep, see Sequence_tree.search
+        """
+        found = self.avl.search(self.avl.root_of(self.vertices[u].first_ptr), keep)
+        return [self._keys[vertex] for vertex in found]
+
+
+class Dynamic_Connectivity:
+    """
+    Connectivity of a general graph under edge insertions and deletions
+    (Holm, de Lichtenberg and Thorup), over hashable vertex keys.
+    Every edge has a level that starts at 0 and only goes up. Level i keeps
+    a Forest spanning the tree edges of level i or more, so forest 0 spans
+    every component; the remaining edges are non-tree edges. Each vertex of
+    a level's forest is flagged TREE if it has a tree edge of exactly that
+    level and NONTREE if it has a non-tree edge of that level, and the flags
+    are or-ed up the AVL nodes' aggregates, so the flagged vertices of a
+    tree are found in O(log n) each.
+    When a tree edge goes, a replacement is looked for from its level down,
+    on the smaller side of the cut. The edges looked at without success go
+    up a level; a level i tree has at most n / 2**i vertices, so there are
+    at most log2 n levels and updates take O(log^2 n) amortized.
+    connected is a query on forest 0.
+    """
+    TREE = 1
+    NONTREE = 2
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.forests = []       # level -> Forest of the tree edges of that level or more
+        self.tree_edges = []    # level -> key -> set of keys joined to it by a tree edge of that level
+        self.nontree_edges = [] # level -> key -> set of keys joined to it by a non-tree edge of that level
+        self.levels = {}        # (key, key) -> level of the edge, under both orders
+        self.add_level()
+
+    def add_level(self):
+        self.forests.append(Forest(Aggregate.FLAGS, self.backend))
+        self.tree_edges.append({})
+        self.nontree_edges.append({})
+
+    def __len__(self):
+        return len(self.forests[0])
+
+    def __contains__(self, key):
+        return key in self.forests[0]
+
+    def add_vertex(self, key):
+        """
+        Add an isolated vertex
+        """
+        self.forests[0].add_vertex(key, 0)
+
+    def has_edge(self, u, v):
+        return (u, v) in self.levels
+
+    def connected(self, u, v):
+        """
+        Whether u and v are in the same component, O(log n)
+        """
+        return self.forests[0].connected(u, v)
+
+    def component_size(self, u):
+        """
+        Number of vertices in u's component, O(log n)
+        """
+        return self.forests[0].component_size(u)
+
+    def insert_edge(self, u, v):
+        """
+        Add the edge (u, v), adding missing vertices, O(log n) plus rerooting
+        """
+        if u == v:
+            raise ValueError("self loop on %r" % (u,))
+        if (u, v) in self.levels:
+            raise ValueError("duplicate edge %r" % ((u, v),))
+        for key in (u, v):
+            if key not in self.forests[0]:
+                self.add_vertex(key)
+        self.levels[(u, v)] = self.levels[(v, u)] = 0
+        if self.forests[0].connected(u, v):
+            self.add(self.nontree_edges, 0, u, v)
+        else:
+            self.forests[0].link(u, v)
+            self.add(self.tree_edges, 0, u, v)
+
+    def delete_edge(self, u, v):
+        """
+        Remove the edge (u, v). If it held its component together, the
+        component is reconnected through a replacement edge when there is one.
+        """
+        try:
+            level = self.levels.pop((u, v))
+        except KeyError:
+            raise ValueError("no edge between %r and %r" % (u, v))
+        del self.levels[(v, u)]
+        if v in self.nontree_edges[level].get(u, ()):
+            self.discard(self.nontree_edges, level, u, v)
+            return
+        self.discard(self.tree_edges, level, u, v)
+        for i in range(level + 1):
+            self.forests[i].cut(u, v)
+        for i in range(level, -1, -1):
+            if self.replace(i, u, v):
+                return
+
+    def replace(self, i, u, v):
+        """
+        Look for an edge of level i across the cut between u and v in forest i.
+        The tree edges of level i on the smaller side go up a level first,
+        then its non-tree edges of level i are tried one by one, each either
+        reconnecting the two sides or going up a level. Returns whether a
+        replacement was found.
+        """
+        forest = self.forests[i]
+        small = u if forest.component_size(u) <= forest.component_size(v) else v
+        if i + 1 == len(self.forests):
+            self.add_level()
+        upper = self.forests[i + 1]
+
+        for x in forest.search(small, lambda flags: flags & self.TREE):
+            for y in list(self.tree_edges[i][x]):
+                self.discard(self.tree_edges, i, x, y)
+                for key in (x, y):
+                    if key not in upper:
+                        upper.add_vertex(key, 0)
+                upper.link(x, y)
+                self.add(self.tree_edges, i + 1, x, y)
+                self.levels[(x, y)] = self.levels[(y, x)] = i + 1
+
+        for x in forest.search(small, lambda flags: flags & self.NONTREE):
+            for y in list(self.nontree_edges[i].get(x, ())):
+                self.discard(self.nontree_edges, i, x, y)
+                if forest.connected(x, y):
+                    self.add(self.nontree_edges, i + 1, x, y)
+                    self.levels[(x, y)] = self.levels[(y, x)] = i + 1
+                    continue
+                # (x, y) crosses the cut: it becomes a tree edge of level i
+                for j in range(i + 1):
+                    self.forests[j].link(x, y)
+                self.add(self.tree_edges, i, x, y)
+                return True
+        return False
+
+    def add(self, edges, i, u, v):
+        edges[i].setdefault(u, set()).add(v)
+        edges[i].setdefault(v, set()).add(u)
+        self.flag(i, u)
+        self.flag(i, v)
+
+    def discard(self, edges, i, u, v):
+        edges[i][u].discard(v)
+        edges[i][v].discard(u)
+        self.flag(i, u)
+        self.flag(i, v)
+
+    def flag(self, i, key):
+        """
+        Bring key's flags at level i up to date with its edges of that level
+        """
+        flags = (self.TREE if self.tree_edges[i].get(key) else 0) | (self.NONTREE if self.nontree_edges[i].get(key) else 0)
+        forest = self.forests[i]
+        if key not in forest:
+            if not flags:
+                return
+            forest.add_vertex(key, 0)
+        if forest.vertices[key].val != flags:
+            forest.set_val(key, flags)
+
+class Offline_Connectivity:
+    """
+    Answers every connectivity query of an operation log known in full up
+    front: ("link", u, v) adds the edge (u, v), ("cut", u, v) removes it and
+    ("connected", u, v) asks whether u and v are joined at that point.
+    Vertices are any hashable keys and need not be declared.
+    Each edge is alive over an interval of queries. The intervals are laid
+    over a segment tree on the queries, O(log q) nodes each, and a DFS of
+    the segment tree unions an edge's endpoints on the way into its nodes
+    and undoes the unions on the way out. The union-find has no path
+    compression, so that undoing is exact, but unions by size, so finds are
+    O(log n). The whole log takes O(m log q log n) for m edges and q
+    queries. The edges need not form a forest, so the answers are those of
+    Forest and of Dynamic_Connectivity on the same log.
+    """
+    def __init__(self, log):
+        self.log = list(log)
+
+    def answers(self):
+        """
+        The answers to the log's connected queries, in order, as booleans
+        """
+        index = {}          # key -> union-find id
+        queries = []        # (id, id) of each query
+        alive = {}          # (key, key) -> (first query the edge is alive for, link)
+        intervals = []      # (first query, query after the last, u id, v id)
+        for op, u, v in self.log:
+            for key in (u, v):
+                if key not in index:
+                    index[key] = len(index)
+            if op == "connected":
+                queries.append((index[u], index[v]))
+            elif op == "link":
+                if (u, v) in alive or (v, u) in alive:
+                    raise ValueError("duplicate edge %r" % ((u, v),))
+                alive[(u, v)] = len(queries)
+            elif op == "cut":
+                edge = (u, v) if (u, v) in alive else (v, u)
+                if edge not in alive:
+                    raise ValueError("no edge between %r and %r" % (u, v))
+                intervals.append((alive.pop(edge), len(queries), index[u], index[v]))
+            else:
+                raise ValueError("unknown operation %r" % (op,))
+        for (u, v), start in alive.items():
+            intervals.append((start, len(queries), index[u], index[v]))
+
+        # edges over a bottom up segment tree on the queries
+        leaves = 1
+        while leaves < len(queries):
+            leaves *= 2
+        edges_at = [[] for _ in range(2 * leaves)]
+        for lo, hi, u, v in intervals:
+            lo += leaves
+            hi += leaves
+            while lo < hi:
+                if lo & 1:
+                    edges_at[lo].append((u, v))
+                    lo += 1
+                if hi & 1:
+                    hi -= 1
+                    edges_at[hi].append((u, v))
+                lo >>= 1
+                hi >>= 1
+
+        parent = list(range(len(index)))
+        size = [1] * len(index)
+        history = []        # roots hung under another root, most recent last
+
+        def find(x):
+            while parent[x] != x:
+                x = parent[x]
+            return x
+
+        answers = [False] * len(queries)
+        stack = [(1, None)] if queries else []
+        while stack:
+            node, undo_to = stack.pop()
+            if undo_to is not None:
+                while len(history) > undo_to:
+                    x = history.pop()
+                    size[parent[x]] -= size[x]
+                    parent[x] = x
+                continue
+            stack.append((node, len(history)))
+            for u, v in edges_at[node]:
+                u = find(u)
+                v = find(v)
+                if u != v:
+                    if size[u] > size[v]:
+                        u, v = v, u
+                    parent[u] = v
+                    size[v] += size[u]
+                    history.append(u)
+            if node >= leaves:
+                if node - leaves < len(queries):
+                    u, v = queries[node - leaves]
+                    answers[node - leaves] = find(u) == find(v)
             else:
-                T1.setRoot(x)
-            return T1
-
-        else: 
-            x = T1.find_max()
-            if T1.getRoot() is x and T1.getRoot() is T1.find_min(): 
-                T2_min = T2.find_min()
-                T2_min.left = T1.getRoot()
-                T1.getRoot().parent = T2_min
-                T1.getRoot().height = 0
-                T2.update_height(T1.getRoot())
-                T2.rebalance(T2.getRoot())
-                return T2 
-
-            if x is not T1.getRoot():
-                x_parent = x.parent
-                if x is x.parent.right:
-                    x.parent.right = None
+                stack.append((2 * node + 1, None))
+                stack.append((2 * node, None))
+        return answers
+
+
+class RW_lock:
+    """
+    Many readers or one writer. A waiting writer holds off new readers, so
+    a steady stream of queries cannot starve updates.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class Concurrent_Euler_Tour_Tree:
+    """
+    Wraps an Euler_Tour_Tree for queries from many threads alongside
+    updates. Every tree of the forest has an RW_lock, found through a table
+    keyed by the AVL root of its tour: queries share it, link, cut and
+    reroot hold it exclusively, so work on different trees never waits on
+    each other. A root is looked up by walking parent pointers, which can
+    race with a writer, so every lock is checked again once held: the root
+    must still be the one it was taken for. The one global lock, _cond,
+    only guards registering new trees and the count of writers mid-update;
+    lookups of known trees skip it. The Splay_tree backend is not
+    supported, as it restructures on reads.
+    """
+    def __init__(self, euler):
+        if isinstance(euler.avl, Splay_tree):
+            raise ValueError("the splay backend restructures on reads and cannot be shared")
+        self.euler = euler
+        self._cond = threading.Condition(threading.Lock())
+        self._locks = {}    # AVL root -> RW_lock of its tree
+        self._writers = 0   # writers in the middle of an update
+
+    @staticmethod
+    def avl_root(vertex):
+        ptr = vertex.first_ptr
+        while ptr.parent:
+            ptr = ptr.parent
+        return ptr
+
+    def _lock_of(self, vertex):
+        """
+        The lock currently registered for vertex's tree. Known trees are
+        looked up without taking _cond: a plain dict read cannot tear, and a
+        stale answer is caught by the check in _acquire. _cond is only taken
+        to register a tree the first time it is asked for, which must wait
+        until no writer is half way through an update, whose trees may show
+        roots that are not final.
+        """
+        lock = self._locks.get(self.avl_root(vertex))
+        if lock:
+            return lock
+        with self._cond:
+            while True:
+                root = self.avl_root(vertex)
+                lock = self._locks.get(root)
+                if lock:
+                    return lock
+                if not self._writers:
+                    lock = self._locks[root] = RW_lock()
+                    return lock
+                self._cond.wait()
+
+    @contextlib.contextmanager
+    def reading(self, *vertices):
+        """
+        Hold the trees of vertices shared, nothing in them changes until the block ends
+        """
+        locks, _ = self._acquire(vertices, False)
+        try:
+            yield
+        finally:
+            for lock in locks:
+                lock.release_read()
+
+    @contextlib.contextmanager
+    def writing(self, *vertices):
+        """
+        Hold the trees of vertices exclusively. On the way out each of the
+        vertices' trees, however the block has regrouped them, is registered
+        under its new root, so vertices must cover every tree the block
+        touches, including the pieces a cut leaves behind.
+        """
+        locks, roots = self._acquire(vertices, True)
+        with self._cond:
+            self._writers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                for root in roots:
+                    del self._locks[root]
+                spare = list(locks)
+                for vertex in vertices:
+                    root = self.avl_root(vertex)
+                    if root not in self._locks:
+                        self._locks[root] = spare.pop() if spare else RW_lock()
+                self._writers -= 1
+                self._cond.notify_all()
+            for lock in locks:
+                lock.release_write()
+
+    def _acquire(self, vertices, exclusive):
+        while True:
+            locks = []
+            for vertex in vertices:
+                lock = self._lock_of(vertex)
+                if lock not in locks:
+                    locks.append(lock)
+            # a fixed order keeps two writers from each holding what the other wants
+            locks.sort(key=id)
+            for lock in locks:
+                if exclusive:
+                    lock.acquire_write()
+                else:
+                    lock.acquire_read()
+            # the trees may have changed hands while we waited. No _cond here:
+            # a writer re-registers its trees before releasing their locks, so
+            # once every root maps to a lock we hold, neither the trees nor
+            # their entries can change under us
+            roots = set(self.avl_root(vertex) for vertex in vertices)
+            if all(self._locks.get(root) in locks for root in roots):
+                return locks, roots
+            for lock in locks:
+                if exclusive:
+                    lock.release_write()
                 else:
-                    x.parent.left = None
-                x.parent = None
-                T1.update_height(x_parent)
-                T1.rebalance_node_to_root(x_parent)
-                h = T1.getRoot().height
+                    lock.release_read()
+
+    def link(self, u, v):
+        with self.writing(u, v):
+            self.euler.link(u, v)
+
+    def cut(self, v):
+        p = v.get_parent()
+        if p is None:
+            raise ValueError("v is the root of its tree, there is nothing to cut")
+        with self.writing(v, p):
+            if v.get_parent() is not p:
+                raise ValueError("v was moved by another writer")
+            return self.euler.cut(v)
+
+    def reroot(self, v):
+        with self.writing(v):
+            self.euler.reroot(v)
+
+    def set_val(self, v, val):
+        with self.writing(v):
+            self.euler.set_val(v, val)
+
+    def subtree_add(self, v, delta):
+        with self.writing(v):
+            self.euler.subtree_add(v, delta)
+
+    def subtree_aggregate(self, v):
+        # range_fold leaves pending tags where they are, so a shared hold is enough
+        with self.reading(v):
+            return self.euler.subtree_aggregate(v)
+
+    def find_root(self, v):
+        with self.reading(v):
+            return v.find_root()
+
+    def connected(self, u, v):
+        with self.reading(u, v):
+            return self.avl_root(u) is self.avl_root(v)
+
+    def subtree_size(self, v):
+        with self.reading(v):
+            avl = self.euler.avl
+            return (avl.rank(v.last_ptr) - avl.rank(v.first_ptr)) // 2 + 1
+
+    def tour(self, v):
+        """
+        The represented vertices of v's tree in euler tour order
+        """
+        with self.reading(v):
+            return list(self.euler.iter_tour(v))
+
+
+class Compact_Euler_Tour_Tree:
+    """
+    Euler tour trees over the vertices 0..n-1 with no per-node objects.
+    Every tour entry is an integer id into parallel arrays (left, right,
+    parent, height, size, represented), and the represented tree is kept as
+    vertex_parent/first/last arrays, with -1 standing for None. Entries
+    0..n-1 are made for the vertices and the rest come from a free list;
+    first[v] and last[v] say which entries are v's first and last
+    appearances, which after a reroot need not be entry v.
+    This is a standalone class, not a Sequence_tree backend: the backends
+    work on node objects, their attributes and their identity, which is the
+    per-node cost this class exists to avoid. The algorithms are those of
+    AVL_tree and Euler_Tour_Tree written against ids, so link, cut, reroot
+    and the queries keep their bounds, but a change to AVL_tree.join or
+    split has to be made here as well. There are no aggregates, subtree_add,
+    batches or Forest on top of it.
+    """
+    def __init__(self, n):
+        self.n = n
+        capacity = 2 * n
+        self.left = array("i", [-1]) * capacity
+        self.right = array("i", [-1]) * capacity
+        self.parent = array("i", [-1]) * capacity
+        self.height = array("b", [0]) * capacity
+        self.size = array("i", [1]) * capacity
+        self.represented = array("i", range(n)) + array("i", [-1]) * n
+        self.vertex_parent = array("i", [-1]) * n
+        self.first = array("i", range(n))
+        self.last = array("i", range(n))
+        self.free = array("i", range(capacity - 1, n - 1, -1))
+
+    @classmethod
+    def from_parent_array(cls, parents):
+        """
+        Build from a parent array (None or negative for roots) in O(n), like
+        Euler_Tour_Tree.from_parent_array, with the same ValueError for
+        parents out of range or on a cycle
+        """
+        n = len(parents)
+        tree = cls(n)
+        # children in CSR form
+        degree = array("i", [0]) * (n + 1)
+        linked = 0
+        for i, p in enumerate(parents):
+            if p is not None and p >= 0:
+                if p >= n:
+                    raise ValueError("parent %r of vertex %d is out of range" % (p, i))
+                degree[p + 1] += 1
+                linked += 1
+        if n and linked == n:
+            raise ValueError("the parents have a cycle: no vertex is a root")
+        for i in range(n):
+            degree[i + 1] += degree[i]
+        fill = array("i", degree)
+        children = array("i", [0]) * max(n - 1, 0)
+        roots = []
+        for i, p in enumerate(parents):
+            if p is None or p < 0:
+                roots.append(i)
+            else:
+                tree.vertex_parent[i] = p
+                children[fill[p]] = i
+                fill[p] += 1
+
+        reached = 0
+        for r in roots:
+            tour = array("i", [r])
+            stack = [r]
+            cursor = [degree[r]]
+            while stack:
+                vertex = stack[-1]
+                if cursor[-1] == degree[vertex + 1]:
+                    stack.pop()
+                    cursor.pop()
+                    tree.last[vertex] = tour[-1]
+                    if stack:
+                        x = tree.free.pop()
+                        tree.represented[x] = stack[-1]
+                        tour.append(x)
+                    continue
+                child = children[cursor[-1]]
+                cursor[-1] += 1
+                tour.append(child)
+                stack.append(child)
+                cursor.append(degree[child])
+            reached += (len(tour) + 1) // 2
+            tree.build(tour, 0, len(tour))
+        if reached < n:
+            raise ValueError("the parents have a cycle: %d of %d vertices are not below a root" % (n - reached, n))
+        return tree
+
+    def memory_usage(self):
+        """
+        Bytes held by the arrays
+        """
+        return sum(len(a) * a.itemsize for a in (self.left, self.right, self.parent, self.height, self.size,
+                                                 self.represented, self.vertex_parent, self.first, self.last, self.free))
+
+    # AVL primitives on ids
 
+    def update_node(self, x):
+        left = self.left[x]
+        right = self.right[x]
+        height = self.height
+        size = self.size
+        left_height = height[left] if left >= 0 else -1
+        right_height = height[right] if right >= 0 else -1
+        height[x] = 1 + (left_height if left_height > right_height else right_height)
+        size[x] = 1 + (size[left] if left >= 0 else 0) + (size[right] if right >= 0 else 0)
+
+    def balance(self, x):
+        left = self.left[x]
+        right = self.right[x]
+        return (self.height[left] if left >= 0 else -1) - (self.height[right] if right >= 0 else -1)
+
+    def rotateLeft(self, x):
+        left = self.left
+        right = self.right
+        parent = self.parent
+        r = right[x]
+        rl = left[r]
+        right[x] = rl
+        if rl >= 0:
+            parent[rl] = x
+        p = parent[x]
+        parent[r] = p
+        if p >= 0:
+            if left[p] == x:
+                left[p] = r
             else:
-                if x.left:
-                    T1.setRoot(x.left)
-                    x.left.parent = None
-                    x.left = None
-                T1.update_height(T1.getRoot())
-                T1.rebalance(T1.getRoot())
-                h = T1.getRoot().height
-
-            T2.update_height(T2.find_min())
-            v = T2.getRoot()
-            while v.height != h+1 and v.height != h:
-                v = v.right
-            u = v.parent
+                right[p] = r
+        left[r] = x
+        parent[x] = r
+        self.update_node(x)
+        self.update_node(r)
+        return r
 
-            x.left = T1.getRoot()
-            x.right = v
-            v.parent = x
-            T1.getRoot().parent = x 
-
-            if u:
-                u.left = x
-                x.parent = u
-                T2.update_height(x)
-                T2.rebalance(u)
+    def rotateRight(self, x):
+        left = self.left
+        right = self.right
+        parent = self.parent
+        l = left[x]
+        lr = right[l]
+        left[x] = lr
+        if lr >= 0:
+            parent[lr] = x
+        p = parent[x]
+        parent[l] = p
+        if p >= 0:
+            if right[p] == x:
+                right[p] = l
             else:
-                T2.setRoot(x)
-            return T2
+                left[p] = l
+        right[l] = x
+        parent[x] = l
+        self.update_node(x)
+        self.update_node(l)
+        return l
 
-    
-    def split(self, v, sign):
+    def retrace(self, x):
         """
-        Split self AVL Tree in two sections, lt and rt, with lt being elements less than v, and rt being elements greater than v.
-        If sign is True:
-            v goes with rt
-        If sign is False:
-            v goes with lt
+        Same as AVL_tree.retrace
+        """
+        root = x
+        while x >= 0:
+            self.update_node(x)
+            b = self.balance(x)
+            if b < -1:
+                if self.balance(self.right[x]) > 0:
+                    self.rotateRight(self.right[x])
+                x = self.rotateLeft(x)
+            elif b > 1:
+                if self.balance(self.left[x]) < 0:
+                    self.rotateLeft(self.left[x])
+                x = self.rotateRight(x)
+            root = x
+            x = self.parent[x]
+        return root
+
+    def join(self, lt, x, rt):
+        """
+        Same as AVL_tree.join
+        """
+        left = self.left
+        right = self.right
+        parent = self.parent
+        height = self.height
+        lt_height = height[lt] if lt >= 0 else -1
+        rt_height = height[rt] if rt >= 0 else -1
+
+        if lt_height > rt_height + 1:
+            u = lt
+            v = right[lt]
+            while v >= 0 and height[v] > rt_height + 1:
+                u = v
+                v = right[v]
+            left[x] = v
+            right[x] = rt
+            if v >= 0:
+                parent[v] = x
+            if rt >= 0:
+                parent[rt] = x
+            right[u] = x
+            parent[x] = u
+            self.update_node(x)
+            return self.retrace(u)
+
+        if rt_height > lt_height + 1:
+            u = rt
+            v = left[rt]
+            while v >= 0 and height[v] > lt_height + 1:
+                u = v
+                v = left[v]
+            left[x] = lt
+            right[x] = v
+            if lt >= 0:
+                parent[lt] = x
+            if v >= 0:
+                parent[v] = x
+            left[u] = x
+            parent[x] = u
+            self.update_node(x)
+            return self.retrace(u)
+
+        left[x] = lt
+        right[x] = rt
+        parent[x] = -1
+        if lt >= 0:
+            parent[lt] = x
+        if rt >= 0:
+            parent[rt] = x
+        self.update_node(x)
+        return x
+
+    def remove_min(self, root):
+        x = root
+        while self.left[x] >= 0:
+            x = self.left[x]
+        p = self.parent[x]
+        child = self.right[x]
+        if child >= 0:
+            self.parent[child] = p
+        if p >= 0:
+            self.left[p] = child
+        remaining = self.retrace(p) if p >= 0 else child
+        self.right[x] = -1
+        self.parent[x] = -1
+        self.update_node(x)
+        return remaining, x
+
+    def remove_max(self, root):
+        x = root
+        while self.right[x] >= 0:
+            x = self.right[x]
+        p = self.parent[x]
+        child = self.left[x]
+        if child >= 0:
+            self.parent[child] = p
+        if p >= 0:
+            self.right[p] = child
+        remaining = self.retrace(p) if p >= 0 else child
+        self.left[x] = -1
+        self.parent[x] = -1
+        self.update_node(x)
+        return remaining, x
+
+    def concatenate(self, lt, rt):
+        """
+        Concatenate the trees rooted at lt and rt, returns the new root
+        """
+        if lt < 0:
+            return rt
+        if rt < 0:
+            return lt
+        lt, x = self.remove_max(lt)
+        return self.join(lt, x, rt)
+
+    def split(self, x, sign):
+        """
+        Same as AVL_tree.split, returns (root of left tree, root of right tree)
         """
-        # Outer/Left Pointer
-        lt = None
+        left = self.left
+        right = self.right
+        parent = self.parent
+        lt = left[x]
+        rt = right[x]
+        if lt >= 0:
+            parent[lt] = -1
+        if rt >= 0:
+            parent[rt] = -1
+        ancestor = parent[x]
+        child = x
+        left[x] = right[x] = parent[x] = -1
+
         if sign:
-            lt = v.left if v.left else None
+            rt = self.join(-1, x, rt)
         else:
-            lt = v.right if v.right else None
-        
-        # Inner/Right Pointer
-        rt = v
-        
-        ancestor = v.parent
-        
-        # boolean representing whether ancestor is greater or less than v
-        increase = True
-        if (ancestor and ancestor.right == v):
-            increase = False
+            lt = self.join(lt, x, -1)
 
-        # Traverse up v's parent pointers, redirecting pointers to "unzip" the BST bottom up
-        while ancestor != None:
-            if (not increase and sign) or (increase and not sign):
-                if sign:
-                    ancestor.right = lt
-                else:
-                    ancestor.left = lt
+        while ancestor >= 0:
+            next_ancestor = parent[ancestor]
+            if right[ancestor] == child:
+                outer = left[ancestor]
+                if outer >= 0:
+                    parent[outer] = -1
+                lt = self.join(outer, ancestor, lt)
+            else:
+                outer = right[ancestor]
+                if outer >= 0:
+                    parent[outer] = -1
+                rt = self.join(rt, ancestor, outer)
+            child = ancestor
+            ancestor = next_ancestor
+        return lt, rt
 
-                if lt:
-                    lt.parent = ancestor
-                lt = ancestor
-                # recomputing height and balance
-                lt_left_height = lt.left.height if lt.left else -1
-                lt_right_height = lt.right.height if lt.right else -1
-                lt.height = 1 + max(lt_left_height, lt_right_height)
-                lt.balance = lt_left_height - lt_right_height
+    def build(self, ids, lo, hi):
+        """
+        Perfectly balanced tree over ids[lo:hi], returns its root
+        """
+        if lo >= hi:
+            return -1
+        mid = (lo + hi) // 2
+        x = ids[mid]
+        l = self.build(ids, lo, mid)
+        r = self.build(ids, mid + 1, hi)
+        self.left[x] = l
+        self.right[x] = r
+        self.parent[x] = -1
+        if l >= 0:
+            self.parent[l] = x
+        if r >= 0:
+            self.parent[r] = x
+        self.update_node(x)
+        return x
 
-            else:
-                if sign:
-                    ancestor.left = rt
-                else:
-                    ancestor.right = rt
-                
-                if rt:
-                    rt.parent = ancestor
-                rt = ancestor
-                # recomputing height and balance
-                rt_left_height = rt.left.height if rt.left else -1
-                rt_right_height = rt.right.height if rt.right else -1
-                rt.height = 1 + max(rt_left_height, rt_right_height)
-                rt.balance = rt_left_height - rt_right_height
-
-            prev = ancestor
-            ancestor = prev.parent
-            if ancestor:
-                # recomputing height and balance
-                ancestor_left_height = ancestor.left.height if ancestor.left else -1
-                ancestor_right_height = ancestor.right.height if ancestor.right else -1
-                ancestor.height = 1 + max(ancestor_left_height, ancestor_right_height)
-                ancestor.balance = ancestor_left_height - ancestor_right_height
-            if ancestor and ancestor.right == prev:
-                increase = False
-            else:
-                increase = True
+    def successor(self, x):
+        if self.right[x] >= 0:
+            x = self.right[x]
+            while self.left[x] >= 0:
+                x = self.left[x]
+            return x
+        while self.parent[x] >= 0 and self.right[self.parent[x]] == x:
+            x = self.parent[x]
+        return self.parent[x]
 
-        # return (root of left tree, root of right tree)
-        return (lt, rt)
-        
-    def cutting(self, first_v, last_v):
+    def predecessor(self, x):
+        if self.left[x] >= 0:
+            x = self.left[x]
+            while self.right[x] >= 0:
+                x = self.right[x]
+            return x
+        while self.parent[x] >= 0 and self.left[self.parent[x]] == x:
+            x = self.parent[x]
+        return self.parent[x]
+
+    def rank(self, x):
         """
-        Cut out v subtree from euler tour representation
+        Position of x in its tour, O(log n)
         """
-        # split by first appearance of v in euler tour
-        lt, rt = self.split(first_v, True)
-        
-        middle_T = AVL_tree()
-        middle_T.setRoot(rt)
+        size = self.size
+        left = self.left
+        parent = self.parent
+        r = size[left[x]] if left[x] >= 0 else 0
+        while parent[x] >= 0:
+            p = parent[x]
+            if self.right[p] == x:
+                r += 1 + (size[left[p]] if left[p] >= 0 else 0)
+            x = p
+        return r
 
-        # split by last appearance of v in euler tour
-        lt2, rt2 = middle_T.split(last_v, False)
+    def avl_root(self, x):
+        parent = self.parent
+        while parent[x] >= 0:
+            x = parent[x]
+        return x
 
-        left_T = AVL_tree()
-        left_T.setRoot(lt)
-        left_T.rebalance(left_T.getRoot())
+    def new_occurrence(self, v):
+        x = self.free.pop()
+        self.represented[x] = v
+        self.left[x] = self.right[x] = self.parent[x] = -1
+        self.height[x] = 0
+        self.size[x] = 1
+        return x
 
-        right_T = AVL_tree()
-        right_T.setRoot(lt2)
-        right_T.rebalance(right_T.getRoot())
+    def release(self, x):
+        self.represented[x] = -1
+        self.free.append(x)
 
-        v_subtree = AVL_tree()
-        v_subtree.setRoot(rt2)
-        v_subtree.rebalance(v_subtree.getRoot())
-       
-        # concatenate and return subtree before first appearance of v and subtree after last appearance of v
-        # return cut out v subtree
-        return left_T.concatenate(right_T), v_subtree
+    # euler tour operations
 
-    def linking(self, u, v):
+    def find_root(self, v):
         """
-        Link u subtree as a child of v in euler tour representation
+        Root of v's represented tree
         """
-        # Update represented tree
-        # append v to w's children
-        v.add_child(u)
-        # set v's parent to w
-        u.set_parent(v)
+        x = self.avl_root(self.last[v])
+        while self.left[x] >= 0:
+            x = self.left[x]
+        return self.represented[x]
 
-        # Update AVL Tree
-        # split based on last appearance of v in AVL Tree
-        v_ptr = v.get_last_ptr()
-        lt, rt = self.split(v_ptr, True)
-        ut = u.find_avl_root()
+    def connected(self, u, v):
+        return self.avl_root(self.first[u]) == self.avl_root(self.first[v])
 
-        left_T = AVL_tree()
-        left_T.setRoot(lt)
+    # batch queries, vectorized with numpy
 
-        # Insert singleton v as rightmost element of left subtree
-        if lt:
-            ptr = left_T.getRoot()
-            while (ptr.right != None):
-                ptr = ptr.right
+    def view(self, column):
+        return numpy.frombuffer(column, dtype=numpy.intc)
+
+    def follow(self, links, x):
+        """
+        Where the chains of links starting at the ids in x end, as a numpy
+        array. Small batches climb one step per pass, O(height) passes over
+        the batch. Large ones jump pointers over the whole vector instead:
+        every id points one step along the chain, then at whatever its target
+        points at, doubling the distance each pass until nothing moves, so
+        O(log height) passes over n entries.
+        """
+        links = self.view(links)
+        if len(x) * 8 < len(links):
+            while True:
+                step = links[x]
+                moving = step >= 0
+                if not moving.any():
+                    return x
+                x = numpy.where(moving, step, x)
+        ends = numpy.where(links >= 0, links, numpy.arange(len(links), dtype=numpy.intc))
+        while True:
+            further = ends[ends]
+            if numpy.array_equal(further, ends):
+                return ends[x]
+            ends = further
 
-            ptr.right = AVL_tree.AVL_node(parent=ptr, represented=v)
-            ptr.balance -= 1
+    def find_root_many(self, vertices):
+        """
+        find_root for every vertex id in vertices at once, returned as a numpy
+        array. Equal roots mean the same component until the next link or cut.
+        """
+        if numpy is None:
+            raise ImportError("find_root_many needs numpy")
+        x = self.view(self.last)[numpy.asarray(vertices, dtype=numpy.intp)]
+        return self.view(self.represented)[self.follow(self.left, self.follow(self.parent, x))]
 
-            while (ptr.parent != None):
-                ptr = ptr.parent
-                ptr_left_height = ptr.left.height if ptr.left else -1
-                ptr_right_height = ptr.right.height if ptr.right else -1
-                ptr.height = 1 + max(ptr_left_height, ptr_right_height)
-                ptr.balance = ptr_left_height - ptr_right_height
+    def connected_many(self, us, vs):
+        """
+        connected for every pair (us[i], vs[i]) at once, returned as a numpy
+        array of booleans
+        """
+        if numpy is None:
+            raise ImportError("connected_many needs numpy")
+        first = self.view(self.first)
+        x = first[numpy.concatenate((numpy.asarray(us, dtype=numpy.intp), numpy.asarray(vs, dtype=numpy.intp)))]
+        roots = self.follow(self.parent, x)
+        return roots[:len(roots) // 2] == roots[len(roots) // 2:]
 
-            left_T.rebalance(left_T.getRoot())
+    def subtree_size(self, v):
+        """
+        Number of vertices in v's subtree, O(log n)
+        """
+        return (self.rank(self.last[v]) - self.rank(self.first[v]) + 2) // 2
 
-        right_T = AVL_tree()
-        right_T.setRoot(rt)
-        right_T.rebalance(right_T.getRoot())
+    def link(self, u, v):
+        """
+        Link u's tree as a child of v, rerooting it at u first if needed.
+        Raises ValueError if u and v are already in the same tree.
+        """
+        if self.connected(u, v):
+            raise ValueError("vertices %d and %d are already in the same tree" % (u, v))
+        if self.vertex_parent[u] >= 0:
+            self.reroot(u)
+        ut = self.avl_root(self.first[u])
+        lt, rt = self.split(self.last[v], False)
+        lt = self.concatenate(lt, ut)
+        x = self.new_occurrence(v)
+        self.last[v] = x
+        self.join(lt, x, rt)
+        self.vertex_parent[u] = v
 
-        u_subtree = AVL_tree()
-        u_subtree.setRoot(ut)
-        u_subtree.rebalance(u_subtree.getRoot())
+    def cut(self, v):
+        """
+        Cut v's subtree away from its parent. Raises ValueError if v is a root.
+        """
+        p = self.vertex_parent[v]
+        if p < 0:
+            raise ValueError("vertex %d is the root of its tree, there is nothing to cut" % v)
+        lt, rt = self.split(self.first[v], True)
+        _, rt2 = self.split(self.last[v], False)
+        lt, p_before = self.remove_max(lt)
+        rt2, p_after = self.remove_min(rt2)
+        if self.last[p] == p_after:
+            self.last[p] = p_before
+        self.release(p_after)
+        self.join(lt, p_before, rt2)
+        self.vertex_parent[v] = -1
 
-        if lt:
-            # concatenate left subtree with u subtree
-            self = left_T.concatenate(u_subtree)
-        else:
-            self = u_subtree
-            ptr = self.getRoot()
-            
-            while (ptr.left != None):
-                ptr = ptr.left
-            
-            ptr.left = AVL_tree.AVL_node(parent=ptr, represented=v)
-            ptr.balance += 1
+    def reroot(self, v):
+        """
+        Make v the root of its tree, see Euler_Tour_Tree.reroot
+        """
+        if self.vertex_parent[v] < 0:
+            return
+        path = [v]
+        while self.vertex_parent[path[-1]] >= 0:
+            path.append(self.vertex_parent[path[-1]])
+        r = path[-1]
+        r_first = self.first[r]
 
-            while (ptr.parent != None):
-                ptr = ptr.parent
-                # recompute heights and balances
-                ptr_left_height = ptr.left.height if ptr.left else -1
-                ptr_right_height = ptr.right.height if ptr.right else -1
-                ptr.height = 1 + max(ptr_left_height, ptr_right_height)
-                ptr.balance = ptr_left_height - ptr_right_height
-                
-            self.rebalance(self.getRoot())
-
-        # concatenate with right subtree
-        self = self.concatenate(right_T)
-        print("result: ", self)
+        moved = []
+        for i in range(1, len(path)):
+            c = path[i - 1]
+            first = self.successor(self.last[c])
+            last = self.predecessor(self.first[c])
+            if last == r_first:
+                last = self.last[r]
+            moved.append((path[i], first, last))
+        for w, first, last in moved:
+            self.first[w] = first
+            self.last[w] = last
+        x = self.new_occurrence(v)
+        self.last[v] = x
 
-        
-root = Euler_Tour_Tree.Represented_Node(1)
-euler = Euler_Tour_Tree(root)
+        lt, rt = self.split(self.first[v], True)
+        lt, _ = self.remove_min(lt)
+        self.release(r_first)
+        self.join(self.concatenate(rt, lt), x, -1)
+
+        for i in range(len(path) - 1, 0, -1):
+            self.vertex_parent[path[i - 1]] = -1
+            self.vertex_parent[path[i]] = path[i - 1]
+
+    def tour(self, v):
+        """
+        List of the vertices along the euler tour of v's tree
+        """
+        out = []
+        x = self.avl_root(self.first[v])
+        while self.left[x] >= 0:
+            x = self.left[x]
+        while x >= 0:
+            out.append(self.represented[x])
+            x = self.successor(x)
+        return out
+
+    def verify(self, v):
+        """
+        Check the AVL invariants and the tour of v's tree, returns the tour length
+        """
+        root = self.avl_root(self.first[v])
+        count = 0
+        stack = [root]
+        while stack:
+            x = stack.pop()
+            count += 1
+            for child in (self.left[x], self.right[x]):
+                if child >= 0:
+                    assert self.parent[child] == x, "broken parent pointer"
+                    stack.append(child)
+            size = self.size[x]
+            height = self.height[x]
+            self.update_node(x)
+            assert self.size[x] == size and self.height[x] == height, "stale node"
+            assert -1 <= self.balance(x) <= 1, "unbalanced node"
+        assert self.height[root] <= 1.4405 * math.log2(count + 2) - 0.3277, "height bound exceeded"
+
+        tour = []
+        x = root
+        while self.left[x] >= 0:
+            x = self.left[x]
+        while x >= 0:
+            tour.append(x)
+            x = self.successor(x)
+        r = self.represented[tour[0]]
+        assert self.vertex_parent[r] < 0, "root has a parent"
+        stack = [r]
+        seen = {r}
+        first = {r: tour[0]}
+        last = {r: tour[0]}
+        for x in tour[1:]:
+            vertex = self.represented[x]
+            last[vertex] = x
+            if len(stack) > 1 and vertex == stack[-2]:
+                stack.pop()
+                continue
+            assert vertex not in seen, "vertex entered twice"
+            assert self.vertex_parent[vertex] == stack[-1], "tour does not match represented tree"
+            seen.add(vertex)
+            first[vertex] = x
+            stack.append(vertex)
+        assert stack == [r], "tour does not return to the root"
+        for vertex in seen:
+            assert self.first[vertex] == first[vertex], "stale first"
+            assert self.last[vertex] == last[vertex], "stale last"
+        return count
 
-assert(1 == euler.root.find_root().val)
 
-print("Add 2 as a child of 1: ")
-node0 = Euler_Tour_Tree.Represented_Node(2)
-euler.link(node0, root)
 
-print("Add 3 as a child of 1: ")
-node1 = Euler_Tour_Tree.Represented_Node(3)
-euler.link(node1, root)
+class Log_Replay:
+    """
+    Streams an operation log through a Forest, one line at a time, and
+    keeps throughput and latency figures. Each line is an operation and its
+    vertex keys, separated by whitespace:
+        link u v        add the edge (u, v)
+        cut u v         remove the edge (u, v)
+        connected u v   query
+        find_root u     query
+        size u          query, the number of vertices in u's tree
+    Keys are taken as strings and vertices are added the first time a link
+    names them. A query on a key no link has named sees a vertex alone in
+    its tree, and a cut naming one is a cut of a missing edge. Blank lines
+    and lines starting with # are skipped. The stages
+    are generators, so the log is never held in memory.
+    An operation the forest rejects (linking two connected vertices,
+    cutting a missing edge) raises, or is counted and skipped if not strict.
+    """
+    ARITY = {"link": 2, "cut": 2, "connected": 2, "find_root": 1, "size": 1}
+
+    def __init__(self, forest=None, strict=False):
+        self.forest = forest if forest is not None else Forest()
+        self.strict = strict
+        self.histograms = {}    # op -> {bucket: count}, bucket b holding latencies under 2**b microseconds
+        self.totals = {}        # op -> [count, seconds]
+        self.rejected = 0
+        self.seconds = 0.0
+
+    @staticmethod
+    def read(path):
+        """
+        Lines of the file at path, - for stdin
+        """
+        if path == "-":
+            yield from sys.stdin
+            return
+        with open(path) as f:
+            yield from f
+
+    def parse(self, lines):
+        """
+        (line number, op, keys) for every operation in lines
+        """
+        for number, line in enumerate(lines, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            op = fields[0]
+            if self.ARITY.get(op) != len(fields) - 1:
+                raise ValueError("line %d: cannot read %r" % (number, line.rstrip("\n")))
+            yield number, op, fields[1:]
+
+    def apply(self, operations):
+        """
+        Run the operations, yielding (op, seconds) for each one applied
+        """
+        forest = self.forest
+        clock = time.perf_counter
+        for number, op, keys in operations:
+            if op == "link":
+                for key in keys:
+                    if key not in forest:
+                        forest.add_vertex(key)
+            start = clock()
+            try:
+                if op == "link":
+                    forest.link(*keys)
+                elif op == "cut":
+                    # an unknown key has no edges, so this is rejected like any missing edge
+                    forest.cut(*keys)
+                elif not all(key in forest for key in keys):
+                    # an unknown key is a vertex alone in its tree, nothing to look up
+                    pass
+                elif op == "connected":
+                    forest.connected(*keys)
+                elif op == "find_root":
+                    forest.find_root(*keys)
+                else:
+                    forest.component_size(*keys)
+            except ValueError as e:
+                if self.strict:
+                    raise ValueError("line %d: %s" % (number, e))
+                self.rejected += 1
+                continue
+            yield op, clock() - start
+
+    def record(self, timings):
+        for op, seconds in timings:
+            totals = self.totals.setdefault(op, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            self.seconds += seconds
+            histogram = self.histograms.setdefault(op, {})
+            bucket = int(seconds * 1e6).bit_length()
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def run(self, path):
+        """
+        Replay the log at path, returns the elapsed wall clock seconds
+        """
+        start = time.perf_counter()
+        self.record(self.apply(self.parse(self.read(path))))
+        return time.perf_counter() - start
+
+    def components(self):
+        """
+        (number of trees, vertices in the largest, number of edges) of the forest, O(n log n)
+        """
+        forest = self.forest
+        sizes = [forest.component_size(key) for key in forest.vertices if forest.find_root(key) == key]
+        edges = len(forest.vertices) - len(sizes)
+        return len(sizes), max(sizes, default=0), edges
+
+    def report(self, elapsed, out=None):
+        # looked up per call, so a redirected sys.stdout is honoured
+        out = out if out is not None else sys.stdout
+        applied = sum(count for count, _ in self.totals.values())
+        out.write("%d operations in %.3f s: %.0f ops/s overall, %.0f ops/s inside the forest\n"
+                  % (applied, elapsed, applied / elapsed if elapsed else 0.0,
+                     applied / self.seconds if self.seconds else 0.0))
+        if self.rejected:
+            out.write("rejected: %d\n" % self.rejected)
+        for op in sorted(self.totals):
+            count, seconds = self.totals[op]
+            out.write("%s: %d, mean %.2f us\n" % (op, count, seconds / count * 1e6))
+            histogram = self.histograms[op]
+            for bucket in range(min(histogram), max(histogram) + 1):
+                n = histogram.get(bucket, 0)
+                bar = "#" * (0 if not n else max(1, round(40 * n / count)))
+                out.write("  < %8d us %10d %s\n" % (2 ** bucket, n, bar))
+        trees, largest, edges = self.components()
+        out.write("%d vertices, %d edges, %d trees, largest %d vertices\n"
+                  % (len(self.forest), edges, trees, largest))
+
+
+def demo():
+    root = Euler_Tour_Tree.Represented_Node(1)
+    euler = Euler_Tour_Tree(root)
+
+    assert(1 == euler.root.find_root().val)
+
+    print("Add 2 as a child of 1: ")
+    node0 = Euler_Tour_Tree.Represented_Node(2)
+    euler.link(node0, root)
+
+    print("Add 3 as a child of 1: ")
+    node1 = Euler_Tour_Tree.Represented_Node(3)
+    euler.link(node1, root)
+
+    print("Add 4 as a child of 3: ")
+    node2 = Euler_Tour_Tree.Represented_Node(4)
+    euler.link(node2, node1)
+
+    print("Add 5 as a child of 1: ")
+    node3 = Euler_Tour_Tree.Represented_Node(5)
+    euler.link(node3, root)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a link/cut/query log through an euler tour tree forest, see Log_Replay.")
+    parser.add_argument("log", nargs="?", help="the log to replay, - for stdin; without one, run the demo")
+    parser.add_argument("--backend", choices=("avl", "splay", "treap", "persistent"), default="avl",
+                        help="sequence tree behind the tours (default: %(default)s)")
+    parser.add_argument("--strict", action="store_true", help="stop at the first operation the forest rejects")
+    args = parser.parse_args(argv)
+    if args.log is None:
+        demo()
+        return
+    backend = {"avl": AVL_tree, "splay": Splay_tree, "treap": Treap, "persistent": Persistent_AVL_tree}[args.backend]
+    replay = Log_Replay(Forest(backend=backend), args.strict)
+    try:
+        elapsed = replay.run(args.log)
+    except ValueError as e:
+        parser.exit(1, "%s\n" % e)
+    replay.report(elapsed)
 
-print("Add 4 as a child of 3: ")
-node2 = Euler_Tour_Tree.Represented_Node(4)
-euler.link(node2, node1)
 
-print("Add 5 as a child of 1: ")
-node3 = Euler_Tour_Tree.Represented_Node(5)
-euler.link(node3, root)
+if __name__ == "__main__":
+    main()
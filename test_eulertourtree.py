@@ -0,0 +1,939 @@
+"""
+Tests for the Euler tour tree.
+
+Run with:
+    python -m unittest test_eulertourtree
+"""
+import contextlib
+import gc
+import io
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from eulertourtree import (Aggregate, AVL_tree, Compact_Euler_Tour_Tree, Concurrent_Euler_Tour_Tree, Dynamic_Connectivity,
+                           Euler_Tour_Tree, Forest, Offline_Connectivity, Persistent_AVL_tree, Splay_tree, Treap, main)
+
+
+def random_forest(n, rng, roots=0.05):
+    return [None if i == 0 or rng.random() < roots else rng.randrange(i) for i in range(n)]
+
+
+def height(root):
+    """
+    Height of the tree under root, walked rather than read off stored fields
+    """
+    result = -1
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        if node:
+            result = max(result, depth)
+            stack.append((node.left, depth + 1))
+            stack.append((node.right, depth + 1))
+    return result
+
+
+def tags(vertex):
+    """
+    (node, lazy, agg) for every node of vertex's tour, to check a tree was left alone
+    """
+    stack = [vertex.find_avl_root()]
+    out = []
+    while stack:
+        node = stack.pop()
+        if node:
+            out.append((node, node.lazy, node.agg))
+            stack.extend((node.left, node.right))
+    return out
+
+
+class Link_Cut_Test(unittest.TestCase):
+    """
+    Random link, cut and reroot churn on every backend, checking each tree
+    with verify and its height against the backend's bound as it goes
+    """
+    BOUNDS = {
+        AVL_tree: lambda n: 1.4405 * math.log2(n + 2) - 0.3277,
+        Persistent_AVL_tree: lambda n: 1.4405 * math.log2(n + 2) - 0.3277,
+        # expected 2.99 ln n, well under this for a fixed seed
+        Treap: lambda n: 4 * math.log2(n + 2),
+        # splay trees have no height bound, only an amortized one on rotations
+        Splay_tree: None,
+    }
+
+    def churn(self, backend, n=400, steps=3000, check_every=50):
+        rng = random.Random(2)
+        euler, nodes = Euler_Tour_Tree.from_parent_array(random_forest(n, rng), backend=backend)
+        stats = euler.instrument()
+        bound = self.BOUNDS[backend]
+        operations = 0
+        for step in range(steps):
+            v = nodes[rng.randrange(n)]
+            w = nodes[rng.randrange(n)]
+            r = rng.random()
+            if r < 0.4 and v.get_parent():
+                euler.cut(v)
+            elif r < 0.8 and v.find_root() is not w.find_root():
+                euler.link(v, w)
+            elif r < 0.9:
+                euler.reroot(v)
+            else:
+                continue
+            operations += 1
+            if step % check_every:
+                continue
+            for x in nodes:
+                if not x.get_parent():
+                    count = euler.verify(x)
+                    if bound:
+                        self.assertLessEqual(height(euler.avl.root_of(x.first_ptr)), bound(count))
+        if not bound:
+            # splaying a node in a tree of k entries costs 3 log2 k + 1 rotations
+            # amortized, and each operation splays a handful of nodes
+            self.assertLessEqual(stats.rotations, operations * 4 * (3 * math.log2(2 * n) + 1))
+
+    def test_avl(self):
+        self.churn(AVL_tree)
+
+    def test_persistent_avl(self):
+        self.churn(Persistent_AVL_tree)
+
+    def test_treap(self):
+        self.churn(Treap)
+
+    def test_splay(self):
+        self.churn(Splay_tree)
+
+
+class Construction_Test(unittest.TestCase):
+    def test_builds_forest(self):
+        euler, nodes = Euler_Tour_Tree.from_edges(5, [(0, 1), (1, 2), (3, 4)])
+        self.assertIs(nodes[2].find_root(), nodes[0])
+        self.assertIs(nodes[4].find_root(), nodes[3])
+        euler.verify(nodes[0])
+        euler.verify(nodes[3])
+
+    def test_parent_array_rejects_non_forests(self):
+        for parents in ([None, 2, 1], [1, 0], [0], [None, 5], [None, 0, 2]):
+            with self.assertRaises(ValueError):
+                Euler_Tour_Tree.from_parent_array(parents)
+            with self.assertRaises(ValueError):
+                Compact_Euler_Tour_Tree.from_parent_array(parents)
+        euler, nodes = Euler_Tour_Tree.from_parent_array([None, 0, -1, 2])
+        euler.verify(nodes[0])
+        euler.verify(nodes[2])
+
+    def test_without_children_matches_containers(self):
+        for backend in BACKENDS:
+            rng = random.Random(9)
+            n = 80
+            parents = random_forest(n, rng, roots=0.1)
+            euler, nodes = Euler_Tour_Tree.from_parent_array(parents, backend=backend)
+            bare, bare_nodes = Euler_Tour_Tree.from_parent_array(parents, backend=backend, children=False)
+            for step in range(300):
+                i = rng.randrange(n)
+                j = rng.randrange(n)
+                r = rng.random()
+                if r < 0.3 and nodes[i].parent:
+                    euler.cut(nodes[i])
+                    bare.cut(bare_nodes[i])
+                elif r < 0.6 and not euler.avl.same_tree(nodes[i].first_ptr, nodes[j].first_ptr):
+                    euler.link(nodes[i], nodes[j])
+                    bare.link(bare_nodes[i], bare_nodes[j])
+                elif r < 0.9:
+                    euler.reroot(nodes[i])
+                    bare.reroot(bare_nodes[i])
+                else:
+                    cuts = [k for k in range(n) if nodes[k].parent and rng.random() < 0.1]
+                    euler.apply_batch([("cut", nodes[k]) for k in cuts])
+                    bare.apply_batch([("cut", bare_nodes[k]) for k in cuts])
+                for k in rng.sample(range(n), 10):
+                    self.assertIsNone(bare_nodes[k].children)
+                    self.assertEqual(sorted(c.val for c in bare_nodes[k].get_children()),
+                                     sorted(c.val for c in nodes[k].get_children()))
+                    self.assertEqual(bare_nodes[k].degree(), nodes[k].degree())
+                    self.assertEqual(nodes[k].degree(), len(nodes[k].children))
+            for v in bare_nodes:
+                if not v.parent:
+                    bare.verify(v)
+
+    def test_without_children_uses_less_memory(self):
+        parents = random_forest(5000, random.Random(1))
+        peaks = []
+        for children in (True, False):
+            tracemalloc.start()
+            built = Euler_Tour_Tree.from_parent_array(parents, children=children)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            del built
+        # no child dict is made along the way, not even an empty one
+        self.assertLess(peaks[1], peaks[0] * 0.85)
+
+    def test_rejects_non_forests(self):
+        for edges in ([(0, 1), (1, 2), (2, 0)], [(0, 1), (1, 1)], [(0, 1), (1, 0)], [(0, 1), (0, 1)]):
+            with self.assertRaises(ValueError):
+                Euler_Tour_Tree.from_edges(3, edges)
+
+
+def ancestors(v):
+    """
+    v and its ancestors, walking the parent pointers up to the root
+    """
+    path = [v]
+    while path[-1].parent:
+        path.append(path[-1].parent)
+    return path
+
+
+def churn(euler, nodes, rng):
+    """
+    One random link, cut, reroot or subtree_add
+    """
+    n = len(nodes)
+    v = nodes[rng.randrange(n)]
+    w = nodes[rng.randrange(n)]
+    r = rng.random()
+    if r < 0.3 and v.parent:
+        euler.cut(v)
+    elif r < 0.6 and not euler.avl.same_tree(v.first_ptr, w.first_ptr):
+        euler.link(v, w)
+    elif r < 0.8:
+        euler.reroot(v)
+    else:
+        euler.subtree_add(v, rng.randrange(-3, 4))
+
+
+class Tour_Query_Test(unittest.TestCase):
+    def test_depth_and_lca(self):
+        for backend in BACKENDS:
+            rng = random.Random(8)
+            n = 60
+            euler, nodes = Euler_Tour_Tree.from_parent_array(random_forest(n, rng, roots=0.1),
+                                                             aggregate=Aggregate.SUM, backend=backend)
+            for step in range(600):
+                churn(euler, nodes, rng)
+                for _ in range(3):
+                    u = nodes[rng.randrange(n)]
+                    v = nodes[rng.randrange(n)]
+                    self.assertEqual(euler.depth(u), len(ancestors(u)) - 1)
+                    above = set(ancestors(u))
+                    expected = next((w for w in ancestors(v) if w in above), None)
+                    self.assertIs(euler.lca(u, v), expected, (backend.__name__, step))
+            for v in nodes:
+                if not v.parent:
+                    euler.verify(v)
+
+            # lowest straight on the sequence tree, against prefix sums of the steps
+            avl = euler.avl
+            for _ in range(100):
+                tour = list(in_order(nodes[rng.randrange(n)].find_avl_root()))
+                prefix = []
+                total = 0
+                for node in tour:
+                    total += avl.step(node)
+                    prefix.append(total)
+                i = rng.randrange(len(tour))
+                j = rng.randrange(i, len(tour))
+                node, low = avl.lowest(tour[i], tour[j])
+                self.assertEqual(low, min(prefix[i:j + 1]))
+                self.assertIn(tour.index(node), [k for k in range(i, j + 1) if prefix[k] == low])
+
+
+    def test_tour_positions_and_is_ancestor(self):
+        for backend in BACKENDS:
+            rng = random.Random(12)
+            n = 50
+            euler, nodes = Euler_Tour_Tree.from_parent_array(random_forest(n, rng, roots=0.1), backend=backend)
+            for step in range(300):
+                churn(euler, nodes, rng)
+                u = nodes[rng.randrange(n)]
+                v = nodes[rng.randrange(n)]
+                # is_ancestor, also across two trees
+                self.assertEqual(euler.is_ancestor(u, v), u in ancestors(v), (backend.__name__, step))
+                self.assertEqual(euler.is_ancestor(v, u), v in ancestors(u), (backend.__name__, step))
+                tour = list(euler.iter_tour(v))
+                self.assertEqual(euler.tour_index(v.first_ptr), tour.index(v))
+                self.assertEqual(euler.tour_index(v.last_ptr), len(tour) - 1 - tour[::-1].index(v))
+                k = rng.randrange(len(tour))
+                self.assertIs(euler.tour_at(k, v).represented, tour[k])
+                self.assertEqual(euler.tour_index(euler.tour_at(k, v)), k)
+                for k in (-1, len(tour)):
+                    with self.assertRaises(IndexError):
+                        euler.tour_at(k, v)
+
+
+class Save_Test(unittest.TestCase):
+    def test_save_leaves_tags_pending(self):
+        parents = [None] + [(i - 1) // 2 for i in range(1, 32)]
+        euler, nodes = Euler_Tour_Tree.from_parent_array(parents, aggregate=Aggregate.SUM)
+        euler.subtree_add(nodes[1], 5)
+        euler.subtree_add(nodes[4], -3)
+        before = tags(nodes[0])
+        path = os.path.join(tempfile.mkdtemp(), "tree.ett")
+        euler.save(path)
+        self.assertEqual(tags(nodes[0]), before)
+        loaded, loaded_nodes = Euler_Tour_Tree.load(path, aggregate=Aggregate.SUM)
+        self.assertEqual(sorted(v.get_val() for v in loaded_nodes), sorted(v.get_val() for v in nodes))
+        self.assertEqual(loaded.subtree_aggregate(loaded.root), euler.subtree_aggregate(euler.root))
+        os.remove(path)
+
+    def test_columns_round_trip_without_pickle(self):
+        path = os.path.join(tempfile.mkdtemp(), "forest.ett")
+        for vals in ({"a": None, "b": "x", "c": 1.5, "d": True}, {"a": 1, "b": 2, "c": 3, "d": 4},
+                     {"a": 0.5, "b": 1.5, "c": 2.5, "d": 3.5}):
+            forest = Forest.from_edges("abcd", [("a", "b"), ("c", "d")], vals)
+            forest.save(path)
+            loaded = Forest.load(path)
+            self.assertEqual({key: node.get_val() for key, node in loaded.vertices.items()}, vals)
+            self.assertEqual(sorted(map(sorted, loaded.edges())), [["a", "b"], ["c", "d"]])
+        os.remove(path)
+        # a value with no plain encoding is refused before anything is written
+        forest = Forest.from_edges([1, 2], [(1, 2)], {1: object(), 2: 0})
+        with self.assertRaises(ValueError):
+            forest.save(path)
+        self.assertFalse(os.path.exists(path))
+
+
+def tours(nodes):
+    """
+    The tour of every tree, as vertex indices, for comparing two copies of a forest
+    """
+    index = {vertex: i for i, vertex in enumerate(nodes)}
+    out = set()
+    for vertex in nodes:
+        if not vertex.get_parent():
+            out.add(tuple(index[node.represented] for node in in_order(vertex.find_avl_root())))
+    return out
+
+
+def in_order(root):
+    stack = []
+    node = root
+    while stack or node:
+        while node:
+            stack.append(node)
+            node = node.left
+        node = stack.pop()
+        yield node
+        node = node.right
+
+
+BACKENDS = (AVL_tree, Splay_tree, Treap, Persistent_AVL_tree)
+
+
+class Batch_Test(unittest.TestCase):
+    def test_matches_one_at_a_time(self):
+        for backend in BACKENDS:
+            rng = random.Random(11)
+            for trial in range(30):
+                n = rng.randrange(2, 60)
+                parents = random_forest(n, rng, roots=0.1)
+                euler, nodes = Euler_Tour_Tree.from_parent_array(parents, aggregate=Aggregate.SUM, backend=backend)
+                batched, batched_nodes = Euler_Tour_Tree.from_parent_array(parents, aggregate=Aggregate.SUM,
+                                                                           backend=backend)
+                # the ops are drawn against the one at a time copy as it goes
+                ops = []
+                for _ in range(rng.randrange(1, 80)):
+                    v = rng.randrange(n)
+                    w = rng.randrange(n)
+                    if rng.random() < 0.5 and nodes[v].parent:
+                        euler.cut(nodes[v])
+                        ops.append(("cut", v))
+                    elif not euler.avl.same_tree(nodes[v].first_ptr, nodes[w].first_ptr):
+                        euler.link(nodes[v], nodes[w])
+                        ops.append(("link", v, w))
+                self.assertEqual(batched.apply_batch([(op[0],) + tuple(batched_nodes[x] for x in op[1:]) for op in ops]),
+                                 len(ops))
+                self.assertEqual(tours(batched_nodes), tours(nodes))
+                for v, w in zip(batched_nodes, nodes):
+                    if not v.parent:
+                        batched.verify(v)
+                    self.assertEqual(batched.subtree_aggregate(v), euler.subtree_aggregate(w))
+
+    def test_cut_root_raises(self):
+        euler, nodes = Euler_Tour_Tree.from_parent_array([None, 0, 1, 0])
+        with self.assertRaises(ValueError):
+            euler.apply_batch([("cut", nodes[1]), ("cut", nodes[0])])
+        # the cut before the bad one went through
+        self.assertIsNone(nodes[1].parent)
+        euler.verify(nodes[0])
+        euler.verify(nodes[1])
+        self.assertEqual([vertex.val for vertex in euler.iter_tour(nodes[0])], [0, 3, 0])
+
+    def test_unknown_operation_raises(self):
+        euler, nodes = Euler_Tour_Tree.from_parent_array([None, 0, 1, 0])
+        with self.assertRaises(ValueError):
+            euler.apply_batch([("cut", nodes[2]), ("bogus",)])
+        self.assertIsNone(nodes[2].parent)
+        euler.verify(nodes[0])
+        euler.verify(nodes[2])
+        self.assertEqual([vertex.val for vertex in euler.iter_tour(nodes[0])], [0, 1, 0, 3, 0])
+
+    def test_cut_releases_fresh_node(self):
+        euler, nodes = Euler_Tour_Tree.from_parent_array([None, 0, None, 2])
+        stats = euler.instrument()
+        # the cut drops the entry for 1 that the first link made, and the second link takes it back
+        euler.apply_batch([("link", nodes[2], nodes[1]), ("cut", nodes[2]), ("link", nodes[2], nodes[0])])
+        self.assertEqual((stats.allocations, stats.reuses), (1, 1))
+        euler.verify(nodes[0])
+        self.assertEqual([vertex.val for vertex in euler.iter_tour(nodes[0])], [0, 1, 0, 2, 3, 2, 0])
+
+
+def components(adjacency):
+    """
+    key -> set of the keys in its component, by BFS over a dict of neighbour sets
+    """
+    component = {}
+    for start in adjacency:
+        if start in component:
+            continue
+        seen = {start}
+        queue = [start]
+        for u in queue:
+            for v in adjacency[u]:
+                if v not in seen:
+                    seen.add(v)
+                    queue.append(v)
+        for u in seen:
+            component[u] = seen
+    return component
+
+
+class Forest_Test(unittest.TestCase):
+    def check(self, forest, adjacency, vals):
+        component = components(adjacency)
+        for u in adjacency:
+            self.assertEqual(forest.component_size(u), len(component[u]))
+            self.assertEqual(forest.component_aggregate(u), sum(vals[v] for v in component[u]))
+            # every tour starts at a vertex entry
+            self.assertIn(forest.find_root(u), component[u])
+            for v in adjacency[u]:
+                self.assertTrue(forest.has_edge(u, v))
+        self.assertEqual(sorted(map(sorted, forest.edges())),
+                         sorted(sorted((u, v)) for u in adjacency for v in adjacency[u] if u < v))
+        # one vertex per component, root_of may restructure a splay tree
+        for u in set(min(members) for members in component.values()):
+            count = forest.avl.verify(forest.avl.root_of(forest.vertices[u].first_ptr))
+            self.assertEqual(count, 3 * len(component[u]) - 2)
+
+    def test_matches_adjacency_sets(self):
+        for backend in BACKENDS:
+            rng = random.Random(6)
+            n = 50
+            keys = ["v%d" % i for i in range(n)]
+            forest = Forest(Aggregate.SUM, backend)
+            adjacency = {key: set() for key in keys}
+            vals = {}
+            for key in keys:
+                vals[key] = rng.randrange(100)
+                forest.add_vertex(key, vals[key])
+            edges = []
+            for step in range(1500):
+                u = rng.choice(keys)
+                v = rng.choice(keys)
+                r = rng.random()
+                if r < 0.35 and edges:
+                    u, v = edges.pop(rng.randrange(len(edges)))
+                    # either arc order, and the side that comes away can start anywhere in its tour
+                    forest.cut(*rng.choice(((u, v), (v, u))))
+                    adjacency[u].discard(v)
+                    adjacency[v].discard(u)
+                elif r < 0.75:
+                    connected = v in components(adjacency)[u]
+                    self.assertEqual(forest.connected(u, v), connected)
+                    if connected:
+                        with self.assertRaises(ValueError):
+                            forest.link(u, v)
+                    else:
+                        forest.link(u, v)
+                        adjacency[u].add(v)
+                        adjacency[v].add(u)
+                        edges.append((u, v))
+                elif r < 0.85:
+                    forest.reroot(u)
+                    self.assertEqual(forest.find_root(u), u)
+                elif r < 0.9:
+                    vals[u] = rng.randrange(100)
+                    forest.set_val(u, vals[u])
+                else:
+                    with self.assertRaises(ValueError):
+                        forest.cut(u, u)
+                if step % 50 == 0:
+                    self.check(forest, adjacency, vals)
+            self.check(forest, adjacency, vals)
+
+            path = os.path.join(tempfile.mkdtemp(), "forest.ett")
+            forest.save(path)
+            loaded = Forest.load(path, Aggregate.SUM, backend)
+            os.remove(path)
+            self.assertEqual(set(loaded.vertices), set(keys))
+            self.check(loaded, adjacency, vals)
+
+    def test_from_edges(self):
+        forest = Forest.from_edges("abcde", [("a", "b"), ("b", "c"), ("d", "e")], {key: 1 for key in "abcde"},
+                                   Aggregate.SUM)
+        self.assertEqual(forest.component_size("a"), 3)
+        self.assertEqual(forest.component_aggregate("e"), 2)
+        self.assertTrue(forest.connected("a", "c"))
+        self.assertFalse(forest.connected("a", "d"))
+        forest.cut("a", "b")
+        self.assertEqual(forest.component_size("c"), 2)
+        for edges in ([("a", "b"), ("b", "c"), ("c", "a")], [("a", "b"), ("a", "b")], [("a", "b"), ("b", "a")]):
+            with self.assertRaises(ValueError):
+                Forest.from_edges("abc", edges)
+
+
+class Dynamic_Connectivity_Test(unittest.TestCase):
+    def test_matches_bfs(self):
+        for backend in (AVL_tree, Treap, Splay_tree):
+            rng = random.Random(4)
+            n = 40
+            graph = Dynamic_Connectivity(backend)
+            adjacency = {u: set() for u in range(n)}
+            for u in range(n):
+                graph.add_vertex(u)
+            edges = []
+            for step in range(1500):
+                # keep the graph hovering around n edges, so components keep splitting and merging
+                if edges and rng.random() < len(edges) / (2.0 * n):
+                    u, v = edges.pop(rng.randrange(len(edges)))
+                    graph.delete_edge(*rng.choice(((u, v), (v, u))))
+                    adjacency[u].discard(v)
+                    adjacency[v].discard(u)
+                else:
+                    u = rng.randrange(n)
+                    v = rng.randrange(n)
+                    if u == v or v in adjacency[u]:
+                        continue
+                    graph.insert_edge(u, v)
+                    adjacency[u].add(v)
+                    adjacency[v].add(u)
+                    edges.append((u, v))
+                component = components(adjacency)
+                for _ in range(5):
+                    u = rng.randrange(n)
+                    v = rng.randrange(n)
+                    self.assertEqual(graph.connected(u, v), v in component[u], (backend.__name__, step))
+                    self.assertEqual(graph.component_size(u), len(component[u]), (backend.__name__, step))
+            self.assertLessEqual(len(graph.forests), math.log2(n) + 1)
+            for u, v in edges:
+                self.assertTrue(graph.has_edge(u, v) and graph.has_edge(v, u))
+
+    def test_errors(self):
+        graph = Dynamic_Connectivity()
+        graph.insert_edge("a", "b")
+        for u, v in (("a", "b"), ("b", "a"), ("a", "a")):
+            with self.assertRaises(ValueError):
+                graph.insert_edge(u, v)
+        with self.assertRaises(ValueError):
+            graph.delete_edge("a", "c")
+        graph.delete_edge("b", "a")
+        self.assertFalse(graph.connected("a", "b"))
+        with self.assertRaises(ValueError):
+            graph.delete_edge("a", "b")
+
+
+class Snapshot_Test(unittest.TestCase):
+    def test_snapshots_keep_their_state(self):
+        rng = random.Random(3)
+        for trial in range(20):
+            n = rng.randrange(2, 40)
+            vals = [rng.randrange(10) for _ in range(n)]
+            euler, nodes = Euler_Tour_Tree.from_parent_array(random_forest(n, rng, roots=0), vals=vals,
+                                                             aggregate=Aggregate.SUM, backend=Persistent_AVL_tree)
+
+            def state():
+                return {v: (v.find_root(), euler.subtree_size(v), v.get_val(), v.parent, list(euler.iter_tour(v)))
+                        for v in nodes}
+
+            snapshots = []
+            newcomers = []
+            for step in range(150):
+                r = rng.random()
+                v = nodes[rng.randrange(n)]
+                if r < 0.1:
+                    snapshots.append((euler.snapshot(), state()))
+                elif r < 0.15 and snapshots:
+                    snapshots.pop(rng.randrange(len(snapshots)))
+                elif r < 0.35 and v.parent:
+                    euler.cut(v)
+                elif r < 0.55:
+                    w = nodes[rng.randrange(n)]
+                    if v.find_root() is not w.find_root():
+                        euler.link(v, w)
+                elif r < 0.65:
+                    euler.reroot(v)
+                elif r < 0.75:
+                    euler.subtree_add(v, rng.randrange(-5, 5))
+                elif r < 0.8:
+                    euler.set_val(v, rng.randrange(10))
+                elif r < 0.85:
+                    # a vertex linked in after a snapshot is not part of it
+                    x = Euler_Tour_Tree.Represented_Node(99)
+                    euler.link(x, v)
+                    newcomers.append((x, [snapshot for snapshot, _ in snapshots]))
+                else:
+                    for snapshot, expected in snapshots:
+                        for u, (root, size, val, parent, tour) in expected.items():
+                            self.assertIs(snapshot.find_root(u), root)
+                            self.assertEqual(snapshot.subtree_size(u), size)
+                            self.assertEqual(snapshot.get_val(u), val)
+                            self.assertIs(snapshot.parent(u), parent)
+                            self.assertEqual(snapshot.tour(u), tour)
+                    for x, older in newcomers:
+                        for snapshot in older:
+                            with self.assertRaises(KeyError):
+                                snapshot.find_root(x)
+            for v in nodes:
+                if not v.parent:
+                    euler.verify(v)
+
+            # the saved states go with the last snapshot
+            versions = euler.avl.versions
+            snapshots = newcomers = snapshot = older = None
+            gc.collect()
+            self.assertEqual(versions.live, [])
+            self.assertFalse(versions.saved)
+            self.assertFalse(versions.vertex_history)
+
+    def test_needs_persistent_backend(self):
+        euler, _ = Euler_Tour_Tree.from_parent_array([None, 0])
+        with self.assertRaises(ValueError):
+            euler.snapshot()
+
+
+def graph_log(n, ops, rng, forest):
+    """
+    A random log of links, cuts and connected queries on n vertices, about
+    half of it queries. With forest, links only join different trees;
+    otherwise they can close cycles.
+    """
+    adjacency = {u: set() for u in range(n)}
+    edges = []
+    log = []
+    for _ in range(ops):
+        r = rng.random()
+        u = rng.randrange(n)
+        v = rng.randrange(n)
+        if r < 0.3 and u != v and v not in adjacency[u] and not (forest and v in components(adjacency)[u]):
+            adjacency[u].add(v)
+            adjacency[v].add(u)
+            edges.append((u, v))
+            log.append(("link", u, v))
+        elif r < 0.5 and edges:
+            u, v = edges.pop(rng.randrange(len(edges)))
+            adjacency[u].discard(v)
+            adjacency[v].discard(u)
+            log.append(rng.choice((("cut", u, v), ("cut", v, u))))
+        else:
+            log.append(("connected", u, v))
+    return log
+
+
+class Offline_Connectivity_Test(unittest.TestCase):
+    def test_matches_forest(self):
+        log = graph_log(60, 3000, random.Random(1), forest=True)
+        forest = Forest()
+        online = []
+        for op, u, v in log:
+            for key in (u, v):
+                if key not in forest:
+                    forest.add_vertex(key)
+            if op == "link":
+                forest.link(u, v)
+            elif op == "cut":
+                forest.cut(u, v)
+            else:
+                online.append(forest.connected(u, v))
+        self.assertEqual(Offline_Connectivity(log).answers(), online)
+
+    def test_matches_dynamic_connectivity_with_cycles(self):
+        log = graph_log(40, 3000, random.Random(2), forest=False)
+        graph = Dynamic_Connectivity()
+        online = []
+        for op, u, v in log:
+            for key in (u, v):
+                if key not in graph:
+                    graph.add_vertex(key)
+            if op == "link":
+                graph.insert_edge(u, v)
+            elif op == "cut":
+                graph.delete_edge(u, v)
+            else:
+                online.append(graph.connected(u, v))
+        self.assertEqual(Offline_Connectivity(log).answers(), online)
+        self.assertIn(True, online)
+        self.assertIn(False, online)
+
+    def test_errors(self):
+        for log in ([("link", 1, 2), ("link", 1, 2)],
+                    [("link", 1, 2), ("link", 2, 1)],
+                    [("cut", 1, 2)],
+                    [("link", 1, 2), ("cut", 1, 2), ("cut", 2, 1)],
+                    [("merge", 1, 2)]):
+            with self.assertRaises(ValueError):
+                Offline_Connectivity(log).answers()
+        self.assertEqual(Offline_Connectivity([]).answers(), [])
+        self.assertEqual(Offline_Connectivity([("connected", 1, 1), ("connected", 1, 2)]).answers(), [True, False])
+
+
+class Log_Replay_Test(unittest.TestCase):
+    LOG = """# a small log
+link a b
+link b c
+connected a c
+cut x y
+connected a z
+find_root q
+size q
+link a c
+
+cut b c
+size a
+"""
+
+    def replay(self, *args):
+        path = os.path.join(tempfile.mkdtemp(), "ops.log")
+        with open(path, "w") as f:
+            f.write(self.LOG)
+        out = io.StringIO()
+        err = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                main([path] + list(args))
+        finally:
+            os.remove(path)
+        return out.getvalue(), err.getvalue()
+
+    def test_report(self):
+        for backend in ("avl", "splay", "treap", "persistent"):
+            out, _ = self.replay("--backend", backend)
+            # the cut of x y and the second link of a c are rejected, and neither adds a vertex
+            self.assertIn("8 operations in", out)
+            self.assertIn("rejected: 2\n", out)
+            self.assertIn("connected: 2,", out)
+            self.assertIn("size: 2,", out)
+            self.assertTrue(out.endswith("3 vertices, 1 edges, 2 trees, largest 2 vertices\n"), out)
+
+    def test_strict_exit_code(self):
+        with self.assertRaises(SystemExit) as raised:
+            self.replay("--strict")
+        self.assertEqual(raised.exception.code, 1)
+
+
+class Compact_Euler_Tour_Tree_Test(unittest.TestCase):
+    def test_matches_objects(self):
+        rng = random.Random(7)
+        n = 300
+        parents = random_forest(n, rng)
+        compact = Compact_Euler_Tour_Tree.from_parent_array(parents)
+        euler, nodes = Euler_Tour_Tree.from_parent_array(parents)
+        for _ in range(2000):
+            v = rng.randrange(n)
+            w = rng.randrange(n)
+            r = rng.random()
+            if r < 0.4 and compact.vertex_parent[v] >= 0:
+                compact.cut(v)
+                euler.cut(nodes[v])
+            elif r < 0.8 and compact.find_root(v) != compact.find_root(w):
+                compact.link(v, w)
+                euler.link(nodes[v], nodes[w])
+            elif r < 0.9:
+                compact.reroot(v)
+                euler.reroot(nodes[v])
+            self.assertEqual(compact.find_root(v), nodes[v].find_root().val)
+            self.assertEqual(compact.connected(v, w), euler.avl.same_tree(nodes[v].first_ptr, nodes[w].first_ptr))
+            self.assertEqual(compact.subtree_size(v), euler.subtree_size(nodes[v]))
+        for v in range(n):
+            if compact.vertex_parent[v] < 0:
+                compact.verify(v)
+                self.assertEqual(compact.tour(v), [vertex.val for vertex in euler.iter_tour(nodes[v])])
+
+    @unittest.skipIf(numpy is None, "needs numpy")
+    def test_batch_queries(self):
+        rng = random.Random(5)
+        n = 400
+        tree = Compact_Euler_Tour_Tree.from_parent_array(random_forest(n, rng))
+        for step in range(600):
+            v = rng.randrange(n)
+            w = rng.randrange(n)
+            if rng.random() < 0.5 and tree.vertex_parent[v] >= 0:
+                tree.cut(v)
+            elif not tree.connected(v, w):
+                tree.link(v, w)
+            if step % 100:
+                continue
+            # a handful of ids climbs step by step, the whole forest jumps pointers
+            for k in (5, 2 * n):
+                vertices = [rng.randrange(n) for _ in range(k)]
+                others = [rng.randrange(n) for _ in range(k)]
+                self.assertEqual(list(tree.find_root_many(vertices)), [tree.find_root(v) for v in vertices])
+                self.assertEqual(list(tree.connected_many(vertices, others)),
+                                 [tree.connected(u, v) for u, v in zip(vertices, others)])
+                # both paths of follow on the same ids
+                x = numpy.asarray([tree.first[v] for v in vertices], dtype=numpy.intp)
+                climbed = [tree.avl_root(tree.first[v]) for v in vertices]
+                self.assertEqual(list(tree.follow(tree.parent, x)), climbed)
+
+    def test_bytes_per_vertex(self):
+        n = 10000
+        parents = random_forest(n, random.Random(1))
+        compact = Compact_Euler_Tour_Tree.from_parent_array(parents)
+        per_vertex = compact.memory_usage() / n
+        tracemalloc.start()
+        euler = Euler_Tour_Tree.from_parent_array(parents)
+        objects_per_vertex = tracemalloc.get_traced_memory()[0] / n
+        tracemalloc.stop()
+        print("\nbytes/vertex: compact %.1f, objects %.1f" % (per_vertex, objects_per_vertex))
+        # two entries per vertex, 4-byte ids in five id arrays plus the free list and heights
+        self.assertLessEqual(per_vertex, 64)
+        self.assertLess(per_vertex * 4, objects_per_vertex)
+
+    def test_cut_root_raises(self):
+        tree = Compact_Euler_Tour_Tree.from_parent_array([None, 0, 0, None])
+        free = list(tree.free)
+        for v in (0, 3):
+            with self.assertRaises(ValueError):
+                tree.cut(v)
+        # nothing was released, in particular no -1 id onto the free list
+        self.assertEqual(list(tree.free), free)
+        tree.cut(1)
+        tree.link(1, 3)
+        self.assertEqual(tree.find_root(1), 3)
+        self.assertEqual(tree.find_root(2), 0)
+        tree.verify(0)
+        tree.verify(3)
+
+    def test_link_same_tree_raises(self):
+        tree = Compact_Euler_Tour_Tree.from_parent_array([None, 0, 1])
+        for u, v in ((0, 1), (1, 2), (2, 0), (1, 1)):
+            with self.assertRaises(ValueError):
+                tree.link(u, v)
+        tree.verify(0)
+        self.assertEqual(tree.tour(0), [0, 1, 2, 1, 0])
+
+    def test_object_link_same_tree_raises(self):
+        euler, nodes = Euler_Tour_Tree.from_parent_array([None, 0, 1])
+        for u, v in ((1, 2), (2, 0), (0, 1), (1, 1)):
+            with self.assertRaises(ValueError):
+                euler.link(nodes[u], nodes[v])
+        euler.verify(nodes[0])
+        self.assertEqual([vertex.val for vertex in euler.iter_tour(nodes[0])], [0, 1, 2, 1, 0])
+
+    def test_object_cut_root_raises(self):
+        euler, nodes = Euler_Tour_Tree.from_parent_array([None, 0])
+        with self.assertRaises(ValueError):
+            euler.cut(nodes[0])
+        euler.verify(nodes[0])
+
+
+class Concurrent_Euler_Tour_Tree_Test(unittest.TestCase):
+    def stress(self, read, aggregate=None, seconds=1.0):
+        """
+        One writer moves random subtrees around a forest, and adds to them
+        when there is an aggregate, while 6 reader threads call read(euler, v)
+        on random vertices v under the shared lock of v's tree. Whatever a
+        thread raises is raised again here.
+        """
+        rng = random.Random(0)
+        n = 1000
+        parents = [None if i < 8 else rng.randrange(i) for i in range(n)]
+        euler, nodes = Euler_Tour_Tree.from_parent_array(parents, aggregate=aggregate)
+        shared = Concurrent_Euler_Tour_Tree(euler)
+        stop = threading.Event()
+        counts = {"reads": 0, "writes": 0}
+        errors = []
+        lock = threading.Lock()
+
+        def reader(seed):
+            rng = random.Random(seed)
+            reads = 0
+            try:
+                while not stop.is_set():
+                    v = nodes[rng.randrange(n)]
+                    with shared.reading(v):
+                        read(euler, v)
+                    reads += 1
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+            with lock:
+                counts["reads"] += reads
+
+        def writer():
+            try:
+                while not stop.is_set():
+                    v = nodes[rng.randrange(n)]
+                    w = nodes[rng.randrange(n)]
+                    r = rng.random()
+                    if aggregate and r < 0.2:
+                        shared.subtree_add(v, rng.randrange(-5, 6))
+                    elif v.get_parent() and r < 0.6:
+                        shared.cut(v)
+                    elif not shared.connected(v, w):
+                        shared.link(v, w)
+                    counts["writes"] += 1
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(1, 7)]
+        threads.append(threading.Thread(target=writer))
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        self.assertGreater(counts["reads"], 0)
+        self.assertGreater(counts["writes"], 0)
+
+    def test_readers_never_see_a_torn_tour(self):
+        # verify checks the whole tour against the represented tree
+        self.stress(lambda euler, v: euler.verify(v))
+
+    def test_subtree_aggregate_under_shared_lock(self):
+        def read(euler, v):
+            total = sum(vertex.get_val() for vertex in set(euler.iter_subtree(v)))
+            self.assertEqual(euler.subtree_aggregate(v), total)
+
+        self.stress(read, aggregate=Aggregate.SUM)
+
+    def test_cut_root_raises(self):
+        euler, nodes = Euler_Tour_Tree.from_parent_array([None, 0])
+        shared = Concurrent_Euler_Tour_Tree(euler)
+        with self.assertRaises(ValueError):
+            shared.cut(nodes[0])
+        # no lock was left held
+        shared.cut(nodes[1])
+        self.assertFalse(shared.connected(nodes[0], nodes[1]))
+        euler.verify(nodes[0])
+
+    def test_subtree_aggregate_does_not_push(self):
+        parents = [None] + [(i - 1) // 2 for i in range(1, 64)]
+        euler, nodes = Euler_Tour_Tree.from_parent_array(parents, aggregate=Aggregate.SUM)
+        euler.subtree_add(nodes[1], 3)
+        euler.subtree_add(nodes[5], -2)
+        before = tags(nodes[0])
+        for v in nodes:
+            total = sum(vertex.get_val() for vertex in set(euler.iter_subtree(v)))
+            self.assertEqual(euler.subtree_aggregate(v), total)
+        # every pending tag is still where it was, so readers can share the fold
+        self.assertEqual(tags(nodes[0]), before)
+
+
+if __name__ == "__main__":
+    unittest.main()